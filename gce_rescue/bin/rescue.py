@@ -16,62 +16,194 @@
 
 """ Main script to be used to set/reset rescue mode. """
 
+import atexit
 from datetime import datetime
 import logging
+import sys
 
-from gce_rescue.config import process_args, set_configs
-from gce_rescue import messages
+from gce_rescue.config import config, get_config, process_args, set_configs
+from gce_rescue import messages, tracing
+from gce_rescue.fleet import Fleet, parse_targets
 from gce_rescue.gce import Instance
-from gce_rescue.tasks.actions import call_tasks
-from gce_rescue.utils import read_input, set_logging
+from gce_rescue.journal import Journal
+from gce_rescue.tasks.actions import call_tasks, plan
+from gce_rescue.tasks.pool import fill_pool
+from gce_rescue.tasks.pre_validations import Validations
+from gce_rescue.tasks.scheduler import OptionalTaskFailed
+from gce_rescue.timings import format_duration
+from gce_rescue.tasks.validations.authorization import authorize_check
+from gce_rescue.tasks.validations.authentication import (
+  compute_service,
+  project_name
+)
+from gce_rescue.utils import ProgressRenderer, read_input, set_logging
+
+
+def rescue_fleet(args, targets) -> None:
+  """ Set/Reset rescue mode of several instances at the same time. """
+  set_logging(vm_name='gce-rescue-fleet')
+  # Independent reads of the workers are sent together as batch requests.
+  config['batch-requests'] = True
+
+  # Authenticate and authorize only once, all instances share the client.
+  zone, name = targets[0]
+  check = Validations(zone=zone, name=name, project=args.project,
+                      test_mode=False)
+  compute = check.compute
+  fleet = Fleet(targets, project=check.adc_project, compute=compute)
+  fleet.discover()
+  if args.plan:
+    print(messages.tip_fleet_plan([
+      (vm, fleet.results[(vm.zone, vm.name)].action,
+       plan(vm, fleet.results[(vm.zone, vm.name)].action))
+      for vm in fleet.instances]))
+    return
+  fleet.authorize()
+
+  if not args.force:
+    info = (f'From {len(targets)} instances, '
+            f'{fleet.count("set_rescue_mode")} will boot in RESCUE MODE and '
+            f'{fleet.count("reset_rescue_mode")} will be restored to the '
+            'original configuration.\nRunning instances will be rebooted. '
+            '\nDo you want to continue [y/N]: ')
+    read_input(msg=info)
+
+  print(f'Processing {len(fleet.instances)} instances...')
+  results = fleet.run(renderer=ProgressRenderer())
+  print(messages.tip_fleet_summary(results))
+  if not all(result.ok for result in results):
+    sys.exit(1)
+
+
+def fill_warm_pool(args) -> None:
+  """ Create the missing rescue disks of the warm pool in args.zone. """
+  set_logging(vm_name=f'gce-rescue-pool-{args.zone}')
+  compute = compute_service(project=args.project)
+  source_disks = get_config('source_guests')[args.arch]
+  print(f'Filling the warm pool of {args.zone} with {args.fill_warm_pool} '
+        f'disks of {len(source_disks)} images...')
+  created = fill_pool(compute, project_name(), args.zone, source_disks,
+                      size=args.fill_warm_pool)
+  print(messages.tip_warm_pool(args.zone, created))
+
+
+def check_permissions(vm: Instance, action: str) -> None:
+  """ Exit before any change if permissions of action are missing. """
+  try:
+    authorize_check(vm, action)
+  except PermissionError as e:
+    print(f'└── {e}', file=sys.stderr)
+    sys.exit(1)
+
+
+def predicted(vm: Instance, action: str) -> str:
+  estimate = plan(vm, action)
+  return (f'\nIt should take {format_duration(estimate["p50"])}, up to '
+          f'{format_duration(estimate["p90"])}.')
+
+
+def write_trace(file_name: str) -> None:
+  """ Save the spans recorded during the execution. """
+  tracing.write(file_name)
+  print(f'Trace saved to {file_name}.')
+
 
 def main():
   """ Main script function. """
   parser = process_args()
   args = parser.parse_args()
   set_configs(args)
-
-  set_logging(vm_name=args.name)
+  if args.trace:
+    tracing.enable()
+    # Also written when the execution fails or exits early.
+    atexit.register(write_trace, args.trace)
+
+  if args.fill_warm_pool is not None:
+    if not args.zone:
+      parser.error('--fill-warm-pool requires --zone.')
+    fill_warm_pool(args)
+    return
+
+  try:
+    targets = parse_targets(args.name, args.file, args.zone)
+  except (ValueError, OSError) as e:
+    parser.error(str(e))
+  if not targets:
+    parser.error('at least one instance is required, use --name or --file.')
+
+  if args.file or len(targets) > 1:
+    rescue_fleet(args, targets)
+    return
+
+  zone, name = targets[0]
+  set_logging(vm_name=name)
 
   parse_kwargs = {
-      'zone': args.zone,
-      'name': args.name,
+      'zone': zone,
+      'name': name,
   }
 
   if args.project:
     parse_kwargs['project'] = args.project
 
   vm = Instance(test_mode=False, **parse_kwargs)
+  if not args.resume:
+    interrupted = Journal.load(vm.project, vm.zone, vm.name)
+    if interrupted:
+      print(messages.tip_resume(vm, interrupted.file_name), file=sys.stderr)
+      sys.exit(1)
   rescue_on = vm.rescue_mode_status['rescue-mode']
+  if args.plan:
+    action = 'reset_rescue_mode' if rescue_on else 'set_rescue_mode'
+    print(messages.tip_plan(vm, action, plan(vm, action)))
+    return
   if not rescue_on:
+    check_permissions(vm, 'set_rescue_mode')
     if not args.force:
-      info = (f'This option will boot the instance {vm.name} in '
-              'RESCUE MODE. \nIf your instance is running it will be rebooted. '
-              '\nDo you want to continue [y/N]: ')
+      if vm.helper_vm:
+        info = (f'This option will stop the instance {vm.name} and attach '
+                f'its boot disk to {vm.helper_vm}. '
+                f'{predicted(vm, "set_rescue_mode")}'
+                '\nDo you want to continue [y/N]: ')
+      else:
+        info = (f'This option will boot the instance {vm.name} in '
+                'RESCUE MODE. \nIf your instance is running it will be '
+                f'rebooted. {predicted(vm, "set_rescue_mode")}'
+                '\nDo you want to continue [y/N]: ')
       read_input(msg=info)
 
     print('Starting...')
     # save in the log file current configuration of the VM as backup.
     logging.info('RESTORE#%s\n', vm.data)
     action = 'set_rescue_mode'
-    msg = messages.tip_connect_ssh(vm)
+    if vm.helper_vm:
+      msg = messages.tip_helper_vm(vm)
+    else:
+      msg = messages.tip_connect_ssh(vm)
 
   else:
     rescue_ts = vm.rescue_mode_status['ts']
     rescue_date = datetime.fromtimestamp(int(rescue_ts))
+    check_permissions(vm, 'reset_rescue_mode')
 
     if not args.force:
       info = (f'The instance \"{vm.name}\" is currently configured '
-              f'to boot as rescue mode since {rescue_date}.\nWould you like to'
+              f'to boot as rescue mode since {rescue_date}.'
+              f'{predicted(vm, "reset_rescue_mode")}\nWould you like to'
               ' restore the original configuration ? [y/N]: ')
       read_input(msg=info)
 
     print('Restoring VM...')
     action = 'reset_rescue_mode'
-    has_snapshot = vm.snapshot
-    msg = messages.tip_restore_disk(vm, snapshot=has_snapshot)
-
-  call_tasks(vm=vm, action=action)
+    msg = messages.tip_restore_disk(vm, backup=vm.backup)
+
+  try:
+    call_tasks(vm=vm, action=action)
+  except OptionalTaskFailed as e:
+    # Only the backup is optional, the rescue itself is done.
+    print(msg)
+    print(messages.tip_backup_failed(vm, e.error), file=sys.stderr)
+    sys.exit(1)
   print(msg)
 
 
@@ -25,6 +25,42 @@ config = {
   'version': VERSION,
   'debug': False,
   'skip-snapshot': False,
+  'backup': 'snapshot',
+  'snapshot-data-disks': False,
+  'max-snapshots-per-region': 10,
+  'max-workers': 20,
+  'max-per-zone': 10,
+  'operation-timeout': 1800,
+  # Snapshots and clones of large disks take hours, not the other operations.
+  'backup-timeout': 24 * 3600,
+  'boot-timeout': 60,
+  'batch-requests': False,
+  'warm-pool': False,
+  'resume': False,
+  'image-cache-ttl': 3600,
+  'permissions-cache-ttl': 300,
+  # Requests per second per project, see tasks/validations/limits.py.
+  'api-read-rate': 20,
+  'api-write-rate': 10,
+  'api-retries': 5,
+  'api-retry-delay': 1,
+  'api-retry-max-delay': 60,
+  'circuit-breaker-threshold': 5,
+  'circuit-breaker-cooldown': 30,
+  'rescue-disk-type': 'pd-balanced',
+  'rescue-disk-size': None,
+  'helper-vm': None,
+  'timings-file': os.path.join(
+    os.path.expanduser('~'), '.cache', 'gce-rescue', 'timings.json'),
+  'journal-dir': os.path.join(
+    os.path.expanduser('~'), '.cache', 'gce-rescue', 'journal'),
+  'engine': 'threads',
+  # Threads running the blocking steps of all the instances, engine=asyncio.
+  'aio-max-threads': 100,
+  'discovery-cache-dir': os.path.join(
+    os.path.expanduser('~'), '.cache', 'gce-rescue', 'discovery'),
+  'discovery-cache-ttl': 7 * 24 * 3600,
+  'discovery-live': False,
   'startup-script-file': os.path.join(dirname, 'startup-script.txt'),
   'source_guests': {
     'x86_64':[
@@ -50,18 +86,114 @@ def process_args():
   parser.add_argument('-p', '--project',
                       help='The project-id that has the instance.')
   parser.add_argument('-z', '--zone', help='Zone where the instance \
-    is created.',
-                      required=True)
-  parser.add_argument('-n', '--name', help='Instance name.', required=True)
+    is created.')
+  parser.add_argument('-n', '--name', action='append',
+                      help='Instance name. Use ZONE/NAME and repeat the option \
+                        to rescue/restore several instances at once.')
+  parser.add_argument('--file',
+                      help='File with one instance per line, as ZONE/NAME \
+                        (or NAME together with --zone).')
+  parser.add_argument('--max-workers', type=int,
+                      default=config['max-workers'],
+                      help='Maximum number of instances processed at the \
+                        same time when running against several instances.')
+  parser.add_argument('--max-per-zone', type=int,
+                      default=config['max-per-zone'],
+                      help='Maximum number of instances processed at the \
+                        same time in a single zone.')
   parser.add_argument('-d', '--debug', action='store_true',
                       help='Print to the log file in debug leve')
   parser.add_argument('-f', '--force', action='store_true',
                       help='Don\'t ask for confirmation.')
   parser.add_argument('--skip-snapshot', action='store_true',
-                      help='Skip backing up the disk using a snapshot.')
+                      help='Skip backing up the disk using a snapshot, same \
+                        as --backup none.')
+  parser.add_argument('--backup', default=config['backup'],
+                      choices=['snapshot', 'instant-snapshot', 'clone', 'none'],
+                      help='Backup of the boot disk taken before setting \
+                        rescue mode. instant-snapshot and clone are ready in \
+                        seconds, snapshot is stored outside the zone.')
+  parser.add_argument('--snapshot-data-disks', action='store_true',
+                      help='With --backup snapshot, also snapshot the other \
+                        disks attached in read-write mode, in parallel.')
+  parser.add_argument('--max-snapshots-per-region', type=int,
+                      default=config['max-snapshots-per-region'], metavar='N',
+                      help='Maximum snapshots in progress at the same time \
+                        per region, for all the instances. \
+                        (default: %(default)s)')
+  parser.add_argument('--rescue-disk-type', default=config['rescue-disk-type'],
+                      metavar='TYPE',
+                      help='Disk type of the rescue disk, e.g. pd-ssd or \
+                        hyperdisk-balanced. auto selects it from the machine \
+                        type and the type of the boot disk. \
+                        (default: %(default)s)')
+  parser.add_argument('--rescue-disk-size', type=int, metavar='GB',
+                      help='Size of the rescue disk, by default the size of \
+                        the image.')
+  parser.add_argument('--helper-vm', metavar='NAME',
+                      help='Instance of the same zone where the boot disk \
+                        is attached as a secondary disk, instead of booting \
+                        the instance from a rescue disk.')
+  parser.add_argument('--api-read-rate', type=float,
+                      default=config['api-read-rate'], metavar='N',
+                      help='Maximum read requests per second sent to the \
+                        API of a project, shared by all instances. \
+                        (default: %(default)s)')
+  parser.add_argument('--api-write-rate', type=float,
+                      default=config['api-write-rate'], metavar='N',
+                      help='Maximum write requests per second sent to the \
+                        API of a project. (default: %(default)s)')
+  parser.add_argument('--engine', default=config['engine'],
+                      choices=['threads', 'asyncio'],
+                      help='Run each task on its own thread, or schedule \
+                        the tasks on a single asyncio event loop with their \
+                        API calls on a shared pool of threads. asyncio \
+                        bounds the threads when rescuing many instances at \
+                        once.')
+  parser.add_argument('--live-discovery', action='store_true',
+                      help='Fetch the discovery document of the Compute API \
+                        from the live discovery service, at most once every \
+                        7 days, instead of using the one bundled with the \
+                        client library.')
+  parser.add_argument('--trace', metavar='FILE',
+                      help='Write the time spent on each task, API request \
+                        and operation wait to FILE, in the Chrome trace \
+                        format (chrome://tracing or ui.perfetto.dev).')
+  parser.add_argument('--plan', action='store_true',
+                      help='Print the steps that would be executed and their \
+                        predicted duration, from the previous executions, \
+                        without changing anything.')
+  parser.add_argument('--resume', action='store_true',
+                      help='Continue an interrupted execution from its last \
+                        completed step, instead of starting over.')
+  parser.add_argument('--warm-pool', action='store_true',
+                      help='Use a rescue disk from the warm pool of the zone, \
+                        when available, instead of creating a new one.')
+  parser.add_argument('--fill-warm-pool', type=int, metavar='N',
+                      help='Keep N ready rescue disks per guest OS in the \
+                        warm pool of --zone and exit.')
+  parser.add_argument('--arch', default='x86_64',
+                      choices=sorted(config['source_guests']),
+                      help='Architecture of the disks created by \
+                        --fill-warm-pool.')
   return parser
 
 
 def set_configs(user_args):
   config['debug'] = getattr(user_args, 'debug')
   config['skip-snapshot'] = getattr(user_args, 'skip_snapshot')
+  config['backup'] = getattr(user_args, 'backup')
+  config['snapshot-data-disks'] = getattr(user_args, 'snapshot_data_disks')
+  config['max-snapshots-per-region'] = getattr(user_args,
+                                               'max_snapshots_per_region')
+  config['rescue-disk-type'] = getattr(user_args, 'rescue_disk_type')
+  config['rescue-disk-size'] = getattr(user_args, 'rescue_disk_size')
+  config['helper-vm'] = getattr(user_args, 'helper_vm')
+  config['max-workers'] = getattr(user_args, 'max_workers')
+  config['max-per-zone'] = getattr(user_args, 'max_per_zone')
+  config['warm-pool'] = getattr(user_args, 'warm_pool')
+  config['resume'] = getattr(user_args, 'resume')
+  config['engine'] = getattr(user_args, 'engine')
+  config['discovery-live'] = getattr(user_args, 'live_discovery')
+  config['api-read-rate'] = getattr(user_args, 'api_read_rate')
+  config['api-write-rate'] = getattr(user_args, 'api_write_rate')
@@ -0,0 +1,237 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Set/Reset rescue mode of several instances from a single invocation. """
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from threading import BoundedSemaphore
+from time import time
+from typing import Dict, List, Tuple
+import logging
+
+from googleapiclient.discovery import Resource
+
+from gce_rescue import messages
+from gce_rescue.config import get_config
+from gce_rescue.gce import Instance
+from gce_rescue.journal import Journal
+from gce_rescue.tasks.actions import call_tasks, call_tasks_async
+from gce_rescue.tasks.scheduler import run_async
+from gce_rescue.tasks.validations.authorization import authorize_check
+from gce_rescue.utils import ProgressRenderer
+
+_logger = logging.getLogger(__name__)
+
+
+def parse_targets(
+  names: List[str],
+  file_name: str = None,
+  default_zone: str = None
+) -> List[Tuple[str, str]]:
+  """Build the list of (zone, name) to be processed.
+  Each entry can be ZONE/NAME or only NAME when default_zone is provided.
+  Entries read from file_name ignore blank lines and # comments.
+  Raises:
+    ValueError: if the zone of an entry can not be determined.
+  """
+
+  entries = list(names or [])
+  if file_name:
+    with open(file_name, encoding='utf-8') as file:
+      for line in file:
+        line = line.split('#', 1)[0].strip()
+        if line:
+          entries.append(line)
+
+  targets = []
+  for entry in entries:
+    if '/' in entry:
+      zone, name = entry.split('/', 1)
+    else:
+      zone, name = default_zone, entry
+    if not zone or not name:
+      raise ValueError(
+        f'Unable to determine the zone of "{entry}". Use ZONE/NAME or --zone.'
+      )
+    if (zone, name) not in targets:
+      targets.append((zone, name))
+  return targets
+
+
+@dataclass
+class FleetResult:
+  """Outcome of one instance processed by the fleet."""
+  zone: str
+  name: str
+  action: str = ''
+  error: str = ''
+  backup_method: str = ''
+  backup: str = ''
+  elapsed: float = 0.0
+
+  @property
+  def ok(self) -> bool:
+    return not self.error
+
+
+class Fleet:
+  """Run set_rescue_mode/reset_rescue_mode on several instances.
+  All the instances share the same compute object (credentials and client).
+  A bounded pool of workers processes the instances, and each zone is capped
+  to max_per_zone instances in progress at the same time. With
+  engine=asyncio the workers are coroutines of a single event loop.
+  """
+
+  def __init__(
+    self,
+    targets: List[Tuple[str, str]],
+    project: str,
+    compute: Resource,
+    max_workers: int = None,
+    max_per_zone: int = None,
+  ):
+    self.targets = targets
+    self.project = project
+    self.compute = compute
+    self.max_workers = max_workers or get_config('max-workers')
+    self.max_per_zone = max_per_zone or get_config('max-per-zone')
+    self.instances: List[Instance] = []
+    self.results: Dict[Tuple[str, str], FleetResult] = {
+      target: FleetResult(*target) for target in targets
+    }
+    self._zone_locks = {
+      zone: BoundedSemaphore(self.max_per_zone) for zone, _ in targets
+    }
+
+  def _load(self, target: Tuple[str, str]) -> None:
+    zone, name = target
+    result = self.results[target]
+    try:
+      vm = Instance(
+        test_mode=False,
+        zone=zone,
+        name=name,
+        project=self.project,
+        compute=self.compute
+      )
+    # Instance() calls sys.exit() on API errors.
+    except (Exception, SystemExit) as e: # pylint: disable=broad-except
+      result.error = f'unable to load instance: {e}'
+      _logger.error(f'{zone}/{name}: {result.error}')
+      return
+    if not get_config('resume'):
+      interrupted = Journal.load(self.project, zone, name)
+      if interrupted:
+        result.error = messages.tip_resume(vm, interrupted.file_name)
+        _logger.error(f'{zone}/{name}: {result.error}')
+        return
+    if vm.rescue_mode_status['rescue-mode']:
+      result.action = 'reset_rescue_mode'
+    else:
+      result.action = 'set_rescue_mode'
+    self.instances.append(vm)
+
+  def _process(self, vm: Instance, renderer: ProgressRenderer) -> None:
+    result = self.results[(vm.zone, vm.name)]
+    with self._zone_locks[vm.zone]:
+      start = time()
+      try:
+        self._start(vm)
+        call_tasks(vm=vm, action=result.action, show_progress=False,
+                   renderer=renderer)
+      except (Exception, SystemExit) as e: # pylint: disable=broad-except
+        result.error = str(e) or e.__class__.__name__
+        _logger.error(f'{vm.zone}/{vm.name}: {result.error}')
+      result.elapsed = time() - start
+
+  def _start(self, vm: Instance) -> None:
+    result = self.results[(vm.zone, vm.name)]
+    if result.action == 'set_rescue_mode':
+      logging.info('RESTORE#%s\n', vm.data)
+    else:
+      result.backup_method = vm.backup_method
+      result.backup = vm.backup
+
+  async def _process_async(
+    self,
+    vm: Instance,
+    renderer: ProgressRenderer,
+    workers: asyncio.Semaphore,
+    zone_locks: Dict[str, asyncio.Semaphore]
+  ) -> None:
+    result = self.results[(vm.zone, vm.name)]
+    async with workers, zone_locks[vm.zone]:
+      start = time()
+      try:
+        # vm.backup may need a blocking API call.
+        await asyncio.get_running_loop().run_in_executor(
+          None, self._start, vm
+        )
+        await call_tasks_async(vm=vm, action=result.action,
+                               show_progress=False, renderer=renderer)
+      except Exception as e: # pylint: disable=broad-except
+        result.error = str(e) or e.__class__.__name__
+        _logger.error(f'{vm.zone}/{vm.name}: {result.error}')
+      result.elapsed = time() - start
+
+  async def _run_async(self, renderer: ProgressRenderer) -> None:
+    workers = asyncio.Semaphore(self.max_workers)
+    zone_locks = {
+      zone: asyncio.Semaphore(self.max_per_zone) for zone in self._zone_locks
+    }
+    await asyncio.gather(*[
+      self._process_async(vm, renderer, workers, zone_locks)
+      for vm in self.instances
+    ])
+
+  def discover(self) -> List[Instance]:
+    """Load all the instances concurrently."""
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      list(pool.map(self._load, self.targets))
+    return self.instances
+
+  def authorize(self) -> List[Instance]:
+    """Check the permissions of the action of each discovered instance,
+    before any of them is changed. The permissions are read once per
+    project, instances missing any are not processed."""
+    for vm in list(self.instances):
+      result = self.results[(vm.zone, vm.name)]
+      try:
+        authorize_check(vm, result.action)
+      except PermissionError as e:
+        result.error = str(e)
+        _logger.error(f'{vm.zone}/{vm.name}: {result.error}')
+        self.instances.remove(vm)
+    return self.instances
+
+  def run(self, renderer: ProgressRenderer = None) -> List[FleetResult]:
+    """Execute the action of each discovered instance concurrently.
+    renderer, when provided, shows one progress bar per instance."""
+    if renderer:
+      renderer.start()
+    if get_config('engine') == 'asyncio':
+      run_async(self._run_async(renderer))
+    else:
+      with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+        list(pool.map(self._process, self.instances,
+                      [renderer] * len(self.instances)))
+    if renderer:
+      renderer.stop()
+    return [self.results[target] for target in self.targets]
+
+  def count(self, action: str) -> int:
+    return len([vm for vm in self.instances
+                if self.results[(vm.zone, vm.name)].action == action])
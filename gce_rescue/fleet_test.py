@@ -0,0 +1,133 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for fleet.py."""
+
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from gce_rescue import fleet, gce
+from gce_rescue.config import config
+from gce_rescue.journal import journal_file
+from gce_rescue.test.mocks import mock_api_object, MOCK_TEST_VM
+
+
+class FleetTest(absltest.TestCase):
+
+  def test_parse_targets(self):
+    targets = fleet.parse_targets(
+      ['europe-central2-a/vm1', 'vm2', 'europe-central2-a/vm1'],
+      default_zone='us-central1-a'
+    )
+    self.assertEqual(targets, [
+      ('europe-central2-a', 'vm1'),
+      ('us-central1-a', 'vm2'),
+    ])
+
+
+  def test_parse_targets_file(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      file_name = os.path.join(tmp, 'instances.txt')
+      with open(file_name, 'w', encoding='utf-8') as file:
+        file.write('# broken by the kernel rollout\n\nus-east1-b/vm3\n')
+      targets = fleet.parse_targets(None, file_name=file_name)
+    self.assertEqual(targets, [('us-east1-b', 'vm3')])
+
+
+  def test_parse_targets_without_zone(self):
+    with self.assertRaises(ValueError):
+      fleet.parse_targets(['vm1'])
+
+
+  def test_discover(self):
+    targets = [(MOCK_TEST_VM['zone'], MOCK_TEST_VM['name'])]
+    fleet_ = fleet.Fleet(
+      targets,
+      project=MOCK_TEST_VM['project'],
+      compute=mock_api_object(['compute']),
+      max_workers=1
+    )
+    instances = fleet_.discover()
+    self.assertEqual(len(instances), 1)
+    self.assertEqual(fleet_.count('set_rescue_mode'), 1)
+    self.assertIs(instances[0].compute, fleet_.compute)
+
+
+  def test_instances_have_their_own_disks(self):
+    """Instances of one execution share the same ts, not their disks."""
+    targets = [(MOCK_TEST_VM['zone'], 'vm1'), (MOCK_TEST_VM['zone'], 'vm2')]
+    fleet_ = fleet.Fleet(
+      targets,
+      project=MOCK_TEST_VM['project'],
+      compute=mock_api_object(['compute', 'compute']),
+      max_workers=1
+    )
+    vm1, vm2 = fleet_.discover()
+    vm2.ts = vm1.ts
+    self.assertNotEqual(vm1.rescue_disk, vm2.rescue_disk)
+    self.assertStartsWith(vm1.rescue_disk, gce.RESCUE_DISK_PREFIX)
+
+    # In rescue mode, the labelled disk attached to the instance.
+    boot = vm1.data['disks'][0]
+    vm1.rescue_mode_status['rescue-mode'] = True
+    labelled = [{'name': 'other-instance-boot'},
+                {'name': boot['source'].split('/')[-1]}]
+    with mock.patch.object(gce, 'list_disk', return_value=labelled):
+      self.assertEqual(vm1._define_disks(), { # pylint: disable=protected-access
+        'device_name': boot['deviceName'],
+        'disk_name': labelled[1]['name'],
+      })
+
+  def test_discover_interrupted(self):
+    """An interrupted execution is only continued with --resume."""
+    targets = [(MOCK_TEST_VM['zone'], MOCK_TEST_VM['name'])]
+    tmp = self.enter_context(tempfile.TemporaryDirectory())
+    self.enter_context(mock.patch.dict(config, {'journal-dir': tmp,
+                                                'resume': False}))
+    file_name = journal_file(MOCK_TEST_VM['project'], *targets[0])
+    with open(file_name, 'w', encoding='utf-8') as file:
+      file.write('{"action": "set_rescue_mode"}')
+    fleet_ = fleet.Fleet(
+      targets,
+      project=MOCK_TEST_VM['project'],
+      compute=mock_api_object(['compute']),
+      max_workers=1
+    )
+    self.assertEmpty(fleet_.discover())
+    result = fleet_.results[targets[0]]
+    self.assertFalse(result.ok)
+    self.assertIn('--resume', result.error)
+    self.assertIn(file_name, result.error)
+
+  def test_authorize(self):
+    """Instances missing permissions are not processed."""
+    targets = [(MOCK_TEST_VM['zone'], MOCK_TEST_VM['name'])]
+    fleet_ = fleet.Fleet(
+      targets,
+      project=MOCK_TEST_VM['project'],
+      compute=mock_api_object(['compute']),
+      max_workers=1
+    )
+    fleet_.discover()
+    with mock.patch.object(fleet, 'authorize_check',
+                           side_effect=PermissionError('missing')) as check:
+      self.assertEmpty(fleet_.authorize())
+    check.assert_called_once_with(mock.ANY, 'set_rescue_mode')
+    self.assertEqual(fleet_.results[targets[0]].error, 'missing')
+
+
+if __name__ == '__main__':
+  absltest.main()
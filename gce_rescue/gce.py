@@ -21,12 +21,28 @@ from googleapiclient.errors import HttpError
 from dataclasses import dataclass, field
 from typing import Dict, List, Union
 from time import time
-from gce_rescue.tasks.backup import backup_metadata_items
-from gce_rescue.tasks.disks import list_disk, list_snapshot
+from gce_rescue.journal import Journal
+from gce_rescue.tasks.backup import (
+  BACKUP_LABEL,
+  backup_metadata_items,
+  backup_method,
+  backup_name,
+  find_backup
+)
+from gce_rescue.tasks.disks import (
+  DEVICE_LABEL,
+  HELPER_LABEL,
+  TARGET_LABEL,
+  list_disk
+)
 from gce_rescue.tasks.pre_validations import Validations
+from gce_rescue.tasks.validations import batch
 from gce_rescue.config import get_config
 
 
+RESCUE_DISK_PREFIX = 'linux-rescue-'
+
+
 def get_instance_info(
   compute: Resource,
   name: str,
@@ -40,9 +56,9 @@ def get_instance_info(
     project_data: dict, Dictionary containing project and zone keys to be
       unpacked when calling the API.
   """
-  return compute.instances().get(
+  return batch.execute(compute.instances().get(
       **project_data,
-      instance = name).execute()
+      instance = name))
 
 def guess_guest(data: Dict) -> str:
   """Determined which Guest OS Family is being used and select a
@@ -95,28 +111,34 @@ class Instance(Resource):
   name: str
   project: str = None
   test_mode: bool = field(default_factory=False)
-  compute: Resource = field(init=False)
+  compute: Resource = None
   data: Dict[str, Union[str, int]] = field(init=False)
   ts: int = field(init=False)
   _status: str = ''
   _rescue_source_disk: str = ''
+  _rescue_disk: str = ''
   _rescue_mode_status: Dict[str, Union[str, int]] = field(
     default_factory=lambda: ({})
   )
   _disks: Dict[str, str] = field(default_factory=lambda: ({}))
+  _backup_method: str = ''
+  _helper_vm: str = ''
   _backup_items: Dict[str, Union[str, int]] = field(
     default_factory=lambda: ([])
   )
+  journal: Journal = field(init=False, default=None)
 
   def __post_init__(self):
-    check = Validations(
-        name=self.name,
-        test_mode=self.test_mode,
-        **self.project_data
-    )
     try:
-      self.compute = check.compute
-      self.project = check.adc_project
+      # A shared compute object (e.g. fleet mode) was already validated.
+      if self.compute is None:
+        check = Validations(
+            name=self.name,
+            test_mode=self.test_mode,
+            **self.project_data
+        )
+        self.compute = check.compute
+        self.project = check.adc_project
       self.data = get_instance_info(
         compute=self.compute,
         name=self.name,
@@ -125,16 +147,52 @@ class Instance(Resource):
       print(e.reason)
       sys.exit(1)
 
+    self._status = self.data['status']
+    if get_config('resume'):
+      self.journal = Journal.load(self.project, self.zone, self.name)
+    if self.journal:
+      # Interrupted execution, the instance can be half way between modes
+      # and its current configuration is not reliable.
+      self._restore_state(self.journal.state)
+      return
+
     self._rescue_mode_status = validate_instance_mode(self.data)
     self.ts = self._rescue_mode_status['ts']
-    self._status = self.data['status']
+    self._backup_items = backup_metadata_items(data=self.data)
+    if not any(disk['boot'] for disk in self.data['disks']):
+      # The boot disk is attached to a helper VM.
+      self._define_helper_mode()
+      return
+
+    if not self._rescue_mode_status['rescue-mode']:
+      self._set_helper_vm(get_config('helper-vm'))
     self._rescue_source_disk = guess_guest(self.data)
     self._disks = self._define_disks()
+    self._rescue_disk = self._define_rescue_disk()
+
+  def state(self) -> Dict:
+    """Values derived from the configuration of the instance before the
+    action started, saved in the journal."""
+    return {
+      'rescue_mode_status': self._rescue_mode_status,
+      'ts': self.ts,
+      'rescue_source_disk': self._rescue_source_disk,
+      'rescue_disk': self._rescue_disk,
+      'disks': self._disks,
+      'backup_items': self._backup_items,
+      'backup_method': self._backup_method,
+      'helper_vm': self._helper_vm,
+    }
 
-    # Backup metadata items
-    self._backup_items = backup_metadata_items(
-        data=self.data
-    )
+  def _restore_state(self, state: Dict) -> None:
+    self._rescue_mode_status = state['rescue_mode_status']
+    self.ts = state['ts']
+    self._rescue_source_disk = state['rescue_source_disk']
+    self._rescue_disk = state['rescue_disk']
+    self._disks = state['disks']
+    self._backup_items = state['backup_items']
+    self._backup_method = state['backup_method']
+    self._helper_vm = state.get('helper_vm', '')
 
   def refresh_fingerprint(self) -> None:
     """Refresh the current metadata fingerprint value."""
@@ -152,6 +210,7 @@ class Instance(Resource):
 
     rescue_on = self._rescue_mode_status['rescue-mode']
     if not rescue_on:
+      self._backup_method = backup_method()
       for disk in self.data['disks']:
         if disk['boot']:
           device_name = disk['deviceName']
@@ -162,19 +221,25 @@ class Instance(Resource):
       ts = self._rescue_mode_status['ts']
       disk_filter = f'labels.rescue={ts}'
 
-      disk = list_disk(
+      labelled = list_disk(
         vm=self,
         project_data=self.project_data,
         label_filter=disk_filter
       )
 
-      disk_name = disk[0]['name']
-      disks = self.data['disks']
-      for disk in disks:
-        full_source = disk['source']
-        source = full_source.split('/')[-1]
-        if disk_name == source:
-          device_name = disk['deviceName']
+      # Instances rescued at the same time share the same ts, keep the
+      # labelled disk attached to this instance.
+      attached = {
+        disk['source'].split('/')[-1]: disk['deviceName']
+        for disk in self.data['disks']
+      }
+      for disk in labelled:
+        if disk['name'] in attached:
+          disk_name = disk['name']
+          device_name = attached[disk_name]
+          # Instances rescued by older versions always took a snapshot.
+          self._backup_method = disk.get('labels', {}).get(
+            BACKUP_LABEL, 'snapshot')
 
     result = {
         'device_name': device_name,
@@ -182,6 +247,61 @@ class Instance(Resource):
     }
     return result
 
+  def _set_helper_vm(self, helper_vm: str) -> None:
+    """Check the helper VM exists in the zone before anything is changed,
+    the boot disk would be left detached otherwise."""
+    if not helper_vm:
+      return
+    if helper_vm == self.name:
+      print(f'{self.name} can not be its own helper VM.')
+      sys.exit(1)
+    try:
+      get_instance_info(
+        compute=self.compute,
+        name=helper_vm,
+        project_data=self.project_data)
+    except HttpError as e:
+      print(f'Helper VM {helper_vm}: {e.reason}')
+      sys.exit(1)
+    self._helper_vm = helper_vm
+
+  def _define_helper_mode(self) -> None:
+    """Without boot disk the instance is in rescue mode with a helper VM,
+    the labels of its boot disk have the state."""
+    labelled = list_disk(
+      vm=self,
+      project_data=self.project_data,
+      label_filter=f'labels.{TARGET_LABEL}={self.name}'
+    )
+    if not labelled:
+      print(f'{self.name} has no boot disk.')
+      sys.exit(1)
+    # Labels of previous rescues are not removed, keep the latest.
+    disk = max(labelled, key=lambda disk: int(disk['labels']['rescue']))
+    labels = disk['labels']
+    self._rescue_mode_status = {
+      'rescue-mode': True,
+      'ts': labels['rescue']
+    }
+    self.ts = labels['rescue']
+    self._helper_vm = labels[HELPER_LABEL]
+    self._backup_method = labels.get(BACKUP_LABEL, 'snapshot')
+    self._disks = {
+      'device_name': labels[DEVICE_LABEL],
+      'disk_name': disk['name']
+    }
+
+  def _define_rescue_disk(self) -> str:
+    """In rescue mode the rescue disk is the boot disk. Its name depends on
+    the version that created it, or it was claimed from the warm pool."""
+
+    if self._rescue_mode_status['rescue-mode']:
+      for disk in self.data['disks']:
+        source = disk['source'].split('/')[-1]
+        if disk['boot'] and source.startswith(RESCUE_DISK_PREFIX):
+          return source
+    return ''
+
   @property
   def rescue_mode_status(self) -> Dict[str, Union[str, int]]:
     return self._rescue_mode_status
@@ -192,7 +312,13 @@ class Instance(Resource):
 
   @property
   def rescue_disk(self) -> str:
-    return f'linux-rescue-disk-{self.ts}'
+    # Unique per instance, several instances can share the same ts.
+    return (self._rescue_disk or
+            f'{RESCUE_DISK_PREFIX}{self.name[:39]}-{self.ts}')
+
+  @rescue_disk.setter
+  def rescue_disk(self, v: str) -> None:
+    self._rescue_disk = v
 
   @property
   def status(self) -> str:
@@ -223,8 +349,20 @@ class Instance(Resource):
     return self._disks
 
   @property
-  def snapshot(self) -> str:
+  def helper_vm(self) -> str:
+    """Instance the boot disk is attached to, instead of booting from a
+    rescue disk. Empty without --helper-vm."""
+    return self._helper_vm
+
+  @property
+  def backup_method(self) -> str:
+    return self._backup_method
+
+  @property
+  def backup(self) -> str:
+    """Name of the backup (snapshot, instant snapshot or disk clone) of the
+    boot disk, empty if there is none."""
     if not self.rescue_mode_status['rescue-mode']:
-      return f"{self.disks['disk_name']}-{self.ts}"
-    return list_snapshot(self)
+      return backup_name(self) if self._backup_method != 'none' else ''
+    return find_backup(self)
 
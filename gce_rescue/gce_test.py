@@ -14,6 +14,9 @@
 
 """Test code for rescue.py."""
 
+import io
+from unittest import mock
+
 from absl.testing import absltest
 from gce_rescue.gce import Instance
 from gce_rescue.test.mocks import (
@@ -79,5 +82,14 @@ class RescueTest(absltest.TestCase):
     )
 
 
+  def test_invalid_helper_vm(self):
+    """An invalid --helper-vm is reported without traceback."""
+    with mock.patch('sys.stdout', new_callable=io.StringIO) as stdout:
+      with self.assertRaises(SystemExit) as context:
+        self.vm._set_helper_vm(self.vm.name) # pylint: disable=protected-access
+    self.assertEqual(context.exception.code, 1)
+    self.assertIn('can not be its own helper VM', stdout.getvalue())
+
+
 if __name__ == '__main__':
   absltest.main()
@@ -0,0 +1,150 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Local journal of an action on one instance: the state of the instance
+    when it started, the steps already done and the operation started by
+    each step. It is saved after every change and removed when the action
+    completes, so an interrupted execution can be resumed (--resume) without
+    repeating the finished steps, waiting on the operations still in flight.
+"""
+
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from gce_rescue.config import get_config
+from gce_rescue.tasks import keeper
+
+_logger = logging.getLogger(__name__)
+
+# Step of the task running in the current thread.
+_current_step = contextvars.ContextVar('journal_step', default=None)
+
+
+def journal_file(project: str, zone: str, name: str) -> str:
+  file_name = re.sub(r'[^\w.-]', '_', f'{project}_{zone}_{name}') + '.json'
+  return os.path.join(get_config('journal-dir'), file_name)
+
+
+class Journal:
+  """Progress of action on one instance, saved to file_name as JSON."""
+
+  def __init__(self, file_name: str, data: Dict):
+    self.file_name = file_name
+    self.data = data
+    self._lock = threading.RLock()
+
+  @classmethod
+  def load(cls, project: str, zone: str, name: str) -> Optional['Journal']:
+    """Journal of an interrupted execution, None if there is none."""
+    file_name = journal_file(project, zone, name)
+    try:
+      with open(file_name, encoding='utf-8') as file:
+        return cls(file_name, json.load(file))
+    except FileNotFoundError:
+      return None
+
+  @classmethod
+  def new(cls, vm, action: str) -> 'Journal':
+    journal = cls(journal_file(vm.project, vm.zone, vm.name), {
+      'action': action,
+      'state': vm.state(),
+      'done': [],
+      'operations': {},
+    })
+    journal.save()
+    return journal
+
+  @property
+  def action(self) -> str:
+    return self.data['action']
+
+  @property
+  def state(self) -> Dict:
+    return self.data['state']
+
+  def save(self) -> None:
+    with self._lock:
+      os.makedirs(os.path.dirname(self.file_name), exist_ok=True)
+      tmp_file = f'{self.file_name}.tmp'
+      with open(tmp_file, 'w', encoding='utf-8') as file:
+        json.dump(self.data, file, indent=2)
+      os.replace(tmp_file, self.file_name)
+
+  def remove(self) -> None:
+    try:
+      os.remove(self.file_name)
+    except FileNotFoundError:
+      pass
+
+  def is_done(self, step: str) -> bool:
+    return step in self.data['done']
+
+  def operation(self, step: str) -> Optional[str]:
+    return self.data['operations'].get(step)
+
+  def started(self, vm, operation: str) -> None:
+    """Called by wait_for_operation(), record the operation of the step
+    running in the current thread, with the state of vm: a step completed
+    while interrupted is not run again, so what it changed on vm before
+    waiting, e.g. the claimed pool disk, must be in the journal."""
+    step = _current_step.get()
+    with self._lock:
+      if step is None or self.data['operations'].get(step) == operation:
+        return
+      self.data['operations'][step] = operation
+      self.data['state'] = vm.state()
+      self.save()
+
+  def done(self, vm, step: str) -> None:
+    with self._lock:
+      self.data['done'].append(step)
+      self.data['operations'].pop(step, None)
+      # Steps can update the instance, e.g. the claimed rescue disk.
+      self.data['state'] = vm.state()
+      self.save()
+
+  def wrap(self, tasks: List[Dict]) -> List[Dict]:
+    """Tasks of the scheduler that skip the steps already done and, for the
+    steps interrupted while waiting, wait on their operation again."""
+    for task in tasks:
+      task['name'] = self._wrap(task['id'], task['name'])
+    return tasks
+
+  def _wrap(self, step: str, func: Callable) -> Callable:
+    @functools.wraps(func)
+    def _step(vm, **kwargs):
+      if self.is_done(step):
+        _logger.info(f'{step} was already done, skipping.')
+        return
+      _current_step.set(step)
+      operation = self.operation(step)
+      if operation:
+        try:
+          keeper.wait_for_operation(
+            vm, {'name': operation, 'status': 'RUNNING'})
+        except Exception as e: # pylint: disable=broad-except
+          _logger.info(f'Operation of {step} failed, running it again: {e}')
+        else:
+          _logger.info(f'{step} completed while interrupted.')
+          self.done(vm, step)
+          return
+      func(vm=vm, **kwargs)
+      self.done(vm, step)
+    return _step
@@ -0,0 +1,162 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for journal.py."""
+
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from googleapiclient.errors import HttpError
+
+from gce_rescue.config import config
+from gce_rescue.gce import Instance
+from gce_rescue.journal import Journal, journal_file
+from gce_rescue.tasks import pool
+from gce_rescue.tasks.actions import call_tasks
+from gce_rescue.test.fake_compute import (
+  FakeCompute,
+  INSTANT_PROFILE,
+  Latency
+)
+
+ZONE = 'europe-central2-a'
+
+
+class JournalTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['skip-snapshot'] = True
+    config['journal-dir'] = self.enter_context(tempfile.TemporaryDirectory())
+    config['timings-file'] = None
+    self.fake = FakeCompute(
+      profile={**INSTANT_PROFILE, 'stop': Latency(0.2, 0)}, seed=0)
+    self.fake.add_instance(ZONE, 'vm1')
+    self.compute = self.fake.service()
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def _instance(self) -> Instance:
+    return Instance(test_mode=False, zone=ZONE, name='vm1',
+                    project=self.fake.project, compute=self.compute)
+
+
+  def _journal(self) -> Journal:
+    return Journal.load(self.fake.project, ZONE, 'vm1')
+
+
+  def _resume_after_failed_start(self, engine: str) -> None:
+    config['engine'] = engine
+    self.fake.add_fault('instances.start', status=503, count=1)
+    with self.assertRaises(HttpError):
+      call_tasks(self._instance(), 'set_rescue_mode', show_progress=False)
+
+    journal = self._journal()
+    self.assertEqual(journal.action, 'set_rescue_mode')
+    self.assertContainsSubset(
+      ['stop', 'create_disk', 'detach_boot', 'attach_rescue', 'set_metadata'],
+      journal.data['done'])
+    self.assertNotIn('start', journal.data['done'])
+
+    # The metadata already says rescue mode, without the journal the
+    # instance would be taken as rescued.
+    config['resume'] = True
+    vm = self._instance()
+    self.assertFalse(vm.rescue_mode_status['rescue-mode'])
+    self.assertEqual(vm.disks['disk_name'], 'vm1')
+    call_tasks(vm, 'set_rescue_mode', show_progress=False)
+
+    self.assertIsNone(self._journal())
+    self.assertEqual(self.fake.calls['instances.stop'], 1)
+    self.assertEqual(self.fake.calls['disks.insert'], 1)
+    self.assertEqual(self.fake.calls['instances.start'], 2)
+    instance = self.fake.instances[(ZONE, 'vm1')]
+    self.assertEqual(instance['status'], 'RUNNING')
+    self.assertEqual(
+      sorted(disk['source'].split('/')[-1] for disk in instance['disks']),
+      ['linux-rescue-vm1-' + str(vm.ts), 'vm1'])
+
+    config['resume'] = False
+    call_tasks(self._instance(), 'reset_rescue_mode', show_progress=False)
+    self.assertEqual(
+      [disk['source'].split('/')[-1] for disk in instance['disks']], ['vm1'])
+
+
+  def test_resume_threads(self):
+    self._resume_after_failed_start('threads')
+
+
+  def test_resume_asyncio(self):
+    self._resume_after_failed_start('asyncio')
+
+
+  def test_resume_operation_in_flight(self):
+    # Waiting on the stop operation fails, as if the client was interrupted.
+    self.fake.add_fault('zoneOperations.wait', status=503, count=1)
+    self.fake.add_fault('zoneOperations.get', status=503, count=1)
+    with self.assertRaises(HttpError):
+      call_tasks(self._instance(), 'set_rescue_mode', show_progress=False)
+    journal = self._journal()
+    self.assertNotIn('stop', journal.data['done'])
+    self.assertIn('stop', journal.data['operations'])
+
+    config['resume'] = True
+    call_tasks(self._instance(), 'set_rescue_mode', show_progress=False)
+    self.assertEqual(self.fake.calls['instances.stop'], 1)
+    self.assertIsNone(self._journal())
+
+
+  def test_resume_claimed_pool_disk(self):
+    """The pool disk claimed before the interruption is the rescue disk."""
+    config['warm-pool'] = True
+    self.fake.profile['setLabels'] = Latency(0.2, 0)
+    self.fake.instances[(ZONE, 'vm1')]['status'] = 'TERMINATED'
+    source_disk = self._instance().rescue_source_disk
+    self.fake.add_disk(ZONE, 'linux-rescue-pool-1', labels={
+      pool.POOL_LABEL: 'ready',
+      pool.IMAGE_LABEL: pool.image_label(source_disk)})
+    # Waiting on the claim fails, as if the client was interrupted.
+    self.fake.add_fault('zoneOperations.wait', status=503, count=1)
+    self.fake.add_fault('zoneOperations.get', status=503, count=1)
+    with mock.patch.object(pool, '_refill'):
+      with self.assertRaises(HttpError):
+        call_tasks(self._instance(), 'set_rescue_mode', show_progress=False)
+    journal = self._journal()
+    self.assertIn('create_disk', journal.data['operations'])
+    self.assertEqual(journal.state['rescue_disk'], 'linux-rescue-pool-1')
+
+    config['resume'] = True
+    vm = self._instance()
+    call_tasks(vm, 'set_rescue_mode', show_progress=False)
+    self.assertIsNone(self._journal())
+    self.assertEqual(self.fake.calls['disks.insert'], 0)
+    instance = self.fake.instances[(ZONE, 'vm1')]
+    self.assertEqual(instance['disks'][0]['source'].split('/')[-1],
+                     'linux-rescue-pool-1')
+
+
+  def test_journal_file(self):
+    self.assertEqual(
+      journal_file('my-project', 'us-east1-b', 'vm/1'),
+      os.path.join(config['journal-dir'], 'my-project_us-east1-b_vm_1.json'))
+
+
+if __name__ == '__main__':
+  absltest.main()
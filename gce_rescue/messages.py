@@ -14,7 +14,14 @@
 
 """ List of messages to inform and educate the user. """
 
+from typing import TYPE_CHECKING, Dict, List, Tuple
+
 from gce_rescue.gce import Instance
+from gce_rescue.timings import format_duration
+
+if TYPE_CHECKING:
+  # fleet.py uses the messages.
+  from gce_rescue.fleet import FleetResult
 
 def tip_connect_ssh(vm: Instance) -> str:
   return (f'└── Your instance is READY! You can now connect your instance '
@@ -26,14 +33,80 @@ def tip_connect_ssh(vm: Instance) -> str:
     f'{vm.zone}/instances/{vm.name}?authuser=0&hl=en_US&useAdminProxy=true&'
     f'troubleshoot4005Enabled=true\n')
 
-def tip_restore_disk(vm: Instance, snapshot=False) -> str:
-  if not snapshot:
-    snapshot_restore_msg = ''
+def tip_helper_vm(vm: Instance) -> str:
+  device = f"/dev/disk/by-id/google-{vm.disks['disk_name']}"
+  return (f'└── The boot disk of {vm.name} is attached to {vm.helper_vm}! '
+    f'You can now connect to {vm.helper_vm} via:\n'
+    f'    $ gcloud compute ssh {vm.helper_vm} --zone={vm.zone} '
+    f'--project={vm.project}\n'
+    f'  The disk is {device}, list its partitions with:\n'
+    f'    $ lsblk {device}\n'
+    f'  XFS partitions of the same image as the helper need '
+    f'"mount -o nouuid".\n'
+    f'  Unmount the disk before restoring {vm.name}.\n')
+
+_BACKUP_DOCS = {
+  'snapshot': ('Snapshot',
+               'https://cloud.google.com/compute/docs/disks/restore-snapshot'),
+  'instant-snapshot': ('Instant snapshot',
+    'https://cloud.google.com/compute/docs/disks/instant-snapshots'),
+  'clone': ('Disk clone',
+    'https://cloud.google.com/compute/docs/disks/create-disk-from-source'),
+}
+
+def tip_restore_disk(vm: Instance, backup: str = '') -> str:
+  if not backup:
+    backup_restore_msg = ''
   else:
-    snapshot_restore_msg = (f' Use the snapshot below '
+    kind, doc = _BACKUP_DOCS[vm.backup_method]
+    backup_restore_msg = (f' Use the {kind.lower()} below '
     f'if you need to restore the modification made while the instance was '
-    f'in rescue mode.\n Snapshot name: {vm.disks["disk_name"]}-{vm.ts}\n'
-    f' More information: '
-    f'https://cloud.google.com/compute/docs/disks/restore-snapshot\n')
+    f'in rescue mode.\n {kind} name: {backup}\n'
+    f' More information: {doc}\n')
+
+  return f'└── The instance {vm.name} was restored!' + backup_restore_msg
+
+def tip_fleet_summary(results: List['FleetResult']) -> str:
+  lines = []
+  for result in results:
+    status = 'OK' if result.ok else f'FAILED: {result.error}'
+    line = (f'  {result.zone}/{result.name} {result.action or "-"} '
+      f'{status} ({result.elapsed:.0f}s)')
+    if result.ok and result.backup:
+      line += f' {result.backup_method}: {result.backup}'
+    lines.append(line)
+  failed = len([result for result in results if not result.ok])
+  return (f'└── {len(results) - failed}/{len(results)} instances finished '
+    f'successfully.\n' + '\n'.join(lines))
+
+def tip_warm_pool(zone: str, created: Dict[str, int]) -> str:
+  lines = [f'  {image}: {count} disks created'
+    for image, count in created.items()]
+  return (f'└── The warm pool of {zone} is ready.\n' + '\n'.join(lines))
+
+def tip_resume(vm: Instance, file_name: str) -> str:
+  return (f'└── A previous execution on {vm.name} was interrupted before it '
+    f'finished.\n  Run the same command with --resume to continue it, or '
+    f'remove {file_name} to start over.')
+
+def tip_backup_failed(vm: Instance, error: Exception) -> str:
+  return (f'└── The backup of {vm.name} failed: {error}\n  Run the same '
+    f'command with --resume to take it again.')
+
+def tip_plan(vm: Instance, action: str, plan: Dict) -> str:
+  lines = [f'  {"step":<18} {"after":<28} {"p50":>6} {"p90":>6} samples']
+  for step in plan['steps']:
+    lines.append(f'  {step["id"]:<18} {",".join(step["after"]) or "-":<28} '
+      f'{format_duration(step["p50"]):>6} {format_duration(step["p90"]):>6} '
+      f'{step["samples"]:>7}')
+  return (f'└── {action} on {vm.name} ({plan["location"]}), nothing was '
+    f'changed:\n' + '\n'.join(lines) + '\n'
+    f'  Predicted duration: {format_duration(plan["p50"])} (p50), '
+    f'{format_duration(plan["p90"])} (p90).')
 
-  return f'└── The instance {vm.name} was restored!' + snapshot_restore_msg
+def tip_fleet_plan(plans: List[Tuple[Instance, str, Dict]]) -> str:
+  lines = [f'  {vm.zone}/{vm.name} {action}: {format_duration(plan["p50"])} '
+    f'(p50), {format_duration(plan["p90"])} (p90)'
+    for vm, action, plan in plans]
+  return (f'└── Plan of {len(plans)} instances, nothing was changed:\n' +
+    '\n'.join(lines))
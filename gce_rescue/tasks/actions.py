@@ -12,17 +12,24 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-""" List of ordered tasks to be executed when set/reset VM rescue mode. """
+""" Graph of tasks to be executed when set/reset VM rescue mode. """
 
-from typing import List
+from typing import Dict, List
 import logging
 
 from gce_rescue.gce import Instance
+from gce_rescue.journal import Journal
+from gce_rescue.tasks.backup import create_backup
 from gce_rescue.tasks.disks import (
-  take_snapshot,
-  create_rescue_disk,
-  restore_original_disk,
-  attach_disk
+  prepare_rescue_disk,
+  detach_boot_disk,
+  attach_rescue_disk,
+  label_boot_disk,
+  attach_original_disk,
+  attach_helper_disk,
+  detach_helper_disk,
+  detach_rescue_disk,
+  delete_rescue_disk
 )
 from gce_rescue.tasks.operations import (
   start_instance,
@@ -32,116 +39,193 @@ from gce_rescue.tasks.metadata import (
   set_metadata,
   restore_metadata_items
 )
-from gce_rescue.utils import Tracker
+from gce_rescue.tasks.scheduler import run_async, run_tasks, run_tasks_async
+from gce_rescue import timings, tracing
+from gce_rescue.utils import ProgressRenderer, Tracker
 from gce_rescue.config import get_config
 _logger = logging.getLogger(__name__)
 
+def _task(task_id: str, name, after: List[str], **kwargs):
+  vm = kwargs['vm']
+  return {
+    'id': task_id,
+    'name': name,
+    'args': [kwargs],
+    'after': after,
+    'trace': {'vm': f'{vm.zone}/{vm.name}'}
+  }
+
 def _list_tasks(vm: Instance, action: str) -> List:
-  """ List tasks, by order, per operation
+  """ List tasks per operation, each task starts when all the tasks in
+  its 'after' are done. Changes on the instance itself stay in sequence,
+  disk-only tasks run alongside them. With a helper VM the boot disk is
+  moved to the helper instead of booting the instance from a rescue disk.
     operations (str):
       1. set_rescue_mode
       2. reset_rescue_mode
   """
-  all_tasks = {
+  helper_tasks = {
+    'set_rescue_mode': [
+      _task('stop', stop_instance, [], vm=vm),
+      _task('label_boot', label_boot_disk, [], vm=vm),
+      _task('detach_boot', detach_boot_disk, ['stop'], vm=vm),
+      _task('attach_helper', attach_helper_disk,
+            ['detach_boot', 'label_boot'], vm=vm),
+    ],
+    'reset_rescue_mode': [
+      _task('detach_helper', detach_helper_disk, [], vm=vm),
+      _task('attach_original', attach_original_disk, ['detach_helper'],
+            vm=vm, boot=True),
+      _task('start', start_instance, ['attach_original'], vm=vm),
+    ]
+  }
+  all_tasks = helper_tasks if vm.helper_vm else {
     'set_rescue_mode': [
-      {
-        'name': stop_instance,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': create_rescue_disk,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': set_metadata,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': start_instance,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': attach_disk,
-        'args': [{
-          'vm': vm,
-          'boot': False,
-          **vm.disks
-        }],
-      },
-      {
-        'name': restore_metadata_items,
-        'args': [{
-          'vm': vm
-        }],
-      }
-  ],
+      _task('stop', stop_instance, [], vm=vm),
+      _task('create_disk', prepare_rescue_disk, [], vm=vm),
+      _task('detach_boot', detach_boot_disk, ['stop'], vm=vm),
+      _task('attach_rescue', attach_rescue_disk,
+            ['detach_boot', 'create_disk'], vm=vm),
+      _task('set_metadata', set_metadata, ['attach_rescue'], vm=vm),
+      _task('start', start_instance, ['set_metadata'], vm=vm),
+      _task('label_boot', label_boot_disk, ['attach_rescue'], vm=vm),
+      _task('attach_original', attach_original_disk,
+            ['start', 'label_boot'], vm=vm),
+      _task('restore_metadata', restore_metadata_items,
+            ['attach_original'], vm=vm),
+    ],
     'reset_rescue_mode': [
-      {
-        'name': stop_instance,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': restore_original_disk,
-        'args': [{
-          'vm': vm
-        }]
-      },
-      {
-        'name': restore_metadata_items,
-        'args': [{
-          'vm': vm,
-          'remove_rescue_mode': True
-        }]
-      },
-      {
-        'name': start_instance,
-        'args': [{
-          'vm': vm
-        }]
-      },
+      _task('stop', stop_instance, [], vm=vm),
+      _task('detach_rescue', detach_rescue_disk, ['stop'], vm=vm),
+      _task('delete_disk', delete_rescue_disk, ['detach_rescue'], vm=vm),
+      _task('detach_original', detach_boot_disk, ['detach_rescue'], vm=vm),
+      _task('attach_original', attach_original_disk, ['detach_original'],
+            vm=vm, boot=True),
+      _task('restore_metadata', restore_metadata_items,
+            ['attach_original'], vm=vm, remove_rescue_mode=True),
+      _task('start', start_instance, ['restore_metadata'], vm=vm),
     ]
   }
 
   if action not in all_tasks:
     _logger.info(f'Unable to find "{action}".')
     raise ValueError()
-  return all_tasks[action]
+  tasks = all_tasks[action]
 
-
-def call_tasks(vm: Instance, action: str) -> None:
-  """ Loop tasks dict and execute """
-  tasks = _list_tasks(vm = vm, action = action)
-  async_backup_thread = None
   if action == 'set_rescue_mode':
-    if get_config('skip-snapshot'):
-      _logger.info(f'Skipping snapshot backup.')
+    if vm.backup_method == 'none':
+      _logger.info('Skipping the backup of the boot disk.')
     else:
-      take_snapshot(vm)
-      async_backup_thread = True
-  total_tasks = len(tasks)
+      # Nothing depends on the backup, it runs for the whole execution. A
+      # failed backup doesn't leave the instance halfway through the rescue,
+      # it is reported once the other steps are done.
+      backup = _task('backup', create_backup, [], vm=vm)
+      backup['optional'] = True
+      tasks.insert(0, backup)
+  return tasks
+
+
+def plan(vm: Instance, action: str) -> Dict:
+  """ Steps of action with their predicted durations, nothing is executed.
+  See timings.plan(). """
+  return timings.plan(vm, _list_tasks(vm, action))
+
+
+def _eta(vm: Instance, tasks: List[Dict]) -> float:
+  """ Predicted duration of the steps not done yet. """
+  durations = timings.estimates(vm, tasks)
+  for step in vm.journal.data['done']:
+    if step in durations:
+      durations[step] = 0
+  return timings.predict(tasks, durations)
+
+
+def _tracker(
+  vm: Instance,
+  tasks: List[Dict],
+  show_progress: bool,
+  renderer: ProgressRenderer
+) -> Tracker:
+  tracker = None
+  if renderer:
+    tracker = Tracker(len(tasks), name=f'{vm.zone}/{vm.name}',
+                      renderer=renderer, eta=_eta(vm, tasks))
+  elif show_progress:
+    tracker = Tracker(len(tasks), eta=_eta(vm, tasks))
+  if tracker:
+    tracker.start()
+  return tracker
+
+
+def _journal(vm: Instance, action: str) -> Journal:
+  """Journal of the interrupted execution being resumed, or a new one."""
+  if vm.journal is None or vm.journal.action != action:
+    vm.journal = Journal.new(vm, action)
+  else:
+    _logger.info(f'Resuming {action}, done: {vm.journal.data["done"]}.')
+  return vm.journal
+
+
+def _finish(vm: Instance, tracker: Tracker) -> None:
+  if tracker:
+    tracker.finish()
+  vm.journal.remove()
+  vm.journal = None
+
+  read_cache = getattr(vm.compute, 'read_cache', None)
+  if read_cache:
+    _logger.info(f'API read cache: {read_cache}.')
+
+
+def call_tasks(
+  vm: Instance,
+  action: str,
+  show_progress: bool = True,
+  renderer: ProgressRenderer = None
+) -> None:
+  """ Execute the tasks graph. The progress is printed on its own, or
+  as one of the bars of renderer when provided. With engine=asyncio it
+  only runs call_tasks_async() until it is done. """
+  if get_config('engine') == 'asyncio':
+    run_async(call_tasks_async(vm, action, show_progress, renderer))
+    return
+
+  tasks = _journal(vm, action).wrap(
+    timings.wrap(vm, _list_tasks(vm = vm, action = action)))
+  tracker = _tracker(vm, tasks, show_progress, renderer)
+
+  def _advance(_):
+    if tracker:
+      tracker.advance(step = 1)
+
+  try:
+    with tracing.span(action, 'action', vm=f'{vm.zone}/{vm.name}'):
+      run_tasks(tasks, on_done=_advance)
+  finally:
+    # Also the steps completed before a failure.
+    timings.save()
+  _finish(vm, tracker)
 
-  tracker = Tracker(total_tasks)
-  tracker.start()
 
-  for task in tasks:
-    execute = task['name']
-    args = task['args'][0]
+async def call_tasks_async(
+  vm: Instance,
+  action: str,
+  show_progress: bool = True,
+  renderer: ProgressRenderer = None
+) -> None:
+  """ Execute the tasks graph on the running event loop, the steps run in
+  its default executor. """
+  tasks = _journal(vm, action).wrap(
+    timings.wrap(vm, _list_tasks(vm = vm, action = action)))
+  tracker = _tracker(vm, tasks, show_progress, renderer)
 
-    execute(**args)
-    tracker.advance(step = 1)
+  def _advance(_):
+    if tracker:
+      tracker.advance(step = 1)
 
-  if async_backup_thread:
-    _logger.info(f'Waiting for async backup to finish')
-    take_snapshot(vm, join_snapshot=True)
-    _logger.info('done.')
-  tracker.finish()
+  try:
+    with tracing.span(action, 'action', vm=f'{vm.zone}/{vm.name}'):
+      await run_tasks_async(tasks, on_done=_advance)
+  finally:
+    timings.save()
+  _finish(vm, tracker)
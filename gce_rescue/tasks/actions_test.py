@@ -0,0 +1,83 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for actions.py."""
+
+from absl.testing import absltest
+from gce_rescue.gce import Instance
+from gce_rescue.tasks import actions
+from gce_rescue.tasks.scheduler import validate_tasks
+from gce_rescue.test.mocks import MOCK_TEST_VM
+
+
+def _requires(tasks, task_id, dependency) -> bool:
+  """True if task_id can only start after dependency is done."""
+  by_id = {task['id']: task for task in tasks}
+  pending = list(by_id[task_id]['after'])
+  while pending:
+    current = pending.pop()
+    if current == dependency:
+      return True
+    pending.extend(by_id[current]['after'])
+  return False
+
+
+class ActionsTest(absltest.TestCase):
+  vm: Instance
+
+
+  def setUp(self):
+    self.vm = Instance(test_mode=True, **MOCK_TEST_VM)
+
+
+  def test_set_rescue_mode_graph(self):
+    tasks = actions._list_tasks(self.vm, 'set_rescue_mode') # pylint: disable=protected-access
+    validate_tasks(tasks)
+    self.assertTrue(_requires(tasks, 'detach_boot', 'stop'))
+    self.assertTrue(_requires(tasks, 'start', 'set_metadata'))
+    self.assertTrue(_requires(tasks, 'attach_original', 'label_boot'))
+    self.assertFalse(_requires(tasks, 'create_disk', 'stop'))
+    self.assertFalse(_requires(tasks, 'start', 'label_boot'))
+
+
+  def test_reset_rescue_mode_graph(self):
+    tasks = actions._list_tasks(self.vm, 'reset_rescue_mode') # pylint: disable=protected-access
+    validate_tasks(tasks)
+    self.assertTrue(_requires(tasks, 'detach_rescue', 'stop'))
+    self.assertTrue(_requires(tasks, 'attach_original', 'detach_original'))
+    self.assertTrue(_requires(tasks, 'start', 'attach_original'))
+    self.assertFalse(_requires(tasks, 'start', 'delete_disk'))
+
+
+  def test_helper_vm_graph(self):
+    self.vm._helper_vm = 'helper' # pylint: disable=protected-access
+    tasks = actions._list_tasks(self.vm, 'set_rescue_mode') # pylint: disable=protected-access
+    validate_tasks(tasks)
+    self.assertTrue(_requires(tasks, 'attach_helper', 'detach_boot'))
+    self.assertTrue(_requires(tasks, 'attach_helper', 'label_boot'))
+    self.assertFalse(_requires(tasks, 'label_boot', 'stop'))
+    self.assertNotIn('create_disk', [task['id'] for task in tasks])
+
+    tasks = actions._list_tasks(self.vm, 'reset_rescue_mode') # pylint: disable=protected-access
+    validate_tasks(tasks)
+    self.assertTrue(_requires(tasks, 'start', 'detach_helper'))
+
+
+  def test_unknown_action(self):
+    with self.assertRaises(ValueError):
+      actions._list_tasks(self.vm, 'unknown') # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+  absltest.main()
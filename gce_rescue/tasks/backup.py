@@ -15,12 +15,20 @@
 """ Different operations to guarantee VM disks backup, before performing
     any modifications."""
 
+from gce_rescue.config import get_config
 from gce_rescue.tasks.keeper import wait_for_operation
-from typing import Dict, List
+from gce_rescue.tasks.snapshots import SnapshotJob, manager
+from gce_rescue.tasks.validations import batch
+from googleapiclient.errors import HttpError
+from typing import Callable, Dict, List
 import logging
 
 _logger = logging.getLogger(__name__)
 
+# Label of the original boot disk with the backup method used, to find the
+# backup when the instance is restored.
+BACKUP_LABEL = 'rescue-backup'
+
 def backup_metadata_items(data: Dict) -> List:
   """ Returns the "items" content (ssh-keys, scripts, etc) to be restored
   at the end of the process. After the instance booted and executed
@@ -30,27 +38,143 @@ def backup_metadata_items(data: Dict) -> List:
     return data['metadata']['items']
   return []
 
-def create_snapshot(vm) -> Dict:
-  """
-  Create a snaphost of the instance boot disk, adding self._ts to the disk name.
-  https://cloud.google.com/compute/docs/reference/rest/v1/disks/createSnapshot
-  Returns:
-    operation-result: Dict
+def backup_method() -> str:
+  """ Backup of the boot disk taken before setting rescue mode:
+    snapshot: standard snapshot, durable but the slowest to complete.
+    instant-snapshot: zonal instant snapshot, ready in seconds.
+    clone: a new disk created from the boot disk.
+    none: no backup (--skip-snapshot).
   """
+  if get_config('skip-snapshot'):
+    return 'none'
+  return get_config('backup')
 
-  disk_name = vm.disks['disk_name']
+def backup_name(vm) -> str:
+  """ Name of the snapshot, instant snapshot or disk clone. """
+  return f"{vm.disks['disk_name']}-{vm.ts}"
+
+def _source_disk(vm) -> str:
+  return f"projects/{vm.project}/zones/{vm.zone}/disks/{vm.disks['disk_name']}"
+
+def snapshot_request_body(vm, disk: str = None) -> Dict:
+  """ Body of disks().createSnapshot for disk, the boot disk by default. """
   # Patch issues/23
   region = vm.zone[:-2]
-  snapshot_name = f'{disk_name}-{vm.ts}'
-  snapshot_body = {
-    'name': snapshot_name,
+  return {
+    'name': f'{disk}-{vm.ts}' if disk else backup_name(vm),
     'storageLocations': [ region ]
   }
+
+def instant_snapshot_request_body(vm) -> Dict:
+  """ Body of instantSnapshots().insert for the boot disk. """
+  return {
+    'name': backup_name(vm),
+    'sourceDisk': _source_disk(vm)
+  }
+
+def clone_request_body(vm, source: Dict) -> Dict:
+  """ Body of disks().insert to clone the boot disk, source is the boot
+  disk as returned by disks().get. """
+  return {
+    'name': backup_name(vm),
+    'sourceDisk': _source_disk(vm),
+    'type': source['type'],
+    'sizeGb': source['sizeGb']
+  }
+
+def snapshot_disk(vm, job: SnapshotJob) -> Dict:
+  """
+  Create the snapshot of job, adding vm.ts to the disk name.
+  https://cloud.google.com/compute/docs/reference/rest/v1/disks/createSnapshot
+  Returns:
+    operation-result: Dict
+  """
+
+  snapshot_body = snapshot_request_body(vm, job.disk)
   _logger.info(f'Creating snapshot {snapshot_body}... ')
   operation = vm.compute.disks().createSnapshot(
     **vm.project_data,
-    disk = disk_name,
+    disk = job.disk,
     body = snapshot_body).execute()
-  result = wait_for_operation(vm, oper=operation)
-  return result
+  job.operation = operation['name']
+  return wait_for_operation(vm, oper=operation,
+                            timeout=get_config('backup-timeout'))
+
+def create_snapshot(vm) -> Dict:
+  """
+  Snapshot the boot disk, and the data disks with --snapshot-data-disks,
+  in parallel, see snapshots.py.
+  Returns:
+    operation-result of the boot disk snapshot: Dict
+  """
+
+  manager.start(vm, snapshot_disk)
+  return manager.join(vm)[0]
+
+def create_instant_snapshot(vm) -> Dict:
+  """
+  Create an instant snapshot of the boot disk, in the zone of the disk.
+  https://cloud.google.com/compute/docs/reference/rest/v1/instantSnapshots/insert
+  Returns:
+    operation-result: Dict
+  """
+
+  body = instant_snapshot_request_body(vm)
+  _logger.info(f'Creating instant snapshot {body}... ')
+  operation = vm.compute.instantSnapshots().insert(
+    **vm.project_data,
+    body = body).execute()
+  return wait_for_operation(vm, oper=operation,
+                            timeout=get_config('backup-timeout'))
+
+def create_clone(vm) -> Dict:
+  """
+  Clone the boot disk, with the same type and size.
+  https://cloud.google.com/compute/docs/disks/create-disk-from-source
+  Returns:
+    operation-result: Dict
+  """
+
+  source = batch.execute(vm.compute.disks().get(
+    **vm.project_data,
+    disk = vm.disks['disk_name']))
+  body = clone_request_body(vm, source)
+  _logger.info(f'Creating disk clone {body}... ')
+  operation = vm.compute.disks().insert(
+    **vm.project_data,
+    body = body).execute()
+  return wait_for_operation(vm, oper=operation,
+                            timeout=get_config('backup-timeout'))
+
+# Function creating each backup method.
+BACKUPS: Dict[str, Callable] = {
+  'snapshot': create_snapshot,
+  'instant-snapshot': create_instant_snapshot,
+  'clone': create_clone,
+}
+
+def create_backup(vm) -> Dict:
+  """ Backup the boot disk with the configured method. """
+  return BACKUPS[vm.backup_method](vm)
 
+def find_backup(vm) -> str:
+  """ Name of the backup of the instance in rescue mode, empty if it was
+  not taken or it was removed. """
+  if vm.backup_method == 'none':
+    return ''
+  name = backup_name(vm)
+  if vm.backup_method == 'snapshot':
+    request = vm.compute.snapshots().get(project = vm.project,
+                                         snapshot = name)
+  elif vm.backup_method == 'instant-snapshot':
+    request = vm.compute.instantSnapshots().get(**vm.project_data,
+                                                instantSnapshot = name)
+  else:
+    request = vm.compute.disks().get(**vm.project_data, disk = name)
+  try:
+    batch.execute(request)
+  except HttpError:
+    _logger.info(f'{vm.backup_method} {name} was not found for VM in active '
+                 'rescue mode')
+    return ''
+  return name
@@ -14,7 +14,10 @@
 
 """Test code for backup.py."""
 
+from unittest import mock
+
 from absl.testing import absltest
+from gce_rescue.config import config
 from gce_rescue.tasks import backup
 from gce_rescue.test.mocks import mock_api_object, MOCK_TEST_VM
 from gce_rescue.gce import Instance
@@ -42,5 +45,27 @@ class BackupTest(absltest.TestCase):
     backup.create_snapshot(self.vm)
 
 
+  def test_instant_snapshot(self):
+    backup.create_instant_snapshot(self.vm)
+
+
+  def test_backup_timeout(self):
+    with mock.patch.object(backup, 'wait_for_operation') as wait, \
+         mock.patch.dict(config, {'backup-timeout': 7200}):
+      backup.create_instant_snapshot(self.vm)
+    self.assertEqual(wait.call_args[1]['timeout'], 7200)
+
+
+  def test_clone_request_body(self):
+    source = {'type': 'zones/z/diskTypes/pd-ssd', 'sizeGb': '200'}
+    body = backup.clone_request_body(self.vm, source)
+    self.assertEqual(body['name'], f'{self.vm.disks["disk_name"]}-{self.vm.ts}')
+    self.assertEqual(body['sourceDisk'],
+                     f'projects/{self.vm.project}/zones/{self.vm.zone}/disks/'
+                     f'{self.vm.disks["disk_name"]}')
+    self.assertEqual((body['type'], body['sizeGb']),
+                     ('zones/z/diskTypes/pd-ssd', '200'))
+
+
 if __name__ == '__main__':
   absltest.main()
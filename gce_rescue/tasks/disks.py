@@ -14,21 +14,107 @@
 
 """ Compilations of all disks tasks related. """
 
-from typing import Dict
+from typing import Dict, Optional
 import logging
-from threading import Thread
+import re
 
 import googleapiclient.errors
 
 from gce_rescue.tasks.keeper import wait_for_operation
-from gce_rescue.tasks.backup import create_snapshot
-from gce_rescue.utils import ThreadHandler as Handler
-from googleapiclient.errors import HttpError
+from gce_rescue.tasks.backup import BACKUP_LABEL
+from gce_rescue.tasks.images import resolve_image
+from gce_rescue.tasks.pool import POOL_DISK_TYPE, claim_disk
+from gce_rescue.config import get_config
+from gce_rescue.tasks.validations import batch
 
 _logger = logging.getLogger(__name__)
-snapshot_thread = None
 
-def _create_rescue_disk(vm, source_disk: str) -> Dict:
+DEFAULT_DISK_TYPE = 'pd-balanced'
+# Machine families without Persistent Disk support, only Hyperdisk.
+HYPERDISK_ONLY_FAMILIES = ('c4', 'c4a', 'c4d', 'n4', 'x4', 'm4', 'a4', 'h4d')
+# From this number of vCPUs the rescue disk is SSD, even if the boot disk
+# isn't, so the repair work isn't limited by the disk.
+SSD_MIN_VCPUS = 16
+# With --helper-vm the target has no boot disk while in rescue mode, these
+# labels of its boot disk keep the state: helper instance, target instance
+# and device name of the boot disk on the target.
+HELPER_LABEL = 'rescue-helper'
+TARGET_LABEL = 'rescue-vm'
+DEVICE_LABEL = 'rescue-device'
+
+
+def machine_vcpus(machine_type: str) -> int:
+  """n2-standard-32 -> 32, n2-custom-8-16384 -> 8, 0 for shared core
+  types as e2-medium."""
+  match = re.search(r'-custom-(\d+)-', machine_type)
+  if not match:
+    match = re.search(r'-(\d+)(?:-lssd)?$', machine_type)
+  return int(match.group(1)) if match else 0
+
+
+def select_disk_type(machine_type: str, boot_disk_type: str) -> str:
+  """ Rescue disk type for --rescue-disk-type auto, from the machine type
+  and the type of the original boot disk (names or URLs). """
+  machine_type = machine_type.split('/')[-1]
+  boot_disk_type = boot_disk_type.split('/')[-1]
+  family = machine_type.split('-')[0]
+  if family in HYPERDISK_ONLY_FAMILIES or boot_disk_type.startswith(
+      'hyperdisk'):
+    return 'hyperdisk-balanced'
+  if (boot_disk_type in ('pd-ssd', 'pd-extreme') or
+      machine_vcpus(machine_type) >= SSD_MIN_VCPUS):
+    return 'pd-ssd'
+  return DEFAULT_DISK_TYPE
+
+
+def rescue_disk_type(vm, boot_disk: Optional[Dict] = None) -> str:
+  """ Type of the rescue disk, boot_disk (disks().get of the original boot
+  disk) is only required by the auto mode. """
+  disk_type = get_config('rescue-disk-type')
+  if disk_type != 'auto':
+    return disk_type
+  disk_type = select_disk_type(vm.data['machineType'], boot_disk['type'])
+  _logger.info(f'Selected rescue disk type {disk_type}.')
+  return disk_type
+
+
+def rescue_disk_body(
+  vm,
+  source_disk: str,
+  disk_type: str = DEFAULT_DISK_TYPE
+) -> Dict:
+  """ Body of disks().insert for the rescue disk. Without
+  rescue-disk-size the disk has the size of the image. """
+  body = {
+    'name': vm.rescue_disk,
+    'sourceImage': source_disk,
+    'type': f'projects/{vm.project}/zones/{vm.zone}/diskTypes/{disk_type}'
+  }
+  if get_config('rescue-disk-size'):
+    body['sizeGb'] = str(get_config('rescue-disk-size'))
+  return body
+
+
+def use_warm_pool(disk_type: str) -> bool:
+  """ Pool disks have the default type and the size of the image. """
+  return (bool(get_config('warm-pool')) and disk_type == POOL_DISK_TYPE and
+          not get_config('rescue-disk-size'))
+
+
+def _boot_disk(vm) -> Optional[Dict]:
+  """ Original boot disk, only read when the auto disk type needs it. """
+  if get_config('rescue-disk-type') != 'auto':
+    return None
+  return batch.execute(vm.compute.disks().get(
+    **vm.project_data,
+    disk = vm.disks['disk_name']))
+
+
+def _create_rescue_disk(
+  vm,
+  source_disk: str,
+  disk_type: Optional[str] = None
+) -> Dict:
   """ Create new temporary rescue disk based on source_disk.
   https://cloud.google.com/compute/docs/reference/rest/v1/disks/insert
   Returns:
@@ -37,9 +123,9 @@ def _create_rescue_disk(vm, source_disk: str) -> Dict:
 
   chk_disk_exist = {}
   try:
-    chk_disk_exist = vm.compute.disks().get(
+    chk_disk_exist = batch.execute(vm.compute.disks().get(
       **vm.project_data,
-      disk = vm.rescue_disk).execute()
+      disk = vm.rescue_disk))
   except googleapiclient.errors.HttpError as e:
     if e.status_code == 404:
       _logger.info(f'Creating rescue disk {vm.rescue_disk}...')
@@ -55,19 +141,32 @@ def _create_rescue_disk(vm, source_disk: str) -> Dict:
     _logger.info(f'Disk {vm.rescue_disk} already exist. Skipping...')
     return {}
 
-  disk_body = {
-    'name': vm.rescue_disk,
-    'sourceImage': source_disk,
-    'type': f'projects/{vm.project}/zones/{vm.zone}/diskTypes/pd-balanced'
-  }
+  source_disk = resolve_image(vm.compute, source_disk)
+  disk_type = disk_type or rescue_disk_type(vm, _boot_disk(vm))
   operation = vm.compute.disks().insert(
     **vm.project_data,
-    body = disk_body).execute()
+    body = rescue_disk_body(vm, source_disk, disk_type)).execute()
 
   result = wait_for_operation(vm, oper=operation)
   return result
 
 
+def disk_label_body(vm, label_fingerprint: str) -> Dict:
+  """ Body of disks().setLabels to identify the original boot disk. """
+  labels = {
+    'rescue': vm.ts,
+    BACKUP_LABEL: vm.backup_method
+  }
+  if vm.helper_vm:
+    labels[HELPER_LABEL] = vm.helper_vm
+    labels[TARGET_LABEL] = vm.name
+    labels[DEVICE_LABEL] = vm.disks['device_name']
+  return {
+    'labels': labels,
+    'labelFingerprint': label_fingerprint
+  }
+
+
 def _set_disk_label(vm, disk_name = str) -> Dict:
   """ Set labels.rescue=TS to be able to idenfied the boot disk when restore
   the VM to the normal configuration.
@@ -76,23 +175,13 @@ def _set_disk_label(vm, disk_name = str) -> Dict:
     operation-result: Dict
   """
 
-  name_filter = f'name={disk_name}'
-  response = list_disk(
-    vm,
-    project_data=vm.project_data,
-    label_filter=name_filter
-  )
-  label_fingerprint = response[0]['labelFingerprint']
-  request_body = {
-    'labels': {
-        'rescue': vm.ts
-    },
-    'labelFingerprint': label_fingerprint
-  }
-  operation = vm.compute.disks().setLabels(
+  label_fingerprint = batch.execute(vm.compute.disks().get(
+    **vm.project_data,
+    disk = disk_name))['labelFingerprint']
+  operation = batch.execute(vm.compute.disks().setLabels(
     **vm.project_data,
     resource = disk_name,
-    body = request_body).execute()
+    body = disk_label_body(vm, label_fingerprint)))
 
   return operation
 
@@ -130,79 +219,94 @@ def list_disk(vm, project_data: Dict, label_filter: str) -> Dict:
   return result['items']
 
 
-def attach_disk(
+def label_disk(vm, disk_name: str) -> None:
+  """ Set labels.rescue=TS on disk_name and check the result. """
+  # setLabels may return before the operation is DONE.
+  request = wait_for_operation(vm, oper=_set_disk_label(vm, disk_name))
+  if request['status'] != 'DONE':
+    _logger.error(f'Unable to set label to disk {disk_name}.')
+    raise Exception(request)
+  else:
+    _logger.info(f'Label configured successfully disk {disk_name}.')
+
+
+def attach_disk_body(
   vm,
   disk_name: str,
   device_name: str,
   boot: bool = False
 ) -> Dict:
-  """
-  Attach disk on the instance. By default it will attach as secundary
-  https://cloud.google.com/compute/docs/reference/rest/v1/instances/attachDisk
-  Returns:
-      operation-result: Dict
-  """
-  if not boot:
-    request = _set_disk_label(vm, disk_name)
-    if request['status'] != 'DONE':
-      _logger.error(f'Unable to set label to disk {disk_name}.')
-      raise Exception(request)
-    else:
-      _logger.info(f'Label configured successfully disk {disk_name}.')
-  attach_disk_body = {
+  """ Body of instances().attachDisk. """
+  return {
     'boot': boot,
     'name': disk_name,
     'deviceName': device_name,
     'type': 'PERSISTENT',
     'source': f'projects/{vm.project}/zones/{vm.zone}/disks/{disk_name}'
   }
+
+
+def attach_disk(
+  vm,
+  disk_name: str,
+  device_name: str,
+  boot: bool = False,
+  set_label: bool = True,
+  instance: Optional[str] = None
+) -> Dict:
+  """
+  Attach disk on the instance, or on another instance of the same zone. By
+  default it will attach as secundary and label it, unless set_label=False.
+  https://cloud.google.com/compute/docs/reference/rest/v1/instances/attachDisk
+  Returns:
+      operation-result: Dict
+  """
+  if not boot and set_label:
+    label_disk(vm, disk_name)
   _logger.info(f'Attaching disk {disk_name}...')
   operation = vm.compute.instances().attachDisk(
     **vm.project_data,
-    instance = vm.name,
-    body = attach_disk_body).execute()
+    instance = instance or vm.name,
+    body = attach_disk_body(vm, disk_name, device_name, boot)).execute()
 
   result = wait_for_operation(vm, oper=operation)
   return result
 
 
-def _detach_disk(vm, disk: str) -> Dict:
-  """ Detach disk from the instance.
+def _detach_disk(vm, disk: str, instance: Optional[str] = None) -> Dict:
+  """ Detach disk from the instance, or from another instance.
   https://cloud.google.com/compute/docs/reference/rest/v1/instances/detachDisk
   """
 
-  _logger.info(f'Detaching disk {disk} from {vm.name}...')
+  instance = instance or vm.name
+  _logger.info(f'Detaching disk {disk} from {instance}...')
   operation = vm.compute.instances().detachDisk(
       **vm.project_data,
-      instance = vm.name,
+      instance = instance,
       deviceName = disk).execute()
   result = wait_for_operation(vm, oper=operation)
   return result
 
 
-def take_snapshot(vm, join_snapshot=None) -> None:
-  global snapshot_thread
-  if not join_snapshot:
-    snapshot_thread = Thread(target=create_snapshot, args=(vm,), daemon=True)
-    snapshot_thread.start()
-  else:
-    snapshot_thread.join()
-
-
-def create_rescue_disk(vm) -> None:
-  device_name = vm.disks['device_name']
-  # task1 = multitasks.Handler(
-  #     target = backup,
-  #     kwargs={'vm' : vm}
-  #     )
-  # task1.start()
-  task2 = Handler(
-    target = _create_rescue_disk,
-    kwargs={'vm': vm, 'source_disk': vm.rescue_source_disk}
-    )
-  task2.start()
-  task2.join()
-  _detach_disk(vm, disk=device_name)
+def prepare_rescue_disk(vm) -> None:
+  """ Create the rescue disk, it doesn't require the instance stopped.
+  With warm-pool enabled a ready disk of the pool is claimed instead, and a
+  new disk is created only when the pool is empty, or the pool disks don't
+  have the requested type or size. """
+  disk_type = rescue_disk_type(vm, _boot_disk(vm))
+  # Run again after a failed claim, the pool disk is no longer used.
+  vm.rescue_disk = ''
+  if use_warm_pool(disk_type) and claim_disk(vm):
+    return
+  _create_rescue_disk(vm, source_disk=vm.rescue_source_disk,
+                      disk_type=disk_type)
+
+
+def detach_boot_disk(vm) -> None:
+  _detach_disk(vm, disk=vm.disks['device_name'])
+
+
+def attach_rescue_disk(vm) -> None:
   attach_disk(
     vm,
     disk_name=vm.rescue_disk,
@@ -210,23 +314,32 @@ def create_rescue_disk(vm) -> None:
     boot=True
   )
 
-def list_snapshot(vm) -> str:
-  snapshot_name = f"{vm.disks['disk_name']}-{vm.ts}"
-  try:
-    result = vm.compute.snapshots().get(
-      snapshot=snapshot_name,
-      project=vm.project
-    ).execute()
-  except HttpError:
-    _logger.info('Snapshot was not found for VM in active rescue mode')
-    return ''
-  return snapshot_name
-
-def restore_original_disk(vm) -> None:
-  """ Restore tasks to the original disk """
-  device_name = vm.disks['device_name']
 
+def label_boot_disk(vm) -> None:
+  label_disk(vm, vm.disks['disk_name'])
+
+
+def attach_original_disk(vm, boot: bool = False) -> None:
+  """ Attach the original boot disk as secondary (rescue mode) or back as
+  boot disk. Labels must already be set by label_boot_disk(). """
+  attach_disk(vm, **vm.disks, boot=boot, set_label=False)
+
+
+def attach_helper_disk(vm) -> None:
+  """ Attach the original boot disk to the helper VM, it keeps the disk
+  name as device name: /dev/disk/by-id/google-DISK_NAME. """
+  disk_name = vm.disks['disk_name']
+  attach_disk(vm, disk_name=disk_name, device_name=disk_name,
+              set_label=False, instance=vm.helper_vm)
+
+
+def detach_helper_disk(vm) -> None:
+  _detach_disk(vm, disk=vm.disks['disk_name'], instance=vm.helper_vm)
+
+
+def detach_rescue_disk(vm) -> None:
   _detach_disk(vm, disk=vm.rescue_disk)
-  _detach_disk(vm, disk=device_name)
+
+
+def delete_rescue_disk(vm) -> None:
   _delete_rescue_disk(vm, disk_name=vm.rescue_disk)
-  attach_disk(vm, **vm.disks, boot=True)
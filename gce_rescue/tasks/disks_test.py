@@ -14,9 +14,13 @@
 
 """Test code for disks.py."""
 
+from unittest import mock
+
 from absl.testing import absltest
 from absl import logging
 
+from gce_rescue.config import config
+
 from gce_rescue.gce import Instance
 from gce_rescue.tasks import disks
 from gce_rescue.test.mocks import (
@@ -46,7 +50,7 @@ class DisksTest(absltest.TestCase):
   def test_attach_disk(self):
     self.vm.compute = mock_api_object([
       'disks',
-      'disks',
+      'disk',
       'operations',
       'operations',
     ])
@@ -73,17 +77,48 @@ class DisksTest(absltest.TestCase):
       'operations',
       'disks',
     ])
-    disks.create_rescue_disk(self.vm)
+    disks.prepare_rescue_disk(self.vm)
+    disks.detach_boot_disk(self.vm)
+    disks.attach_rescue_disk(self.vm)
+
+
+  def test_select_disk_type(self):
+    cases = [
+      ('e2-medium', 'pd-standard', 'pd-balanced'),
+      ('e2-medium', 'pd-ssd', 'pd-ssd'),
+      ('n2-standard-32', 'pd-balanced', 'pd-ssd'),
+      ('n2-custom-4-16384', 'pd-balanced', 'pd-balanced'),
+      ('c3-standard-8', 'hyperdisk-balanced', 'hyperdisk-balanced'),
+      ('n4-standard-2', 'hyperdisk-balanced', 'hyperdisk-balanced'),
+      ('zones/z/machineTypes/c4-standard-4',
+       'projects/p/zones/z/diskTypes/hyperdisk-balanced',
+       'hyperdisk-balanced'),
+    ]
+    for machine_type, boot_disk_type, expected in cases:
+      self.assertEqual(
+        disks.select_disk_type(machine_type, boot_disk_type), expected,
+        (machine_type, boot_disk_type))
+
+
+  def test_rescue_disk_body(self):
+    with mock.patch.dict(config, {'rescue-disk-size': 50}):
+      body = disks.rescue_disk_body(self.vm, 'image', 'pd-ssd')
+    self.assertEndsWith(body['type'], '/diskTypes/pd-ssd')
+    self.assertEqual(body['sizeGb'], '50')
+    self.assertNotIn('sizeGb', disks.rescue_disk_body(self.vm, 'image'))
 
 
-  def test_restore_original_disk(self):
+  def test_restore_original_disks(self):
     self.vm.compute = mock_api_object([
       'operations',
       'operations',
       'operations',
       'operations',
     ])
-    disks.restore_original_disk(self.vm)
+    disks.detach_rescue_disk(self.vm)
+    disks.detach_boot_disk(self.vm)
+    disks.delete_rescue_disk(self.vm)
+    disks.attach_original_disk(self.vm, boot=True)
 
 
 if __name__ == '__main__':
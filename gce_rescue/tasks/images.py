@@ -0,0 +1,77 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Resolve the image family of the rescue disks to a concrete image, once
+    per execution (or per image-cache-ttl seconds in long running processes),
+    so every disk created meanwhile, e.g. of a fleet or of the warm pool,
+    uses the same image version.
+    https://cloud.google.com/compute/docs/reference/rest/v1/images/getFromFamily
+"""
+
+import logging
+import re
+import threading
+from time import time
+from typing import Dict, Optional, Tuple
+
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+# (image project, family) -> (image selfLink, expiration time).
+_cache: Dict[Tuple[str, str], Tuple[str, float]] = {}
+_lock = threading.Lock()
+
+
+def parse_family(source_image: str) -> Optional[Tuple[str, str]]:
+  """projects/debian-cloud/global/images/family/debian-11 ->
+  ('debian-cloud', 'debian-11'), None if it is not an image family. Family
+  names are per architecture (e.g. debian-11-arm64)."""
+  match = re.search(r'projects/([^/]+)/global/images/family/([^/]+)$',
+                    source_image)
+  return match.groups() if match else None
+
+
+def resolve_image(compute: Resource, source_image: str) -> str:
+  """Concrete image of the source_image family. source_image is returned
+  as it is when it is not a family or it can't be resolved, the family is
+  then resolved by disks().insert as before."""
+
+  key = parse_family(source_image)
+  if key is None:
+    return source_image
+
+  # Held during the request, concurrent callers wait for the same result.
+  with _lock:
+    cached = _cache.get(key)
+    if cached and cached[1] > time():
+      return cached[0]
+    try:
+      image = compute.images().getFromFamily(
+        project=key[0],
+        family=key[1]).execute()
+    except HttpError as e:
+      _logger.info(f'Unable to resolve {source_image}: {e}')
+      return source_image
+    _logger.info(f'Image family {key[1]} resolved to {image["name"]}.')
+    _cache[key] = (image['selfLink'], time() + get_config('image-cache-ttl'))
+    return image['selfLink']
+
+
+def clear_cache() -> None:
+  with _lock:
+    _cache.clear()
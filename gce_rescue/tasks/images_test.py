@@ -0,0 +1,71 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for images.py."""
+
+from unittest import mock
+
+from absl.testing import absltest
+from gce_rescue.config import config
+from gce_rescue.tasks import images
+from gce_rescue.test.mocks import mock_api_responses, ok_response
+
+FAMILY = 'projects/debian-cloud/global/images/family/debian-11'
+IMAGE = {
+  'name': 'debian-11-v1',
+  'selfLink': 'https://compute.googleapis.com/compute/v1/projects/'
+              'debian-cloud/global/images/debian-11-v1',
+}
+
+
+class ImagesTest(absltest.TestCase):
+
+  def setUp(self):
+    images.clear_cache()
+
+
+  def test_parse_family(self):
+    self.assertEqual(images.parse_family(FAMILY), ('debian-cloud', 'debian-11'))
+    self.assertIsNone(images.parse_family(IMAGE['selfLink']))
+
+
+  def test_resolve_once(self):
+    compute = mock_api_responses([ok_response(IMAGE)])
+    self.assertEqual(images.resolve_image(compute, FAMILY), IMAGE['selfLink'])
+    # The mock has no more responses, it must come from the cache.
+    self.assertEqual(images.resolve_image(compute, FAMILY), IMAGE['selfLink'])
+
+
+  def test_resolve_expired(self):
+    compute = mock_api_responses([ok_response(IMAGE), ok_response({
+      'name': 'debian-11-v2', 'selfLink': 'global/images/debian-11-v2'})])
+    with mock.patch.dict(config, {'image-cache-ttl': 0}):
+      images.resolve_image(compute, FAMILY)
+      self.assertEqual(images.resolve_image(compute, FAMILY),
+                       'global/images/debian-11-v2')
+
+
+  def test_not_a_family(self):
+    compute = mock_api_responses([])
+    self.assertEqual(images.resolve_image(compute, IMAGE['selfLink']),
+                     IMAGE['selfLink'])
+
+
+  def test_resolve_error(self):
+    compute = mock_api_responses([({'status': '403'}, '{}')])
+    self.assertEqual(images.resolve_image(compute, FAMILY), FAMILY)
+
+
+if __name__ == '__main__':
+  absltest.main()
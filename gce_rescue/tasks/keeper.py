@@ -17,50 +17,179 @@
 """keeper that the progress of the tasks. """
 
 import googleapiclient.discovery
-from time import sleep
-from typing import Dict
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpRequest
+from time import sleep, time
+from typing import Dict, Iterator
 import logging
-import json
+
+from gce_rescue import tracing
+from gce_rescue.config import get_config
+from gce_rescue.tasks.validations import batch
 
 _logger = logging.getLogger(__name__)
 
+# Fallback polling delays (seconds), when zoneOperations().wait can't be used.
+POLL_MIN_DELAY = 0.5
+POLL_MAX_DELAY = 10
+POLL_BACKOFF = 1.5
+
+# Guest attribute written by the rescue startup-script when it ends, its value
+# is the ts of the execution.
+READY_ATTRIBUTE = 'gce-rescue/ready'
+READY_POLL_DELAY = 1
+SERIAL_POLL_DELAY = 2
+
 
 def wait_for_operation(
   instance_obj: googleapiclient.discovery.Resource,
-  oper: Dict
+  oper: Dict,
+  timeout: int = None
 ) -> Dict:
-  """ Creating poll to wait the operation to finish. """
+  """ Wait the operation to finish.
+  zoneOperations().wait blocks on the server side until the operation is DONE
+  (or about 2 minutes have passed), so the result is known as soon as the
+  operation finishes with a single request. If the wait call fails, fall back
+  to zoneOperations().get with an adaptive backoff. The operation is recorded
+  in the journal of the instance, to wait on it again with --resume.
+  https://cloud.google.com/compute/docs/reference/rest/v1/zoneOperations/wait
+  Raises:
+    TimeoutError: if the operation is not DONE after timeout seconds.
+  """
 
-  while True:
-    if oper['status'] == 'DONE':
-      _logger.info('done.')
-      if 'error' in oper:
-        raise Exception(oper['error'])
-      return oper
+  if timeout is None:
+    timeout = get_config('operation-timeout')
+  deadline = time() + timeout
+  delay = POLL_MIN_DELAY
+  long_poll = True
 
-    oper = instance_obj.compute.zoneOperations().get(
-      **instance_obj.project_data,
-      operation = oper['name']).execute()
-    sleep(1)
+  journal = getattr(instance_obj, 'journal', None)
+  if journal:
+    journal.started(instance_obj, oper['name'])
 
-def wait_for_os_boot(vm: googleapiclient.discovery.Resource) -> bool:
-  """Wait guest OS to complete the boot proccess."""
+  with tracing.span('wait_for_operation', 'wait',
+                    operation=oper['name']) as span_args:
+    span_args['requests'] = 0
+    while True:
+      if oper['status'] == 'DONE':
+        _logger.info('done.')
+        if 'error' in oper:
+          raise Exception(oper['error'])
+        return oper
+
+      if time() >= deadline:
+        raise TimeoutError(
+          f'Operation {oper["name"]} is still {oper["status"]} after '
+          f'{timeout}s.'
+        )
+
+      operations = instance_obj.compute.zoneOperations()
+      if long_poll:
+        span_args['requests'] += 1
+        try:
+          oper = operations.wait(
+            **instance_obj.project_data,
+            operation = oper['name']).execute()
+          continue
+        except HttpError as e:
+          _logger.debug(
+            f'zoneOperations().wait failed, polling instead: {e}')
+          long_poll = False
+
+      sleep(min(delay, max(deadline - time(), 0)))
+      span_args['requests'] += 1
+      delay = min(delay * POLL_BACKOFF, POLL_MAX_DELAY)
+      oper = batch.execute(operations.get(
+        **instance_obj.project_data,
+        operation = oper['name']))
+
+def serial_console_chunks(
+  vm: googleapiclient.discovery.Resource,
+  start: int = 0,
+  wait_time: int = 2
+) -> Iterator[str]:
+  """Yield the serial console output as it is written, one chunk per poll.
+  Only the bytes after the last `next` offset are requested, so each poll
+  costs the size of the new output instead of the whole buffer.
+  https://cloud.google.com/compute/docs/reference/rest/v1/instances/getSerialPortOutput
+  """
 
-  timeout = 60
-  wait_time = 2
-  end_string = f'END:{vm.ts}'
-  _logger.info('Waiting startup-script to complete.')
   while True:
     result = vm.compute.instances().getSerialPortOutput(
       **vm.project_data,
-      instance = vm.name
+      instance = vm.name,
+      start = start
     ).execute()
+    start = int(result.get('next', start))
+    yield result.get('contents', '')
+    sleep(wait_time)
 
-    if end_string in json.dumps(result):
-      _logger.info('startup-script has ended.')
-      return True
 
-    sleep(wait_time)
-    timeout -= wait_time
-    if not timeout:
-      return False
\ No newline at end of file
+def serial_console_lines(
+  vm: googleapiclient.discovery.Resource,
+  start: int = 0,
+  wait_time: int = 2
+) -> Iterator[str]:
+  """Yield the serial console output line by line, as it is written."""
+
+  pending = ''
+  for chunk in serial_console_chunks(vm, start=start, wait_time=wait_time):
+    *lines, pending = (pending + chunk).split('\n')
+    yield from lines
+
+
+def ready_attribute_request(vm) -> HttpRequest:
+  """Read the READY_ATTRIBUTE guest attribute, 404 until it is written.
+  https://cloud.google.com/compute/docs/reference/rest/v1/instances/getGuestAttributes
+  """
+  return vm.compute.instances().getGuestAttributes(
+    **vm.project_data,
+    instance = vm.name,
+    variableKey = READY_ATTRIBUTE)
+
+
+def is_ready(vm, guest_attribute: Dict) -> bool:
+  return guest_attribute.get('variableValue') == str(vm.ts)
+
+
+def wait_for_os_boot(vm: googleapiclient.discovery.Resource) -> bool:
+  """Wait guest OS to complete the boot proccess. The startup-script writes
+  the READY_ATTRIBUTE guest attribute when it ends, a single small read each
+  READY_POLL_DELAY seconds. If guest attributes can't be read (e.g. disabled
+  by an organization policy) the serial console is read instead, looking for
+  END:ts. After boot-timeout seconds it gives up and returns False."""
+
+  deadline = time() + get_config('boot-timeout')
+  end_string = f'END:{vm.ts}'
+  # keep the tail of the previous chunk to find a marker split between polls.
+  overlap = ''
+  chunks = None
+  _logger.info('Waiting startup-script to complete.')
+  with tracing.span('wait_for_os_boot', 'wait') as span_args:
+    span_args['source'] = 'guest-attributes'
+    while True:
+      found = False
+      wait_time = READY_POLL_DELAY
+      if chunks is None:
+        try:
+          found = is_ready(vm, ready_attribute_request(vm).execute())
+        except HttpError as e:
+          if e.status_code != 404:
+            _logger.info(f'Unable to read guest attributes, reading the '
+                         f'serial console instead: {e}')
+            span_args['source'] = 'serial-console'
+            chunks = serial_console_chunks(vm, wait_time=0)
+      if chunks is not None:
+        wait_time = SERIAL_POLL_DELAY
+        data = overlap + next(chunks)
+        found = end_string in data
+        overlap = data[-(len(end_string) - 1):]
+
+      if found:
+        _logger.info('startup-script has ended.')
+        span_args['found'] = True
+        return True
+      if time() >= deadline:
+        span_args['found'] = False
+        return False
+      sleep(min(wait_time, max(deadline - time(), 0)))
@@ -0,0 +1,100 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for keeper.py."""
+
+import json
+from unittest import mock
+
+from absl.testing import absltest
+from gce_rescue.gce import Instance
+from gce_rescue.tasks import keeper
+from gce_rescue.test.mocks import mock_api_responses, MOCK_TEST_VM
+
+RUNNING = {'name': 'operation-1', 'status': 'RUNNING'}
+DONE = {'name': 'operation-1', 'status': 'DONE'}
+
+
+class KeeperTest(absltest.TestCase):
+  vm: Instance
+
+
+  def setUp(self):
+    self.vm = Instance(test_mode=True, **MOCK_TEST_VM)
+    self.enter_context(mock.patch.object(keeper, 'POLL_MIN_DELAY', 0))
+
+
+  def test_wait_for_operation(self):
+    """zoneOperations().wait is used while the operation is running."""
+    self.vm.compute = mock_api_responses([
+      ({'status': '200'}, json.dumps(RUNNING)),
+      ({'status': '200'}, json.dumps(DONE)),
+    ])
+    result = keeper.wait_for_operation(self.vm, oper=RUNNING)
+    self.assertEqual(result['status'], 'DONE')
+
+
+  def test_wait_for_operation_fallback(self):
+    """Fall back to zoneOperations().get when wait is not available."""
+    self.vm.compute = mock_api_responses([
+      ({'status': '501'}, '{}'),
+      ({'status': '200'}, json.dumps(RUNNING)),
+      ({'status': '200'}, json.dumps(DONE)),
+    ])
+    result = keeper.wait_for_operation(self.vm, oper=RUNNING)
+    self.assertEqual(result['status'], 'DONE')
+
+
+  def test_wait_for_operation_timeout(self):
+    with self.assertRaises(TimeoutError):
+      keeper.wait_for_operation(self.vm, oper=RUNNING, timeout=0)
+
+
+  def test_wait_for_os_boot(self):
+    """The guest attribute is polled until the startup-script writes it."""
+    self.vm.ts = 1666774335
+    self.vm.compute = mock_api_responses([
+      ({'status': '404'}, '{}'),
+      ({'status': '200'}, json.dumps({'variableValue': '1666774335'})),
+    ])
+    with mock.patch.object(keeper, 'sleep') as sleep:
+      self.assertTrue(keeper.wait_for_os_boot(self.vm))
+    sleep.assert_called_once_with(keeper.READY_POLL_DELAY)
+
+
+  def test_wait_for_os_boot_split_marker(self):
+    """Without guest attributes the serial console is read. The END marker
+    is found even when split between two polls."""
+    self.vm.ts = 1666774335
+    self.vm.compute = mock_api_responses([
+      ({'status': '403'}, '{}'),
+      ({'status': '200'}, json.dumps({'contents': 'END:1666', 'next': 8})),
+      ({'status': '200'}, json.dumps({'contents': '774335\n', 'next': 15})),
+    ])
+    with mock.patch.object(keeper, 'sleep'):
+      self.assertTrue(keeper.wait_for_os_boot(self.vm))
+
+
+  def test_serial_console_lines(self):
+    self.vm.compute = mock_api_responses([
+      ({'status': '200'}, json.dumps({'contents': 'line 1\nli', 'next': 9})),
+      ({'status': '200'}, json.dumps({'contents': 'ne 2\n', 'next': 14})),
+    ])
+    with mock.patch.object(keeper, 'sleep'):
+      lines = keeper.serial_console_lines(self.vm)
+      self.assertEqual([next(lines), next(lines)], ['line 1', 'line 2'])
+
+
+if __name__ == '__main__':
+  absltest.main()
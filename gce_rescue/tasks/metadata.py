@@ -21,12 +21,10 @@ import logging
 
 _logger = logging.getLogger(__name__)
 
-def set_metadata(vm) -> Dict:
-  """Configure Instance custom metadata.
-  https://cloud.google.com/compute/docs/reference/rest/v1/instances/setMetadata
-    a. Set rescue-mode=<ts unique id> if disable=False
-    b. Delete rescue-mode if disable=True
-    c. Replace startup-script with local startup-script.sh content."""
+def rescue_metadata_body(vm) -> Dict:
+  """Body of instances().setMetadata with the rescue startup-script. Guest
+  attributes are enabled for the startup-script to report it has ended,
+  the original items replace them once it did."""
 
   startup_script_file = get_config('startup-script-file')
   device_name = vm.disks['device_name']
@@ -35,19 +33,47 @@ def set_metadata(vm) -> Dict:
     file_content = file_content.replace('GOOGLE_DISK_NAME', device_name)
     file_content = file_content.replace('GOOGLE_TS', str(vm.ts))
 
-  metadata_body = {
+  return {
     'fingerprint': vm.data['metadata']['fingerprint'],
     'items': [{
       'key': 'startup-script',
       'value': file_content
+    }, {
+      'key': 'enable-guest-attributes',
+      'value': 'TRUE'
     }]
   }
+
+
+def restore_metadata_body(vm, remove_rescue_mode: bool = False) -> Dict:
+  """Body of instances().setMetadata with the original items, plus
+  rescue-mode while the instance is in rescue mode. The fingerprint must be
+  refreshed before."""
+
+  if not remove_rescue_mode:
+    vm.backup_items.append({ 'key': 'rescue-mode', 'value': vm.ts })
+  else:
+    vm.backup_items.remove({ 'key': 'rescue-mode', 'value': vm.ts })
+
+  return {
+    'fingerprint': vm.data['metadata']['fingerprint'],
+    'items': vm.backup_items
+  }
+
+
+def set_metadata(vm) -> Dict:
+  """Configure Instance custom metadata.
+  https://cloud.google.com/compute/docs/reference/rest/v1/instances/setMetadata
+    a. Set rescue-mode=<ts unique id> if disable=False
+    b. Delete rescue-mode if disable=True
+    c. Replace startup-script with local startup-script.sh content."""
+
   _logger.info('Setting custom metadata...')
 
   operation = vm.compute.instances().setMetadata(
     **vm.project_data,
     instance = vm.name,
-    body = metadata_body).execute()
+    body = rescue_metadata_body(vm)).execute()
 
   result = wait_for_operation(vm, oper=operation)
   return result
@@ -57,16 +83,7 @@ def restore_metadata_items(vm, remove_rescue_mode: bool = False) -> Dict:
   """Restore original metadata.items after the instance is running again."""
 
   vm.refresh_fingerprint()
-
-  if not remove_rescue_mode:
-    vm.backup_items.append({ 'key': 'rescue-mode', 'value': vm.ts })
-  else:
-    vm.backup_items.remove({ 'key': 'rescue-mode', 'value': vm.ts })
-
-  metadata_body = {
-    'fingerprint': vm.data['metadata']['fingerprint'],
-    'items': vm.backup_items
-  }
+  metadata_body = restore_metadata_body(vm, remove_rescue_mode)
   _logger.info('Restoring original metadata...')
 
   # gce-rescue/issues/21 - continue after wait period timed out
@@ -37,7 +37,7 @@ class MetadataTest(absltest.TestCase):
     self.vm.ts = 1666774335
     self.vm.compute = mock_api_object([
       'compute',
-      'serialconsole',
+      'guestattributes',
       'operations',
     ])
     result = metadata.restore_metadata_items(self.vm)
@@ -0,0 +1,203 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Warm pool of unattached rescue disks, ready to be claimed.
+    Pool disks are labelled with:
+      gce-rescue-pool: ready | claimed
+      gce-rescue-image: last part of the source image, e.g. debian-11
+      gce-rescue-vm: instance name, once claimed
+    A disk is claimed by changing gce-rescue-pool to claimed with setLabels
+    and its labelFingerprint. If another execution claimed the same disk
+    first the fingerprint no longer matches, the request fails and the next
+    disk is tried.
+"""
+
+import atexit
+import logging
+from threading import Thread
+from time import time
+from typing import Dict, List, Optional
+import uuid
+
+from googleapiclient.discovery import Resource
+from googleapiclient.errors import HttpError
+
+from gce_rescue.tasks.images import resolve_image
+from gce_rescue.tasks.keeper import wait_for_operation
+
+_logger = logging.getLogger(__name__)
+
+POOL_LABEL = 'gce-rescue-pool'
+IMAGE_LABEL = 'gce-rescue-image'
+VM_LABEL = 'gce-rescue-vm'
+# Pool disks keep their name once claimed, it identifies them in rescue mode.
+DISK_PREFIX = 'linux-rescue-pool-'
+POOL_DISK_TYPE = 'pd-balanced'
+# Seconds the process waits at exit for the refills still in progress.
+REFILL_EXIT_TIMEOUT = 30
+
+# Refill threads started by claim_disk(), joined at exit.
+_refills: List[Thread] = []
+
+
+class _Location:
+  """Minimal object with the attributes used by wait_for_operation."""
+
+  def __init__(self, compute: Resource, project: str, zone: str):
+    self.compute = compute
+    self.project = project
+    self.zone = zone
+
+  @property
+  def project_data(self) -> Dict[str, str]:
+    return {'project': self.project, 'zone': self.zone}
+
+
+def image_label(source_disk: str) -> str:
+  """projects/debian-cloud/global/images/family/debian-11 -> debian-11"""
+  return source_disk.split('/')[-1]
+
+
+def list_ready_disks(
+  compute: Resource,
+  project: str,
+  zone: str,
+  source_disk: str
+) -> List[Dict]:
+  """Pool disks of source_disk image ready to be claimed."""
+  label_filter = (f'labels.{POOL_LABEL}=ready AND '
+                  f'labels.{IMAGE_LABEL}={image_label(source_disk)}')
+  result = compute.disks().list(
+    project=project,
+    zone=zone,
+    filter=label_filter).execute()
+  return [disk for disk in result.get('items', []) if not disk.get('users')]
+
+
+def create_pool_disk(
+  compute: Resource,
+  project: str,
+  zone: str,
+  source_disk: str,
+  wait: bool = True
+) -> str:
+  """Create one pool disk, wait=False only sends the request."""
+  disk_name = f'{DISK_PREFIX}{int(time())}-{uuid.uuid4().hex[:6]}'
+  disk_body = {
+    'name': disk_name,
+    'sourceImage': resolve_image(compute, source_disk),
+    'type': f'projects/{project}/zones/{zone}/diskTypes/{POOL_DISK_TYPE}',
+    'labels': {
+      POOL_LABEL: 'ready',
+      IMAGE_LABEL: image_label(source_disk),
+    }
+  }
+  _logger.info(f'Creating pool disk {disk_name}...')
+  operation = compute.disks().insert(
+    project=project,
+    zone=zone,
+    body=disk_body).execute()
+  if wait:
+    wait_for_operation(_Location(compute, project, zone), oper=operation)
+  return disk_name
+
+
+def fill_pool(
+  compute: Resource,
+  project: str,
+  zone: str,
+  source_disks: List[str],
+  size: int
+) -> Dict[str, int]:
+  """Create the missing disks to have size ready disks per source image.
+  Returns:
+    Number of disks created per image label.
+  """
+  created = {}
+  for source_disk in source_disks:
+    ready = list_ready_disks(compute, project, zone, source_disk)
+    missing = max(size - len(ready), 0)
+    threads = [
+      Thread(target=create_pool_disk,
+             args=(compute, project, zone, source_disk))
+      for _ in range(missing)
+    ]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    created[image_label(source_disk)] = missing
+  return created
+
+
+def _refill(vm) -> None:
+  try:
+    create_pool_disk(vm.compute, vm.project, vm.zone, vm.rescue_source_disk,
+                     wait=False)
+  except HttpError as e:
+    _logger.info(f'Unable to refill the warm pool: {e}')
+
+
+def join_refills(timeout: float = REFILL_EXIT_TIMEOUT) -> None:
+  """Wait for the refill requests of the claimed disks. They run in daemon
+  threads, a refill still running after timeout is killed at exit."""
+  while _refills:
+    thread = _refills.pop()
+    thread.join(timeout)
+    if thread.is_alive():
+      _logger.info(f'Refill of the warm pool skipped, {thread.name} still '
+                   f'running after {timeout}s.')
+
+
+atexit.register(join_refills)
+
+
+def claim_disk(vm) -> Optional[str]:
+  """Claim a ready pool disk for vm, as its rescue disk, and refill the pool
+  in background.
+  Returns:
+    The claimed disk name, None when the pool has no disk available.
+  """
+  candidates = list_ready_disks(
+    vm.compute, vm.project, vm.zone, vm.rescue_source_disk
+  )
+  for disk in candidates:
+    labels = dict(disk.get('labels', {}))
+    labels[POOL_LABEL] = 'claimed'
+    labels[VM_LABEL] = vm.name
+    try:
+      operation = vm.compute.disks().setLabels(
+        **vm.project_data,
+        resource=disk['name'],
+        body={
+          'labels': labels,
+          'labelFingerprint': disk['labelFingerprint']
+        }).execute()
+      # Saved in the journal while waiting, a resumed execution uses it.
+      vm.rescue_disk = disk['name']
+      wait_for_operation(vm, oper=operation)
+    except HttpError as e:
+      if e.status_code != 412:
+        raise
+      _logger.info(f'Pool disk {disk["name"]} was claimed by another run.')
+      continue
+    _logger.info(f'Claimed pool disk {disk["name"]}.')
+    refill = Thread(target=_refill, args=(vm,), daemon=True,
+                    name=f'refill-{vm.zone}')
+    refill.start()
+    _refills.append(refill)
+    return disk['name']
+
+  _logger.info('No warm pool disk available.')
+  return None
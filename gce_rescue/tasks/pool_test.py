@@ -0,0 +1,113 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for pool.py."""
+
+import threading
+from unittest import mock
+
+from absl.testing import absltest
+from gce_rescue.gce import Instance
+from gce_rescue.tasks import images, keeper, pool
+from gce_rescue.test.mocks import (
+  mock_api_responses,
+  ok_response,
+  MOCK_TEST_VM
+)
+
+DONE = {'name': 'operation-1', 'status': 'DONE'}
+IMAGE = {'name': 'debian-11-v1', 'selfLink': 'global/images/debian-11-v1'}
+
+
+def _pool_disk(name: str) -> dict:
+  return {
+    'name': name,
+    'labels': {pool.POOL_LABEL: 'ready', pool.IMAGE_LABEL: 'debian-11'},
+    'labelFingerprint': f'{name}-fingerprint',
+  }
+
+
+class PoolTest(absltest.TestCase):
+  vm: Instance
+
+
+  def setUp(self):
+    self.vm = Instance(test_mode=True, **MOCK_TEST_VM)
+    self.enter_context(mock.patch.object(keeper, 'POLL_MIN_DELAY', 0))
+    self.refill = self.enter_context(mock.patch.object(pool, '_refill'))
+    self.enter_context(mock.patch.object(pool, '_refills', []))
+    images.clear_cache()
+
+
+  def test_image_label(self):
+    self.assertEqual(
+      pool.image_label('projects/debian-cloud/global/images/family/debian-11'),
+      'debian-11')
+
+
+  def test_claim_disk(self):
+    self.vm.compute = mock_api_responses([
+      ok_response({'items': [_pool_disk('linux-rescue-pool-1')]}),
+      ok_response(DONE),
+    ])
+    self.assertEqual(pool.claim_disk(self.vm), 'linux-rescue-pool-1')
+    self.assertEqual(self.vm.rescue_disk, 'linux-rescue-pool-1')
+    self.refill.assert_called_once_with(self.vm)
+
+
+  def test_claim_disk_conflict(self):
+    """A disk claimed by another run is skipped."""
+    self.vm.compute = mock_api_responses([
+      ok_response({'items': [_pool_disk('linux-rescue-pool-1'),
+                     _pool_disk('linux-rescue-pool-2')]}),
+      ({'status': '412'}, '{}'),
+      ok_response(DONE),
+    ])
+    self.assertEqual(pool.claim_disk(self.vm), 'linux-rescue-pool-2')
+
+
+  def test_claim_disk_empty_pool(self):
+    self.vm.compute = mock_api_responses([ok_response({})])
+    self.assertIsNone(pool.claim_disk(self.vm))
+    self.refill.assert_not_called()
+
+
+  def test_fill_pool(self):
+    compute = mock_api_responses([
+      ok_response({'items': [_pool_disk('linux-rescue-pool-1')]}),
+      ok_response(IMAGE),
+      ok_response(DONE),
+    ])
+    created = pool.fill_pool(
+      compute, self.vm.project, self.vm.zone,
+      ['projects/debian-cloud/global/images/family/debian-11'], size=2)
+    self.assertEqual(created, {'debian-11': 1})
+
+
+  def test_join_refills(self):
+    """A refill still running at exit is logged as skipped."""
+    running = threading.Event()
+    refill = threading.Thread(target=running.wait, args=(5,), daemon=True,
+                              name='refill-test')
+    refill.start()
+    pool._refills.append(refill) # pylint: disable=protected-access
+    with self.assertLogs('gce_rescue.tasks.pool', 'INFO') as logs:
+      pool.join_refills(timeout=0)
+    running.set()
+    self.assertIn('refill-test', logs.output[0])
+    self.assertEmpty(pool._refills) # pylint: disable=protected-access
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -18,7 +18,6 @@
 
 from dataclasses import dataclass, field
 import googleapiclient.discovery
-from gce_rescue.tasks.validations.authorization import authorize_check
 from gce_rescue.tasks.validations.authentication import (
   authenticate_check,
   project_name
@@ -34,6 +33,8 @@ class Validations:
   name: str
   project: str = None
   test_mode: bool = field(default_factory=False)
+  _compute: googleapiclient.discovery.Resource = field(
+    init=False, default=None)
 
   def _authentication(self):
     return authenticate_check(
@@ -43,13 +44,12 @@ class Validations:
       test_mode = self.test_mode,
     )
 
-  def __post_init__(self):
-    if not self.test_mode:
-      authorize_check(project = self.project)
-
   @property
   def compute(self) -> googleapiclient.discovery.Resource:
-    return self._authentication()
+    # Authenticated once, on the first use.
+    if self._compute is None:
+      self._compute = self._authentication()
+    return self._compute
 
   @property
   def adc_project(self) -> str:
@@ -0,0 +1,196 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Execute a graph of tasks, running independent tasks concurrently.
+    Each task is a dict:
+      id: str, unique name of the task.
+      name: callable to be executed.
+      args: [dict], keyword arguments of the callable.
+      after: [str], ids of the tasks that must be done before this one.
+      trace: dict, optional details added to the trace span of the task.
+      optional: bool, a failure of the task doesn't stop the other tasks,
+        it is raised as OptionalTaskFailed once they are done.
+"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+import functools
+import logging
+import queue
+from threading import Thread
+from typing import Any, Awaitable, Callable, Dict, List
+
+from gce_rescue import tracing
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+
+class OptionalTaskFailed(Exception):
+  """An optional task failed, every other task was done."""
+
+  def __init__(self, task_id: str, error: BaseException):
+    super().__init__(f'{task_id} failed: {error}')
+    self.task_id = task_id
+    self.error = error
+
+
+def _raise(error: BaseException, optional: List) -> None:
+  """Raise the failure of the run, if any."""
+  if error is not None:
+    raise error
+  if optional:
+    task, exception = optional[0]
+    raise OptionalTaskFailed(task['id'], exception) from exception
+
+
+def validate_tasks(tasks: List[Dict]) -> None:
+  """Raise ValueError if a dependency is unknown or there is a cycle."""
+
+  by_id = {task['id']: task for task in tasks}
+  if len(by_id) != len(tasks):
+    raise ValueError('Duplicated task id.')
+  for task in tasks:
+    for dependency in task.get('after', []):
+      if dependency not in by_id:
+        raise ValueError(f'Task "{task["id"]}" depends on unknown '
+                         f'"{dependency}".')
+
+  done = set()
+  while len(done) < len(tasks):
+    ready = [task['id'] for task in tasks if task['id'] not in done
+             and set(task.get('after', [])) <= done]
+    if not ready:
+      raise ValueError('Tasks dependencies have a cycle.')
+    done.update(ready)
+
+
+def run_tasks(
+  tasks: List[Dict],
+  on_done: Callable[[Dict], None] = None
+) -> None:
+  """Start each task, in its own thread, as soon as its dependencies are done.
+  After a failure no new task is started, the running ones are waited and the
+  first exception is raised. The failures of optional tasks only stop their
+  dependents."""
+
+  validate_tasks(tasks)
+  finished = queue.Queue()
+  started, done = set(), set()
+  error, optional = None, []
+
+  def _run(task: Dict) -> None:
+    try:
+      with tracing.span(task['id'], 'task', **task.get('trace', {})):
+        task['name'](**task['args'][0])
+      finished.put((task, None))
+    except BaseException as e: # pylint: disable=broad-except
+      finished.put((task, e))
+
+  running = 0
+  while True:
+    if error is None:
+      for task in tasks:
+        if (task['id'] not in started and
+            set(task.get('after', [])) <= done):
+          _logger.debug(f'Starting task {task["id"]}.')
+          started.add(task['id'])
+          running += 1
+          Thread(target=_run, args=(task,), daemon=True).start()
+
+    if not running:
+      break
+
+    task, exception = finished.get()
+    running -= 1
+    if exception is not None:
+      _logger.error(f'Task {task["id"]} failed: {exception}')
+      if task.get('optional') and isinstance(exception, Exception):
+        optional.append((task, exception))
+      else:
+        error = error or exception
+      continue
+    done.add(task['id'])
+    if on_done:
+      on_done(task)
+
+  _raise(error, optional)
+
+
+async def run_tasks_async(
+  tasks: List[Dict],
+  on_done: Callable[[Dict], None] = None
+) -> None:
+  """Same as run_tasks(), with each task as an asyncio task of the running
+  event loop instead of a thread. The blocking functions of the tasks run in
+  the default executor of the loop, coroutine functions are awaited."""
+
+  validate_tasks(tasks)
+  started, done = set(), set()
+  running = {}
+  error, optional = None, []
+
+  async def _run(task: Dict) -> None:
+    with tracing.span(task['id'], 'task', **task.get('trace', {})):
+      if asyncio.iscoroutinefunction(task['name']):
+        await task['name'](**task['args'][0])
+        return
+      # Each task keeps its own context, e.g. the step of the journal.
+      context = contextvars.copy_context()
+      await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        context.run, task['name'], **task['args'][0]))
+
+  while True:
+    if error is None:
+      for task in tasks:
+        if (task['id'] not in started and
+            set(task.get('after', [])) <= done):
+          _logger.debug(f'Starting task {task["id"]}.')
+          started.add(task['id'])
+          running[asyncio.ensure_future(_run(task))] = task
+
+    if not running:
+      break
+
+    finished, _ = await asyncio.wait(
+      running, return_when=asyncio.FIRST_COMPLETED
+    )
+    for future in finished:
+      task = running.pop(future)
+      exception = future.exception()
+      if exception is not None:
+        _logger.error(f'Task {task["id"]} failed: {exception}')
+        if task.get('optional') and isinstance(exception, Exception):
+          optional.append((task, exception))
+        else:
+          error = error or exception
+        continue
+      done.add(task['id'])
+      if on_done:
+        on_done(task)
+
+  _raise(error, optional)
+
+
+def run_async(main: Awaitable) -> Any:
+  """asyncio.run() of main, with up to aio-max-threads threads in the
+  default executor for the blocking tasks of every instance."""
+
+  async def _main():
+    asyncio.get_running_loop().set_default_executor(
+      ThreadPoolExecutor(max_workers=get_config('aio-max-threads')))
+    return await main
+
+  return asyncio.run(_main())
@@ -0,0 +1,175 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for scheduler.py."""
+
+import asyncio
+import threading
+
+from absl.testing import absltest
+from gce_rescue.tasks import scheduler
+
+
+class SchedulerTest(absltest.TestCase):
+
+  def setUp(self):
+    self.events = []
+    self.lock = threading.Lock()
+
+
+  def _task(self, task_id, after, barrier=None, fail=False):
+    def _execute(name):
+      if barrier:
+        # Both tasks must be running at the same time to pass the barrier.
+        barrier.wait(timeout=5)
+      if fail:
+        raise RuntimeError(name)
+      with self.lock:
+        self.events.append(name)
+    return {'id': task_id, 'name': _execute, 'args': [{'name': task_id}],
+            'after': after}
+
+
+  def test_dependencies_order(self):
+    tasks = [
+      self._task('start', ['stop']),
+      self._task('stop', []),
+      self._task('attach', ['start']),
+    ]
+    done = []
+    scheduler.run_tasks(tasks, on_done=lambda task: done.append(task['id']))
+    self.assertEqual(self.events, ['stop', 'start', 'attach'])
+    self.assertEqual(done, ['stop', 'start', 'attach'])
+
+
+  def test_independent_tasks_run_concurrently(self):
+    barrier = threading.Barrier(2)
+    tasks = [
+      self._task('stop', [], barrier),
+      self._task('create_disk', [], barrier),
+      self._task('attach', ['stop', 'create_disk']),
+    ]
+    scheduler.run_tasks(tasks)
+    self.assertEqual(self.events[-1], 'attach')
+
+
+  def test_failure_stops_dependents(self):
+    tasks = [
+      self._task('stop', [], fail=True),
+      self._task('detach', ['stop']),
+    ]
+    with self.assertRaises(RuntimeError):
+      scheduler.run_tasks(tasks)
+    self.assertEmpty(self.events)
+
+
+  def test_optional_failure(self):
+    tasks = [
+      dict(self._task('backup', [], fail=True), optional=True),
+      self._task('label', ['backup']),
+      self._task('stop', []),
+      self._task('detach', ['stop']),
+    ]
+    with self.assertRaises(scheduler.OptionalTaskFailed) as context:
+      scheduler.run_tasks(tasks)
+    self.assertEqual(context.exception.task_id, 'backup')
+    self.assertIsInstance(context.exception.error, RuntimeError)
+    self.assertEqual(sorted(self.events), ['detach', 'stop'])
+
+    # The failures of the other tasks come first.
+    tasks[2] = self._task('stop', [], fail=True)
+    with self.assertRaisesRegex(RuntimeError, 'stop'):
+      scheduler.run_tasks(tasks)
+
+
+  def _async_task(self, task_id, after, event=None, fail=False):
+    async def _execute(name):
+      if event:
+        # Only passes if the task setting the event runs at the same time.
+        await asyncio.wait_for(event.wait(), timeout=5)
+      if fail:
+        raise RuntimeError(name)
+      self.events.append(name)
+    return {'id': task_id, 'name': _execute, 'args': [{'name': task_id}],
+            'after': after}
+
+
+  def test_async_dependencies_order(self):
+    tasks = [
+      self._async_task('start', ['stop']),
+      self._async_task('stop', []),
+      self._async_task('attach', ['start']),
+    ]
+    asyncio.run(scheduler.run_tasks_async(tasks))
+    self.assertEqual(self.events, ['stop', 'start', 'attach'])
+
+
+  def test_async_independent_tasks_run_concurrently(self):
+    async def _run():
+      event = asyncio.Event()
+      async def _set():
+        event.set()
+      tasks = [
+        self._async_task('wait', [], event),
+        {'id': 'set', 'name': _set, 'args': [{}], 'after': []},
+        self._async_task('attach', ['wait', 'set']),
+      ]
+      await scheduler.run_tasks_async(tasks)
+    asyncio.run(_run())
+    self.assertEqual(self.events, ['wait', 'attach'])
+
+
+  def test_async_failure_stops_dependents(self):
+    tasks = [
+      self._async_task('stop', [], fail=True),
+      self._async_task('detach', ['stop']),
+    ]
+    with self.assertRaises(RuntimeError):
+      asyncio.run(scheduler.run_tasks_async(tasks))
+    self.assertEmpty(self.events)
+
+
+  def test_async_optional_failure(self):
+    tasks = [
+      dict(self._async_task('backup', [], fail=True), optional=True),
+      self._async_task('stop', []),
+      self._async_task('detach', ['stop']),
+    ]
+    with self.assertRaises(scheduler.OptionalTaskFailed):
+      asyncio.run(scheduler.run_tasks_async(tasks))
+    self.assertEqual(self.events, ['stop', 'detach'])
+
+
+  def test_async_blocking_tasks(self):
+    # The blocking tasks run at the same time on the threads of the loop.
+    barrier = threading.Barrier(2)
+    tasks = [
+      self._task('stop', [], barrier),
+      self._task('create_disk', [], barrier),
+      self._task('detach', ['stop']),
+    ]
+    scheduler.run_async(scheduler.run_tasks_async(tasks))
+    self.assertCountEqual(self.events, ['stop', 'create_disk', 'detach'])
+    self.assertLess(self.events.index('stop'), self.events.index('detach'))
+
+
+  def test_invalid_graph(self):
+    with self.assertRaises(ValueError):
+      scheduler.validate_tasks([self._task('a', ['b']), self._task('b', ['a'])])
+    with self.assertRaises(ValueError):
+      scheduler.validate_tasks([self._task('a', ['missing'])])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,178 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Snapshots of the disks of the instances, taken in parallel: the boot
+    disk and, with --snapshot-data-disks, every other persistent disk
+    attached in read-write mode. At most max-snapshots-per-region snapshots
+    are in progress per project and region, for all the instances of the
+    process, the others wait for a slot.
+    https://cloud.google.com/compute/docs/disks/snapshot-best-practices
+"""
+
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+import logging
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+
+def _key(vm) -> Tuple[str, str, str, str]:
+  # The same instance is rescued again by a later execution, with a new ts.
+  return (vm.project, vm.zone, vm.name, str(vm.ts))
+
+
+def snapshot_disks(vm) -> List[str]:
+  """Disks of vm to snapshot, the boot disk first."""
+  disks = [vm.disks['disk_name']]
+  if not get_config('snapshot-data-disks'):
+    return disks
+  for disk in vm.data['disks']:
+    name = disk.get('source', '').split('/')[-1]
+    if (disk['boot'] or disk.get('type') == 'SCRATCH' or
+        disk.get('mode', 'READ_WRITE') != 'READ_WRITE' or
+        name in disks or name == vm.rescue_disk):
+      continue
+    disks.append(name)
+  return disks
+
+
+class _Slots:
+  """Counting semaphore shared by the snapshot threads."""
+
+  def __init__(self, size: int):
+    self.size = size
+    self.used = 0
+    self._condition = threading.Condition()
+
+  def _try_acquire(self) -> bool:
+    if self.used >= self.size:
+      return False
+    self.used += 1
+    return True
+
+  def acquire(self) -> None:
+    with self._condition:
+      self._condition.wait_for(self._try_acquire)
+
+  def release(self) -> None:
+    with self._condition:
+      self.used -= 1
+      self._condition.notify()
+
+
+@dataclass
+class SnapshotJob:
+  """Snapshot name of disk. status is WAITING (for a slot), RUNNING, DONE
+  or FAILED, operation is the name of its createSnapshot operation."""
+  disk: str
+  name: str
+  operation: str = ''
+  status: str = 'WAITING'
+  error: Optional[BaseException] = None
+  future: Future = field(default_factory=Future, repr=False)
+
+
+class SnapshotManager:
+  """Snapshots in progress per instance. take(vm, job) sends the
+  createSnapshot request of job, records its operation name in the job
+  and waits on it. Thread-safe."""
+
+  def __init__(self):
+    self._jobs: Dict[Tuple[str, str, str, str], List[SnapshotJob]] = {}
+    self._slots: Dict[Tuple[str, str], _Slots] = {}
+    self._lock = threading.Lock()
+
+  def _new_jobs(self, vm) -> List[SnapshotJob]:
+    """Jobs of vm, empty if they were already started. After a failure
+    they all start again, the snapshots already taken return 409."""
+    with self._lock:
+      jobs = self._jobs.get(_key(vm), [])
+      if jobs and not (all(job.future.done() for job in jobs) and
+                       any(job.status == 'FAILED' for job in jobs)):
+        return []
+      self._jobs[_key(vm)] = [
+        SnapshotJob(disk=disk, name=f'{disk}-{vm.ts}')
+        for disk in snapshot_disks(vm)
+      ]
+      return self._jobs[_key(vm)]
+
+  def _region_slots(self, vm) -> _Slots:
+    key = (vm.project, vm.zone[:-2])
+    with self._lock:
+      if key not in self._slots:
+        self._slots[key] = _Slots(get_config('max-snapshots-per-region'))
+      return self._slots[key]
+
+  @staticmethod
+  def _finish(
+    job: SnapshotJob,
+    result: Optional[Dict],
+    error: Optional[BaseException]
+  ) -> None:
+    if isinstance(error, HttpError) and error.status_code == 409:
+      # Taken by an interrupted execution (--resume).
+      _logger.info(f'Snapshot {job.name} already exists.')
+      result, error = {'status': 'DONE'}, None
+    if error is None:
+      job.status = 'DONE'
+      job.future.set_result(result)
+    else:
+      _logger.info(f'Snapshot {job.name} failed: {error}')
+      job.status, job.error = 'FAILED', error
+      job.future.set_exception(error)
+
+  def start(self, vm, take: Callable) -> List[SnapshotJob]:
+    """Start the snapshots of vm, each one on its own thread."""
+    slots = self._region_slots(vm)
+
+    def _run(job: SnapshotJob) -> None:
+      slots.acquire()
+      result = error = None
+      try:
+        job.status = 'RUNNING'
+        result = take(vm, job)
+      except Exception as e: # pylint: disable=broad-except
+        error = e
+      finally:
+        slots.release()
+      self._finish(job, result, error)
+
+    jobs = self._new_jobs(vm)
+    for job in jobs:
+      threading.Thread(target=_run, args=(job,), daemon=True,
+                       name=f'snapshot-{job.name}').start()
+    return self.jobs(vm)
+
+  def jobs(self, vm) -> List[SnapshotJob]:
+    with self._lock:
+      return list(self._jobs.get(_key(vm), []))
+
+  def poll(self, vm) -> Dict[str, str]:
+    """Status of each snapshot of vm, by snapshot name."""
+    return {job.name: job.status for job in self.jobs(vm)}
+
+  def join(self, vm, timeout: Optional[float] = None) -> List[Dict]:
+    """Wait for the snapshots of vm and return their operations, the boot
+    disk first. Raises the error of the first failed snapshot."""
+    return [job.future.result(timeout) for job in self.jobs(vm)]
+
+
+# Shared by all the instances rescued by the process.
+manager = SnapshotManager()
@@ -0,0 +1,125 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for snapshots.py."""
+
+import threading
+from types import SimpleNamespace
+
+from absl.testing import absltest
+from googleapiclient.errors import HttpError
+import httplib2
+
+from gce_rescue.config import config
+from gce_rescue.tasks import snapshots
+
+ZONE = 'europe-central2-a'
+
+
+def _vm(name: str = 'vm1', ts: int = 1700000000, data_disks=()):
+  attached = [{'boot': True, 'source': f'zones/{ZONE}/disks/{name}',
+               'type': 'PERSISTENT'}]
+  attached += [{'boot': False, 'source': f'zones/{ZONE}/disks/{disk}',
+                'type': 'PERSISTENT', 'mode': mode}
+               for disk, mode in data_disks]
+  attached.append({'boot': False, 'type': 'SCRATCH'})
+  return SimpleNamespace(project='p1', zone=ZONE, name=name, ts=ts,
+                         disks={'disk_name': name}, data={'disks': attached},
+                         rescue_disk=f'linux-rescue-{name}-{ts}')
+
+
+class SnapshotsTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['snapshot-data-disks'] = True
+    config['max-snapshots-per-region'] = 2
+    self.manager = snapshots.SnapshotManager()
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def test_snapshot_disks(self):
+    vm = _vm(data_disks=[('data-1', 'READ_WRITE'), ('shared', 'READ_ONLY')])
+    self.assertEqual(snapshots.snapshot_disks(vm), ['vm1', 'data-1'])
+    config['snapshot-data-disks'] = False
+    self.assertEqual(snapshots.snapshot_disks(vm), ['vm1'])
+
+
+  def test_region_limit(self):
+    release = threading.Event()
+    lock = threading.Lock()
+    running = []
+    peak = [0]
+
+    def _take(vm, job):
+      with lock:
+        running.append(job.name)
+        peak[0] = max(peak[0], len(running))
+      job.operation = f'operation-{job.name}'
+      release.wait()
+      with lock:
+        running.remove(job.name)
+      return {'status': 'DONE', 'name': job.operation}
+
+    vms = [_vm('vm1', data_disks=[('data-1', 'READ_WRITE')]), _vm('vm2')]
+    for vm in vms:
+      self.manager.start(vm, _take)
+    # Starting again doesn't take new snapshots.
+    self.manager.start(vms[0], _take)
+    statuses = list(self.manager.poll(vms[0]).values()) + list(
+      self.manager.poll(vms[1]).values())
+    self.assertLen(statuses, 3)
+    self.assertContainsSubset(['WAITING'], statuses)
+
+    release.set()
+    results = self.manager.join(vms[0], timeout=5)
+    self.assertEqual([result['name'] for result in results],
+                     ['operation-vm1-1700000000',
+                      'operation-data-1-1700000000'])
+    self.manager.join(vms[1], timeout=5)
+    self.assertEqual(peak[0], 2)
+    self.assertEqual(set(self.manager.poll(vms[0]).values()), {'DONE'})
+
+
+  def test_failure_and_restart(self):
+    vm = _vm(data_disks=[('data-1', 'READ_WRITE')])
+    conflict = HttpError(httplib2.Response({'status': '409'}), b'{}')
+
+    def _fail_data_disk(vm, job):
+      if job.disk == 'data-1':
+        raise RuntimeError('Quota exceeded.')
+      return {'status': 'DONE'}
+
+    self.manager.start(vm, _fail_data_disk)
+    with self.assertRaisesRegex(RuntimeError, 'Quota'):
+      self.manager.join(vm, timeout=5)
+    self.assertEqual(self.manager.poll(vm), {'vm1-1700000000': 'DONE',
+                                             'data-1-1700000000': 'FAILED'})
+
+    def _existing_boot_snapshot(vm, job):
+      if job.disk == 'vm1':
+        raise conflict
+      return {'status': 'DONE'}
+
+    self.manager.start(vm, _existing_boot_snapshot)
+    self.assertLen(self.manager.join(vm, timeout=5), 2)
+    self.assertEqual(set(self.manager.poll(vm).values()), {'DONE'})
+
+
+if __name__ == '__main__':
+  absltest.main()
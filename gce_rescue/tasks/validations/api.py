@@ -13,32 +13,107 @@
 # limitations under the License.
 
 """ Common API objects """
+import datetime
+import threading
+from typing import Optional
+
 import googleapiclient
 import google_auth_httplib2
 import httplib2
 
+from google.auth.credentials import AnonymousCredentials
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import Resource
 
 from gce_rescue.config import VERSION
+from gce_rescue.tasks.validations.cache import CachedHttpRequest, ReadCache
+from gce_rescue.tasks.validations.discovery import get_document
+
+_local = threading.local()
+_refresh_lock = threading.Lock()
+
+# Tokens are refreshed this long before they expire, before google-auth
+# would refresh them itself (3m45s) from every thread sending a request.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
+
+
+def _expires_soon(credentials: Credentials) -> bool:
+  if isinstance(credentials, AnonymousCredentials):
+    return False
+  if not credentials.token:
+    return True
+  if credentials.expiry is None:
+    return False
+  now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+  return credentials.expiry - now < REFRESH_MARGIN
+
+
+def refresh_credentials(credentials: Credentials) -> None:
+  """Refresh the access token if it is missing or about to expire, once
+  for all threads sharing credentials."""
+  if not _expires_soon(credentials):
+    return
+  with _refresh_lock:
+    # Another thread may have refreshed it while this one waited.
+    if _expires_soon(credentials):
+      credentials.refresh(google_auth_httplib2.Request(httplib2.Http()))
+
+
+class _Pool(dict):
+  """(credentials, AuthorizedHttp) of a thread by id(credentials). The
+  connections are closed when the thread ends, not left to the GC."""
+
+  def __del__(self):
+    for _, http in self.values():
+      http.http.close()
+
+
+def authorized_http(
+    credentials: Credentials) -> google_auth_httplib2.AuthorizedHttp:
+  """Keep-alive connection pool of the current thread for credentials.
+  httplib2.Http can't be shared between threads, but reusing it within the
+  same thread keeps the TCP+TLS connection open between requests."""
+
+  pool = getattr(_local, 'pool', None)
+  if pool is None:
+    pool = _local.pool = _Pool()
+  cached = pool.get(id(credentials))
+  if cached is None or cached[0] is not credentials:
+    cached = (
+      credentials,
+      google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http())
+    )
+    pool[id(credentials)] = cached
+  return cached[1]
+
 
 def api_service(
     service: str,
     version: str,
-    credentials: Credentials) -> Resource:
+    credentials: Credentials,
+    api_endpoint: Optional[str] = None) -> Resource:
+  """Build the API object. GET requests share a ReadCache, available on the
+  returned object as read_cache. api_endpoint replaces the base URL of the
+  API, e.g. to send the requests to a local emulator."""
+
+  cache = ReadCache()
 
   def _builder(http, *args, **kwargs):
     # google api client is not thread safe
     # https://github.com/googleapis/google-api-python-client/blob/main/docs/thread_safety.md
     del http
+    refresh_credentials(credentials)
     headers = kwargs.setdefault('headers',{})
     headers['user-agent'] = f'gce_rescue-{VERSION}'
-    auth_http = google_auth_httplib2.AuthorizedHttp(credentials,
-                                                   http=httplib2.Http())
-    return googleapiclient.http.HttpRequest(auth_http, *args, **kwargs)
+    return CachedHttpRequest(cache, authorized_http(credentials),
+                             *args, **kwargs)
 
-  service_ = googleapiclient.discovery.build(service, version,
-                        cache_discovery=False,
+  service_ = googleapiclient.discovery.build_from_document(
+                        get_document(service, version),
                         credentials=credentials,
-                        requestBuilder=_builder)
+                        requestBuilder=_builder,
+                        client_options=(
+                          {'api_endpoint': api_endpoint}
+                          if api_endpoint else None))
+  service_.read_cache = cache
   return service_
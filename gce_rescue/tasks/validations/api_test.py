@@ -0,0 +1,71 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for api.py."""
+
+import datetime
+from unittest import mock
+
+from absl.testing import absltest
+from google.auth.credentials import AnonymousCredentials
+from google.oauth2.credentials import Credentials
+from gce_rescue.tasks.validations import api
+from gce_rescue.utils import ThreadHandler as Handler
+
+
+class ApiTest(absltest.TestCase):
+
+  def test_authorized_http_per_thread(self):
+    """The same thread reuses its connections, other threads don't."""
+    credentials = AnonymousCredentials()
+    http = api.authorized_http(credentials)
+    self.assertIs(api.authorized_http(credentials), http)
+
+    task = Handler(target=api.authorized_http, args=(credentials,))
+    task.start()
+    self.assertIsNot(task.result(), http)
+
+
+  def test_authorized_http_per_credentials(self):
+    http = api.authorized_http(AnonymousCredentials())
+    self.assertIsNot(api.authorized_http(AnonymousCredentials()), http)
+
+
+  def test_refresh_credentials(self):
+    """Tokens are refreshed once, only when they are about to expire."""
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    credentials = Credentials(token='token',
+                              expiry=now + datetime.timedelta(hours=1))
+    with mock.patch.object(Credentials, 'refresh') as refresh:
+      api.refresh_credentials(credentials)
+      refresh.assert_not_called()
+
+      credentials.expiry = now + datetime.timedelta(minutes=1)
+      def _refreshed(_):
+        credentials.expiry = now + datetime.timedelta(hours=1)
+      refresh.side_effect = _refreshed
+      tasks = [Handler(target=api.refresh_credentials, args=(credentials,))
+               for _ in range(4)]
+      for task in tasks:
+        task.start()
+      for task in tasks:
+        task.result()
+      refresh.assert_called_once()
+
+      api.refresh_credentials(AnonymousCredentials())
+      refresh.assert_called_once()
+
+
+if __name__ == '__main__':
+  absltest.main()
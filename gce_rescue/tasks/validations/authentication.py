@@ -17,7 +17,7 @@ import google.auth
 import sys
 
 from googleapiclient.discovery import Resource
-from gce_rescue.tasks.validations.api import api_service
+from gce_rescue.tasks.validations.clients import default_credentials, get_client
 from gce_rescue.test.mocks import mock_api_object
 
 PROJECT = ''
@@ -25,7 +25,7 @@ PROJECT = ''
 def _get_auth():
   global PROJECT
   try:
-    credentials, adc_project = google.auth.default()
+    credentials, adc_project = default_credentials()
     if not adc_project and not PROJECT:
       msg = _info_no_project()
       print(msg, file=sys.stderr)
@@ -52,17 +52,14 @@ def authenticate_check(
   credentials = _get_auth()
   if not credentials:
     return False
-  # service = googleapiclient.discovery.build(
-  #   'compute',
-  #   'v1',
-  #   credentials = credentials
-  # )
-  service =  api_service('compute', 'v1', credentials)
-  request = service.instances().get(
-		project = PROJECT,
-		zone = zone,
-		instance = instance_name)
   try:
+    # The response stays in the ReadCache of the shared client, loading the
+    # instance right after doesn't send the request again.
+    service = get_client('compute', 'v1', PROJECT)
+    request = service.instances().get(
+      project = PROJECT,
+      zone = zone,
+      instance = instance_name)
     request.execute()
     return service
   except google.auth.exceptions.RefreshError:
@@ -70,6 +67,14 @@ def authenticate_check(
     print(msg, file=sys.stderr)
     sys.exit(1)
 
+def compute_service(project: str = None) -> Resource:
+  """Authenticated service for tasks that are not related to an instance,
+  e.g. fill the warm pool."""
+  global PROJECT
+  PROJECT = project
+  _get_auth()
+  return get_client('compute', 'v1', PROJECT)
+
 def project_name() -> str:
   return PROJECT
 
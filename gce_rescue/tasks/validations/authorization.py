@@ -13,39 +13,139 @@
 # limitations under the License.
 
 """
-Authorization validation to be called from ../pre_validations.py
-Permissions:
-  compute.instances.stop
-  compute.instances.start
-  compute.instances.attachDisk
-  compute.instances.detachDisk
-  compute.images.useReadOnly
-  compute.disks.use
-  compute.disks.setLabels
-  compute.snapshots.create
-  compute.disks.createSnapshot
-  compute.instances.setMetadata
-  compute.instances.setLabels
+Authorization validation, run before any change on the instances. All the
+permissions the tool can need are tested on the project with a single
+projects().testIamPermissions call, cached for permissions-cache-ttl
+seconds, and each instance checks the ones its action needs against it.
+Only permissions granted on the project are seen, not those granted on a
+single instance or disk.
 """
-import google.auth
-from gce_rescue.tasks.validations.api import api_service
+import threading
+from time import time
+from typing import Dict, Set, Tuple
 
-def authorize_check(project: str = None) -> bool:
+from gce_rescue.config import get_config
+from gce_rescue.tasks.validations.clients import get_client
 
-  permissions_list = ['compute.snapshots.create']
-  body_data = {'permissions': permissions_list}
-  credentials, project_id = google.auth.default()
+# Permissions of each action, booting from a rescue disk.
+ACTION_PERMISSIONS = {
+  'set_rescue_mode': [
+    'compute.instances.get',
+    'compute.instances.stop',
+    'compute.instances.start',
+    'compute.instances.attachDisk',
+    'compute.instances.detachDisk',
+    'compute.instances.setMetadata',
+    # Waiting for the rescue boot, see keeper.wait_for_os_boot().
+    'compute.instances.getGuestAttributes',
+    'compute.instances.getSerialPortOutput',
+    'compute.disks.get',
+    'compute.disks.create',
+    'compute.disks.use',
+    'compute.disks.setLabels',
+  ],
+  'reset_rescue_mode': [
+    'compute.instances.get',
+    'compute.instances.stop',
+    'compute.instances.start',
+    'compute.instances.attachDisk',
+    'compute.instances.detachDisk',
+    'compute.instances.setMetadata',
+    'compute.disks.list',
+    'compute.disks.use',
+    'compute.disks.delete',
+  ],
+}
 
-  if not project:
-    project = project_id
+# Permissions of each action with --helper-vm.
+HELPER_PERMISSIONS = {
+  'set_rescue_mode': [
+    'compute.instances.get',
+    'compute.instances.stop',
+    'compute.instances.attachDisk',
+    'compute.instances.detachDisk',
+    'compute.disks.get',
+    'compute.disks.use',
+    'compute.disks.setLabels',
+  ],
+  'reset_rescue_mode': [
+    'compute.instances.get',
+    'compute.instances.start',
+    'compute.instances.attachDisk',
+    'compute.instances.detachDisk',
+    'compute.disks.list',
+    'compute.disks.use',
+  ],
+}
 
-  service = api_service('cloudresourcemanager', 'v1', credentials)
-  result = service.projects().testIamPermissions(
-    resource = project,
-    body =  body_data
-  ).execute()
+# Permissions of each backup method, only taken by set_rescue_mode.
+BACKUP_PERMISSIONS = {
+  'snapshot': ['compute.snapshots.create', 'compute.disks.createSnapshot'],
+  'instant-snapshot': ['compute.instantSnapshots.create',
+                       'compute.disks.createInstantSnapshot'],
+  'clone': ['compute.disks.create', 'compute.disks.useReadOnly'],
+  'none': [],
+}
 
-  if permissions_list != result['permissions']:
-    raise PermissionError()
+# Claiming a disk of the warm pool.
+WARM_POOL_PERMISSIONS = ['compute.disks.list', 'compute.disks.setLabels']
 
+ALL_PERMISSIONS = sorted({
+  permission
+  for permissions in (*ACTION_PERMISSIONS.values(),
+                      *HELPER_PERMISSIONS.values(),
+                      *BACKUP_PERMISSIONS.values(),
+                      WARM_POOL_PERMISSIONS)
+  for permission in permissions
+})
+
+# project -> (granted permissions, expiration time).
+_cache: Dict[str, Tuple[Set[str], float]] = {}
+_lock = threading.Lock()
+
+
+def required_permissions(vm, action: str) -> Set[str]:
+  """Permissions needed by action on vm, with its mode and backup method."""
+  if vm.helper_vm:
+    permissions = set(HELPER_PERMISSIONS[action])
+  else:
+    permissions = set(ACTION_PERMISSIONS[action])
+  if action == 'set_rescue_mode':
+    permissions.update(BACKUP_PERMISSIONS[vm.backup_method])
+    if get_config('warm-pool') and not vm.helper_vm:
+      permissions.update(WARM_POOL_PERMISSIONS)
+  return permissions
+
+
+def granted_permissions(project: str) -> Set[str]:
+  """Permissions of ALL_PERMISSIONS granted on project to the caller."""
+  # Held during the request, the fleet workers wait for the same result.
+  with _lock:
+    cached = _cache.get(project)
+    if cached and cached[1] > time():
+      return cached[0]
+    service = get_client('cloudresourcemanager', 'v1', project)
+    result = service.projects().testIamPermissions(
+      resource = project,
+      body = {'permissions': ALL_PERMISSIONS}
+    ).execute()
+    granted = set(result.get('permissions', []))
+    _cache[project] = (granted, time() + get_config('permissions-cache-ttl'))
+    return granted
+
+
+def authorize_check(vm, action: str) -> bool:
+  """Raises:
+    PermissionError: listing the permissions missing for action on vm.
+  """
+  missing = sorted(required_permissions(vm, action) -
+                   granted_permissions(vm.project))
+  if missing:
+    raise PermissionError(
+      f'Missing permissions on project {vm.project}: {", ".join(missing)}')
   return True
+
+
+def clear_cache() -> None:
+  with _lock:
+    _cache.clear()
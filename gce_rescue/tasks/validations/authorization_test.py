@@ -0,0 +1,105 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for authorization.py."""
+
+from types import SimpleNamespace
+from unittest import mock
+
+from absl.testing import absltest
+
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import authorization
+
+
+def _vm(project: str = 'project-1', backup_method: str = 'snapshot',
+        helper_vm: str = '') -> SimpleNamespace:
+  return SimpleNamespace(project=project, backup_method=backup_method,
+                         helper_vm=helper_vm)
+
+
+class AuthorizationTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['discovery-live'] = False
+    authorization.clear_cache()
+    self.addCleanup(authorization.clear_cache)
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def _grant(self, permissions) -> mock.MagicMock:
+    """Answer testIamPermissions with permissions, counting the calls."""
+    client = mock.MagicMock()
+    client.projects().testIamPermissions().execute.return_value = {
+      'permissions': sorted(permissions)}
+    client.projects().testIamPermissions.reset_mock()
+    self.enter_context(mock.patch.object(authorization, 'get_client',
+                                         return_value=client))
+    return client.projects().testIamPermissions
+
+
+  def test_required_permissions(self):
+    rescue = authorization.required_permissions(_vm(), 'set_rescue_mode')
+    self.assertContainsSubset(
+      ['compute.instances.detachDisk', 'compute.disks.setLabels',
+       'compute.disks.createSnapshot', 'compute.instances.setMetadata',
+       'compute.instances.getGuestAttributes',
+       'compute.instances.getSerialPortOutput'],
+      rescue)
+    self.assertNotIn(
+      'compute.instantSnapshots.create',
+      authorization.required_permissions(_vm(backup_method='none'),
+                                         'set_rescue_mode'))
+    helper = authorization.required_permissions(
+      _vm(backup_method='none', helper_vm='helper'), 'set_rescue_mode')
+    self.assertNotIn('compute.disks.create', helper)
+    self.assertNotIn('compute.instances.setMetadata', helper)
+    self.assertContainsSubset(helper, authorization.ALL_PERMISSIONS)
+
+
+  def test_one_call_per_project(self):
+    test_iam = self._grant(authorization.ALL_PERMISSIONS)
+    for action in ('set_rescue_mode', 'reset_rescue_mode'):
+      self.assertTrue(authorization.authorize_check(_vm(), action))
+    test_iam.assert_called_once_with(
+      resource='project-1',
+      body={'permissions': authorization.ALL_PERMISSIONS})
+    authorization.authorize_check(_vm(project='project-2'), 'set_rescue_mode')
+    self.assertEqual(test_iam.call_count, 2)
+
+
+  def test_missing_permissions(self):
+    self._grant(set(authorization.ALL_PERMISSIONS) - {
+      'compute.disks.setLabels', 'compute.instances.detachDisk'})
+    with self.assertRaisesRegex(
+        PermissionError,
+        'compute.disks.setLabels, compute.instances.detachDisk'):
+      authorization.authorize_check(_vm(), 'set_rescue_mode')
+
+
+  def test_cache_ttl(self):
+    config['permissions-cache-ttl'] = 0
+    test_iam = self._grant(authorization.ALL_PERMISSIONS)
+    authorization.authorize_check(_vm(), 'set_rescue_mode')
+    authorization.authorize_check(_vm(), 'set_rescue_mode')
+    self.assertEqual(test_iam.call_count, 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,147 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Send independent requests, issued by different threads within a short
+    window, together in a single batch HTTP request.
+    https://cloud.google.com/compute/docs/api/how-tos/batch
+"""
+
+from concurrent.futures import Future
+import logging
+import threading
+from time import sleep
+from typing import Dict
+from urllib.parse import urlsplit
+
+import googleapiclient.http
+from googleapiclient.errors import BatchError
+
+from gce_rescue import tracing
+from gce_rescue.config import get_config
+from gce_rescue.tasks.validations import limits
+from gce_rescue.tasks.validations.api import authorized_http
+
+_logger = logging.getLogger(__name__)
+
+BATCH_WINDOW = 0.05
+# Compute accepts up to 1000 requests per batch.
+MAX_BATCH_SIZE = 100
+
+_batchers = {}
+_batchers_lock = threading.Lock()
+
+
+def _batch_uri(uri: str) -> str:
+  """https://compute.googleapis.com/compute/v1/projects/... ->
+  https://compute.googleapis.com/batch/compute/v1"""
+  parts = urlsplit(uri)
+  api, version = parts.path.strip('/').split('/')[:2]
+  return f'{parts.scheme}://{parts.netloc}/batch/{api}/{version}'
+
+
+class RequestBatcher:
+  """Collect requests for BATCH_WINDOW seconds and send them in one batch.
+  Each caller receives its own response, or the exception (e.g. HttpError)
+  of its own request."""
+
+  def __init__(self, batch_uri: str, window: float = BATCH_WINDOW):
+    self.batch_uri = batch_uri
+    self.window = window
+    self.batches = 0
+    self.requests = 0
+    self._pending = []
+    self._lock = threading.Lock()
+    self._flusher = None
+
+  def submit(self, request: googleapiclient.http.HttpRequest) -> Future:
+    future = Future()
+    cache = getattr(request, 'cache', None)
+    cached = cache.get(request) if cache else None
+    if cached is not None:
+      future.set_result(cached)
+      return future
+
+    with self._lock:
+      self._pending.append((request, future))
+      if self._flusher is None:
+        self._flusher = threading.Thread(target=self._flush, daemon=True)
+        self._flusher.start()
+    return future
+
+  def execute(self, request: googleapiclient.http.HttpRequest) -> Dict:
+    return self.submit(request).result()
+
+  def _flush(self) -> None:
+    sleep(self.window)
+    with self._lock:
+      pending, self._pending = self._pending, []
+      self._flusher = None
+    for i in range(0, len(pending), MAX_BATCH_SIZE):
+      self._send(pending[i:i + MAX_BATCH_SIZE])
+
+  def _send(self, pending) -> None:
+    def _callback(request_id, response, exception):
+      request, future = pending[int(request_id)]
+      if exception is not None:
+        future.set_exception(exception)
+        return
+      cache = getattr(request, 'cache', None)
+      if cache:
+        cache.update(request, response)
+      future.set_result(response)
+
+    batch = googleapiclient.http.BatchHttpRequest(
+      callback=_callback, batch_uri=self.batch_uri
+    )
+    for request_id, (request, _) in enumerate(pending):
+      batch.add(request, request_id=str(request_id))
+
+    # The requests http belongs to the threads that built them.
+    http = pending[0][0].http
+    credentials = getattr(http, 'credentials', None)
+    if credentials is not None:
+      http = authorized_http(credentials)
+
+    self.batches += 1
+    self.requests += len(pending)
+    _logger.debug(f'Sending {len(pending)} requests in one batch.')
+    error = None
+    try:
+      with tracing.span('batch', 'api', requests=len(pending)):
+        batch.execute(http=http)
+    except Exception as e: # pylint: disable=broad-except
+      error = e
+    for request, future in pending:
+      if not future.done():
+        future.set_exception(
+          error or BatchError(f'No response in the batch for {request.uri}')
+        )
+
+
+def execute(request: googleapiclient.http.HttpRequest) -> Dict:
+  """Execute the request, batched with requests of other threads when
+  batch-requests is enabled."""
+
+  if not get_config('batch-requests'):
+    return request.execute()
+
+  batch_uri = _batch_uri(request.uri)
+  with _batchers_lock:
+    if batch_uri not in _batchers:
+      _batchers[batch_uri] = RequestBatcher(batch_uri)
+    batcher = _batchers[batch_uri]
+  # Each request of a batch counts against the quotas on its own, and it is
+  # sent again in a later batch when its own response is retryable.
+  with tracing.span(request.methodId, 'api', batched=True):
+    return limits.call(request, lambda: batcher.execute(request))
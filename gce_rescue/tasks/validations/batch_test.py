@@ -0,0 +1,116 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for batch.py."""
+
+import json
+from unittest import mock
+
+from absl.testing import absltest
+import googleapiclient.discovery
+from googleapiclient.errors import HttpError
+from googleapiclient.http import HttpMockSequence
+
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import batch, limits
+from gce_rescue.test.mocks import MOCK_TEST_VM
+
+BOUNDARY = 'batch_boundary'
+
+
+def _part(request_id: int, status: str, content: dict) -> str:
+  return (
+    f'--{BOUNDARY}\r\n'
+    'Content-Type: application/http\r\n'
+    f'Content-ID: <response-base + {request_id}>\r\n\r\n'
+    f'HTTP/1.1 {status}\r\n'
+    'Content-Type: application/json\r\n\r\n'
+    f'{json.dumps(content)}\r\n'
+  )
+
+
+def _batch_response(*parts: str):
+  return ({'status': '200',
+           'content-type': f'multipart/mixed; boundary="{BOUNDARY}"'},
+          ''.join(parts) + f'--{BOUNDARY}--')
+
+
+class BatchTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    limits.clear()
+    self.addCleanup(limits.clear)
+    self.enter_context(mock.patch.dict(
+      batch._batchers, clear=True)) # pylint: disable=protected-access
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+  def test_batch_uri(self):
+    self.assertEqual(
+      batch._batch_uri( # pylint: disable=protected-access
+        'https://compute.googleapis.com/compute/v1/projects/p/zones/z'),
+      'https://compute.googleapis.com/batch/compute/v1'
+    )
+
+
+  def test_responses_are_mapped_to_callers(self):
+    http = HttpMockSequence([_batch_response(
+      _part(0, '200 OK', {'name': 'mock-vm'}),
+      _part(1, '404 Not Found', {'error': {'code': 404}}))])
+    compute = googleapiclient.discovery.build('compute', 'v1', http=http)
+    batcher = batch.RequestBatcher(
+      'https://compute.googleapis.com/batch/compute/v1')
+
+    disk = batcher.submit(compute.disks().get(
+      project=MOCK_TEST_VM['project'], zone=MOCK_TEST_VM['zone'],
+      disk='mock-vm'))
+    snapshot = batcher.submit(compute.snapshots().get(
+      project=MOCK_TEST_VM['project'], snapshot='mock-vm-1'))
+
+    self.assertEqual(disk.result()['name'], 'mock-vm')
+    with self.assertRaises(HttpError) as error:
+      snapshot.result()
+    self.assertEqual(error.exception.status_code, 404)
+    self.assertEqual(batcher.batches, 1)
+    self.assertEqual(batcher.requests, 2)
+
+
+
+  def test_execute_within_limits(self):
+    config['batch-requests'] = True
+    config['api-retries'] = 3
+    http = HttpMockSequence([
+      _batch_response(_part(0, '503 Service Unavailable',
+                            {'error': {'code': 503}})),
+      _batch_response(_part(0, '200 OK', {'name': 'operation-1'})),
+    ])
+    compute = googleapiclient.discovery.build('compute', 'v1', http=http)
+    request = compute.instances().stop(
+      project=MOCK_TEST_VM['project'], zone=MOCK_TEST_VM['zone'],
+      instance='mock-vm')
+    with mock.patch.object(limits, 'sleep') as sleep:
+      self.assertEqual(batch.execute(request), {'name': 'operation-1'})
+    sleep.assert_called_once()
+    self.assertIn('requestId=', request.uri)
+    self.assertEqual(limits.breaker(request).failures, 0)
+    batcher, = batch._batchers.values() # pylint: disable=protected-access
+    self.assertEqual(batcher.batches, 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
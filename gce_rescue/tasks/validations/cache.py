@@ -0,0 +1,127 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Read-through cache of Compute GET requests during one run.
+    Identical GETs (same method and URI) are answered from the cache until a
+    mutating request on the same location (zone, region or global) is sent
+    or an operation on that location is DONE.
+"""
+
+import copy
+import functools
+import re
+import threading
+from typing import Dict, Optional
+
+import googleapiclient.http
+
+from gce_rescue import tracing
+from gce_rescue.tasks.validations import limits
+
+CACHEABLE_METHODS = (
+  'compute.instances.get',
+  'compute.disks.get',
+  'compute.disks.list',
+  'compute.snapshots.get',
+)
+OPERATION_METHODS = (
+  'compute.zoneOperations.get',
+  'compute.zoneOperations.wait',
+)
+
+_LOCATION = re.compile(
+  r'projects/([^/]+)/(zones/[^/?]+|regions/[^/?]+|global)'
+)
+
+
+def _locations(uri: str):
+  """Locations affected by a change on uri: its own and the project global."""
+  match = _LOCATION.search(uri or '')
+  if not match:
+    return []
+  project, location = match.groups()
+  return [(project, location), (project, 'global')]
+
+
+class ReadCache:
+  """Thread-safe cache of GET responses, with counters of saved calls."""
+
+  def __init__(self):
+    self._entries = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+    self.invalidations = 0
+
+  def get(self, request: googleapiclient.http.HttpRequest) -> Optional[Dict]:
+    if request.methodId not in CACHEABLE_METHODS:
+      return None
+    with self._lock:
+      entry = self._entries.get((request.methodId, request.uri))
+      if entry is None:
+        self.misses += 1
+        return None
+      self.hits += 1
+    return copy.deepcopy(entry[1])
+
+  def update(
+    self,
+    request: googleapiclient.http.HttpRequest,
+    response: Dict
+  ) -> None:
+    """Store the response of a GET, or invalidate after a change."""
+
+    if request.methodId in CACHEABLE_METHODS:
+      locations = _locations(request.uri)[:1]
+      with self._lock:
+        self._entries[(request.methodId, request.uri)] = (
+          locations, copy.deepcopy(response)
+        )
+    elif request.methodId in OPERATION_METHODS:
+      if response.get('status') == 'DONE':
+        self.invalidate(response.get('targetLink') or request.uri)
+    elif request.method != 'GET':
+      self.invalidate(request.uri)
+
+  def invalidate(self, uri: str) -> None:
+    locations = _locations(uri)
+    with self._lock:
+      for key, (entry_locations, _) in list(self._entries.items()):
+        if not locations or set(entry_locations) & set(locations):
+          del self._entries[key]
+          self.invalidations += 1
+
+  def __str__(self) -> str:
+    return (f'{self.hits} calls saved, {self.misses} misses, '
+            f'{self.invalidations} invalidations')
+
+
+class CachedHttpRequest(googleapiclient.http.HttpRequest):
+  """HttpRequest answered from a ReadCache when possible, sent within the
+  rate limits and retried as defined in limits.py otherwise."""
+
+  def __init__(self, cache: ReadCache, *args, **kwargs):
+    super().__init__(*args, **kwargs)
+    self.cache = cache
+
+  def execute(self, http=None, num_retries=0):
+    with tracing.span(self.methodId, 'api') as span_args:
+      response = self.cache.get(self)
+      if response is not None:
+        span_args['cached'] = True
+        return response
+      response = limits.call(self, functools.partial(
+        super().execute, http=http, num_retries=num_retries))
+    self.cache.update(self, response)
+    return response
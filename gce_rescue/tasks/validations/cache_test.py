@@ -0,0 +1,106 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for cache.py."""
+
+import functools
+import json
+
+from absl.testing import absltest
+import googleapiclient.discovery
+from googleapiclient.http import HttpMockSequence
+
+from gce_rescue.tasks.validations.cache import CachedHttpRequest, ReadCache
+from gce_rescue.test.mocks import MOCK_TEST_VM
+
+INSTANCE = {'name': MOCK_TEST_VM['name'], 'status': 'RUNNING'}
+OPERATION = {'name': 'operation-1', 'status': 'DONE', 'targetLink': (
+  'https://compute.googleapis.com/compute/v1/projects/mock_project/zones/'
+  f'{MOCK_TEST_VM["zone"]}/instances/{MOCK_TEST_VM["name"]}'
+)}
+
+
+class CacheTest(absltest.TestCase):
+
+  def setUp(self):
+    self.cache = ReadCache()
+
+
+  def _compute(self, responses):
+    http = HttpMockSequence([
+      ({'status': '200'}, json.dumps(response)) for response in responses
+    ])
+    return googleapiclient.discovery.build(
+      'compute', 'v1', http=http,
+      requestBuilder=functools.partial(CachedHttpRequest, self.cache))
+
+
+  def _get(self, compute):
+    return compute.instances().get(
+      project=MOCK_TEST_VM['project'],
+      zone=MOCK_TEST_VM['zone'],
+      instance=MOCK_TEST_VM['name']).execute()
+
+
+  def test_dedupe_gets(self):
+    compute = self._compute([INSTANCE])
+    self.assertEqual(self._get(compute), INSTANCE)
+    self.assertEqual(self._get(compute), INSTANCE)
+    self.assertEqual(self.cache.hits, 1)
+    self.assertEqual(self.cache.misses, 1)
+
+
+  def test_cached_response_is_a_copy(self):
+    compute = self._compute([INSTANCE])
+    self._get(compute)['status'] = 'TERMINATED'
+    self.assertEqual(self._get(compute)['status'], 'RUNNING')
+
+
+  def test_invalidate_on_mutation(self):
+    stopped = dict(INSTANCE, status='TERMINATED')
+    compute = self._compute([INSTANCE, OPERATION, stopped])
+    self._get(compute)
+    compute.instances().stop(
+      project=MOCK_TEST_VM['project'],
+      zone=MOCK_TEST_VM['zone'],
+      instance=MOCK_TEST_VM['name']).execute()
+    self.assertEqual(self._get(compute)['status'], 'TERMINATED')
+    self.assertEqual(self.cache.hits, 0)
+
+
+  def test_invalidate_on_operation_done(self):
+    compute = self._compute([INSTANCE, OPERATION, INSTANCE])
+    self._get(compute)
+    compute.zoneOperations().get(
+      project=MOCK_TEST_VM['project'],
+      zone=MOCK_TEST_VM['zone'],
+      operation=OPERATION['name']).execute()
+    self._get(compute)
+    self.assertEqual(self.cache.invalidations, 1)
+    self.assertEqual(self.cache.misses, 2)
+
+
+  def test_other_zone_is_kept(self):
+    compute = self._compute([INSTANCE, OPERATION])
+    self._get(compute)
+    compute.instances().stop(
+      project=MOCK_TEST_VM['project'],
+      zone='us-central1-a',
+      instance=MOCK_TEST_VM['name']).execute()
+    self._get(compute)
+    self.assertEqual(self.cache.hits, 1)
+
+
+if __name__ == '__main__':
+  absltest.main()
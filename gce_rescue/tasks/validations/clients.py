@@ -0,0 +1,67 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Process-wide registry of the credentials and API clients.
+    Application Default Credentials are loaded once, and each client is
+    built once per (service, version, project), so the validations, the
+    fleet workers and the tasks share them, including the ReadCache of
+    the client. Safe to use from several threads.
+"""
+
+import threading
+from typing import Dict, Optional, Tuple
+
+import google.auth
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import Resource
+
+from gce_rescue.tasks.validations.api import api_service, refresh_credentials
+
+_lock = threading.Lock()
+_default: Optional[Tuple[Credentials, Optional[str]]] = None
+_clients: Dict[Tuple[str, str, Optional[str]], Resource] = {}
+
+
+def default_credentials() -> Tuple[Credentials, Optional[str]]:
+  """(credentials, project) of google.auth.default(), loaded on the first
+  call. Raises DefaultCredentialsError as google.auth.default()."""
+  global _default
+  with _lock:
+    if _default is None:
+      _default = google.auth.default()
+    return _default
+
+
+def get_client(
+  service: str,
+  version: str,
+  project: Optional[str] = None
+) -> Resource:
+  """API client authenticated with the default credentials. Its token is
+  refreshed ahead of the expiry, see api.refresh_credentials()."""
+  credentials, _ = default_credentials()
+  refresh_credentials(credentials)
+  key = (service, version, project)
+  with _lock:
+    if key not in _clients:
+      _clients[key] = api_service(service, version, credentials)
+    return _clients[key]
+
+
+def clear() -> None:
+  """Forget the credentials and clients, e.g. after the ADC changed."""
+  global _default
+  with _lock:
+    _default = None
+    _clients.clear()
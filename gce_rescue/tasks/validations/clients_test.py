@@ -0,0 +1,78 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for clients.py."""
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from absl.testing import absltest
+from google.auth.credentials import AnonymousCredentials
+
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import clients
+
+
+class ClientsTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['discovery-live'] = False
+    clients.clear()
+    self.addCleanup(clients.clear)
+    self.default = self.enter_context(mock.patch.object(
+      clients.google.auth, 'default',
+      return_value=(AnonymousCredentials(), 'adc-project')))
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def test_default_credentials_once(self):
+    for _ in range(3):
+      credentials, project = clients.default_credentials()
+    self.assertIsInstance(credentials, AnonymousCredentials)
+    self.assertEqual(project, 'adc-project')
+    self.default.assert_called_once()
+
+
+  def test_get_client(self):
+    client = clients.get_client('compute', 'v1', 'project-1')
+    self.assertIs(clients.get_client('compute', 'v1', 'project-1'), client)
+    self.assertIsNot(clients.get_client('compute', 'v1', 'project-2'), client)
+    self.default.assert_called_once()
+
+
+  def test_get_client_threads(self):
+    with mock.patch.object(clients, 'api_service',
+                           side_effect=lambda *_: object()) as build:
+      with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(
+          lambda _: clients.get_client('compute', 'v1', 'project-1'),
+          range(32)))
+    build.assert_called_once()
+    self.assertLen({id(client) for client in results}, 1)
+
+
+  def test_clear(self):
+    client = clients.get_client('compute', 'v1')
+    clients.clear()
+    self.assertIsNot(clients.get_client('compute', 'v1'), client)
+    self.assertEqual(self.default.call_count, 2)
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -0,0 +1,148 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Discovery documents used to build the API objects.
+    Lookup order:
+      1. documents already loaded by this process.
+      2. on-disk cache, a compact copy of the document bundled with
+         google-api-python-client, or of the last live document.
+      3. the bundled document, its compact copy is saved on the on-disk
+         cache.
+    The live discovery service (~5 MB) is only fetched with discovery-live,
+    when the on-disk cache is older than discovery-cache-ttl. When it fails
+    the stale cache or the bundled document is used, and saved on the
+    on-disk cache to be used for FETCH_RETRY_DELAY seconds before fetching
+    again.
+"""
+
+import json
+import logging
+import os
+import tempfile
+import threading
+from time import time
+from typing import Optional
+
+import httplib2
+from googleapiclient import discovery_cache
+from googleapiclient.version import __version__ as client_version
+
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+DISCOVERY_URL = (
+  'https://{service}.googleapis.com/$discovery/rest?version={version}'
+)
+FETCH_TIMEOUT = 5
+FETCH_RETRY_DELAY = 3600
+
+_documents = {}
+_lock = threading.Lock()
+
+
+def _cache_file(service: str, version: str) -> str:
+  # Documents are versioned by the client library that will parse them.
+  return os.path.join(
+    get_config('discovery-cache-dir'),
+    client_version,
+    f'{service}.{version}.json'
+  )
+
+
+def _read_cache(file_name: str, ttl: Optional[int]) -> Optional[str]:
+  try:
+    if ttl is not None and time() - os.path.getmtime(file_name) > ttl:
+      return None
+    with open(file_name, encoding='utf-8') as file:
+      return file.read()
+  except OSError:
+    return None
+
+
+def _write_cache(
+  file_name: str,
+  content: str,
+  mtime: Optional[float] = None
+) -> None:
+  """Atomically replace the cached document, errors are only logged."""
+  try:
+    os.makedirs(os.path.dirname(file_name), exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(file_name))
+    with os.fdopen(fd, 'w', encoding='utf-8') as file:
+      file.write(content)
+    if mtime is not None:
+      os.utime(tmp_name, (mtime, mtime))
+    os.replace(tmp_name, file_name)
+  except OSError as e:
+    _logger.info(f'Unable to write discovery cache {file_name}: {e}')
+
+
+def _compact(content: str) -> str:
+  """Whitespace-free copy of the document, faster to read and parse."""
+  return json.dumps(json.loads(content), separators=(',', ':'))
+
+
+def _fetch(service: str, version: str) -> str:
+  url = DISCOVERY_URL.format(service=service, version=version)
+  response, content = httplib2.Http(timeout=FETCH_TIMEOUT).request(url)
+  if response.status != 200:
+    raise ValueError(f'{url} returned HTTP {response.status}')
+  return _compact(content)
+
+
+def _bundled(service: str, version: str) -> Optional[str]:
+  content = discovery_cache.get_static_doc(service, version)
+  return _compact(content) if content is not None else None
+
+
+def get_document(service: str, version: str, live: bool = None) -> str:
+  """Return the discovery document of service/version as JSON string."""
+
+  if live is None:
+    live = get_config('discovery-live')
+  key = (service, version)
+  with _lock:
+    if key in _documents:
+      return _documents[key]
+
+    file_name = _cache_file(service, version)
+    if not live:
+      content = _read_cache(file_name, ttl=None)
+      if content is None:
+        content = _bundled(service, version)
+        if content is not None:
+          _write_cache(file_name, content)
+      _documents[key] = content
+      return content
+
+    ttl = get_config('discovery-cache-ttl')
+    content = _read_cache(file_name, ttl=ttl)
+    fetch_failed = False
+    if content is None:
+      try:
+        content = _fetch(service, version)
+        _write_cache(file_name, content)
+      except (httplib2.HttpLib2Error, OSError, ValueError) as e:
+        _logger.info(f'Unable to fetch {service} {version} document: {e}')
+        fetch_failed = True
+    if content is None:
+      content = (_read_cache(file_name, ttl=None) or
+                 _bundled(service, version))
+      if fetch_failed and content is not None and ttl is not None:
+        # The next executions don't wait on the failing fetch again.
+        _write_cache(file_name, content,
+                     mtime=time() - max(ttl - FETCH_RETRY_DELAY, 0))
+    _documents[key] = content
+  return content
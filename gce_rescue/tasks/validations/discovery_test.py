@@ -0,0 +1,102 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+# pylint: disable=protected-access
+
+"""Test code for discovery.py."""
+
+import json
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import discovery
+
+
+class DiscoveryTest(absltest.TestCase):
+
+  def setUp(self):
+    self.enter_context(mock.patch.dict(config, {
+      'discovery-cache-dir': self.enter_context(
+        tempfile.TemporaryDirectory()),
+      'discovery-live': False,
+    }))
+    self.enter_context(mock.patch.dict(discovery._documents, clear=True))
+    self.cache_file = discovery._cache_file('compute', 'v1')
+
+
+  def test_bundled_document(self):
+    """Without cache, the document bundled with the client is used and its
+    compact copy saved, the live document is not fetched."""
+    with mock.patch.object(discovery, '_fetch') as fetch:
+      document = discovery.get_document('compute', 'v1')
+    fetch.assert_not_called()
+    self.assertEqual(json.loads(document)['name'], 'compute')
+    with open(self.cache_file, encoding='utf-8') as file:
+      self.assertEqual(file.read(), document)
+    self.assertNotIn('\n', document)
+
+
+  def test_cached_document(self):
+    discovery._write_cache(self.cache_file, '{"name": "cached"}')
+    document = json.loads(discovery.get_document('compute', 'v1'))
+    self.assertEqual(document['name'], 'cached')
+
+
+  def test_expired_document_is_refreshed(self):
+    discovery._write_cache(self.cache_file, '{"name": "old"}')
+    os.utime(self.cache_file, (0, 0))
+    with mock.patch.object(discovery, '_fetch',
+                           return_value='{"name": "new"}') as fetch:
+      document = discovery.get_document('compute', 'v1', live=True)
+    fetch.assert_called_once_with('compute', 'v1')
+    self.assertEqual(json.loads(document)['name'], 'new')
+    with open(self.cache_file, encoding='utf-8') as file:
+      self.assertEqual(json.load(file)['name'], 'new')
+
+
+  def test_expired_document_not_live(self):
+    """Without discovery-live the cache doesn't expire."""
+    discovery._write_cache(self.cache_file, '{"name": "old"}')
+    os.utime(self.cache_file, (0, 0))
+    document = json.loads(discovery.get_document('compute', 'v1'))
+    self.assertEqual(document['name'], 'old')
+
+
+  def test_failed_fetch_is_not_retried(self):
+    discovery._write_cache(self.cache_file, '{"name": "old"}')
+    os.utime(self.cache_file, (0, 0))
+    error = OSError('timed out')
+    with mock.patch.object(discovery, '_fetch', side_effect=error) as fetch:
+      document = discovery.get_document('compute', 'v1', live=True)
+      self.assertEqual(json.loads(document)['name'], 'old')
+      discovery._documents.clear()
+      discovery.get_document('compute', 'v1', live=True)
+    fetch.assert_called_once()
+
+    # It is fetched again after FETCH_RETRY_DELAY.
+    with mock.patch.object(discovery, 'time',
+                           return_value=discovery.time() +
+                           discovery.FETCH_RETRY_DELAY + 1), \
+         mock.patch.object(discovery, '_fetch',
+                           return_value='{"name": "new"}') as fetch:
+      discovery._documents.clear()
+      document = discovery.get_document('compute', 'v1', live=True)
+    self.assertEqual(json.loads(document)['name'], 'new')
+
+
+if __name__ == '__main__':
+  absltest.main()
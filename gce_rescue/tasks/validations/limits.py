@@ -0,0 +1,267 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Client side limits of the API requests, shared by every thread of the
+    process:
+    - a token bucket per API, project and kind of request (read or write),
+      so many rescues at once stay below the rate quotas of the project;
+    - retries of the rate limited (429) and failed (5xx) requests, after the
+      Retry-After of the response or a jittered exponential backoff;
+    - a circuit breaker per zone, failing fast while a zone keeps failing.
+    https://cloud.google.com/compute/api-quota
+"""
+
+import email.utils
+import logging
+import random
+import re
+import socket
+import threading
+from time import monotonic, sleep, time
+from typing import Callable, Dict, Optional, Tuple
+import uuid
+
+import googleapiclient.http
+from googleapiclient.errors import HttpError
+
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# Compute answers some rate limited requests with 403 and these reasons.
+RATE_LIMIT_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded')
+# Polling requests, read as the GETs even if wait is a POST.
+_READ_METHODS = ('compute.zoneOperations.wait',)
+
+_PROJECT = re.compile(r'projects/([^/:?]+)')
+_ZONE = re.compile(r'/zones/([^/?]+)')
+
+_lock = threading.Lock()
+_buckets: Dict[Tuple[str, str, str], 'TokenBucket'] = {}
+_breakers: Dict[str, 'CircuitBreaker'] = {}
+
+
+class CircuitOpenError(Exception):
+  """Requests to the zone are not sent, it failed too many times in a row."""
+
+
+class TokenBucket:
+  """rate requests per second, with bursts of up to burst requests."""
+
+  def __init__(self, rate: Optional[float], burst: Optional[float] = None):
+    self.rate = rate
+    self.burst = burst or max(rate or 0, 1)
+    self._tokens = self.burst
+    self._updated = monotonic()
+    self._lock = threading.Lock()
+
+  def reserve(self) -> float:
+    """Take a token and return the seconds to wait before using it."""
+    if not self.rate:
+      return 0
+    with self._lock:
+      now = monotonic()
+      self._tokens = min(self.burst,
+                         self._tokens + (now - self._updated) * self.rate)
+      self._updated = now
+      # Tokens can go negative, waiting callers are served in order.
+      self._tokens -= 1
+      return max(0.0, -self._tokens / self.rate)
+
+
+class CircuitBreaker:
+  """Open after threshold failures in a row. Once open, requests fail
+  without being sent for cooldown seconds, then they are let through again
+  and the first failure opens it again."""
+
+  def __init__(self, name: str, threshold: int, cooldown: float):
+    self.name = name
+    self.threshold = threshold
+    self.cooldown = cooldown
+    self.failures = 0
+    self._opened = None
+    self._lock = threading.Lock()
+
+  def check(self) -> None:
+    with self._lock:
+      if self._opened is None:
+        return
+      remaining = self._opened + self.cooldown - monotonic()
+    if remaining > 0:
+      raise CircuitOpenError(
+        f'Requests to {self.name} are failing, not sending more for '
+        f'{remaining:.0f}s.')
+
+  def success(self) -> None:
+    with self._lock:
+      self.failures = 0
+      self._opened = None
+
+  def failure(self) -> None:
+    with self._lock:
+      self.failures += 1
+      if self.threshold and self.failures >= self.threshold:
+        if self._opened is None:
+          _logger.info(f'Too many failures in {self.name}, '
+                       f'pausing its requests for {self.cooldown}s.')
+        self._opened = monotonic()
+
+
+def _kind(request: googleapiclient.http.HttpRequest) -> str:
+  if request.method == 'GET' or request.methodId in _READ_METHODS:
+    return 'read'
+  return 'write'
+
+
+def bucket(request: googleapiclient.http.HttpRequest) -> TokenBucket:
+  """Bucket of the API, project and kind of the request."""
+  match = _PROJECT.search(request.uri)
+  key = ((request.methodId or '').split('.')[0],
+         match.group(1) if match else '', _kind(request))
+  with _lock:
+    if key not in _buckets:
+      _buckets[key] = TokenBucket(get_config(f'api-{key[2]}-rate'))
+    return _buckets[key]
+
+
+def breaker(
+  request: googleapiclient.http.HttpRequest
+) -> Optional[CircuitBreaker]:
+  """Breaker of the zone of the request, None for regional and global
+  requests."""
+  match = _ZONE.search(request.uri)
+  if not match:
+    return None
+  with _lock:
+    if match.group(1) not in _breakers:
+      _breakers[match.group(1)] = CircuitBreaker(
+        match.group(1),
+        get_config('circuit-breaker-threshold'),
+        get_config('circuit-breaker-cooldown'))
+    return _breakers[match.group(1)]
+
+
+def _reason(error: HttpError) -> str:
+  try:
+    return error.error_details[0]['reason']
+  except (AttributeError, IndexError, KeyError, TypeError):
+    return ''
+
+
+def is_retryable(error: Exception) -> bool:
+  if isinstance(error, HttpError):
+    return (error.status_code in RETRY_STATUS or
+            (error.status_code == 403 and
+             _reason(error) in RATE_LIMIT_REASONS))
+  return isinstance(error, (ConnectionError, TimeoutError, socket.timeout))
+
+
+def _is_zone_failure(error: Exception) -> bool:
+  """Rate limits are per project, they say nothing about the zone."""
+  if isinstance(error, HttpError):
+    return error.status_code >= 500
+  return True
+
+
+def retry_after(error: Exception) -> Optional[float]:
+  """Seconds of the Retry-After header, in seconds or as a HTTP date."""
+  resp = getattr(error, 'resp', None)
+  value = resp.get('retry-after') if resp is not None else None
+  if not value:
+    return None
+  try:
+    return max(0.0, float(value))
+  except ValueError:
+    pass
+  try:
+    return max(0.0, email.utils.parsedate_to_datetime(value).timestamp()
+               - time())
+  except (TypeError, ValueError):
+    return None
+
+
+def backoff(attempt: int, error: Exception = None) -> float:
+  """Seconds before the retry number attempt (0 for the first retry)."""
+  delay = retry_after(error)
+  if delay is not None:
+    return delay
+  # Full jitter, the retries of many workers don't arrive together.
+  return random.uniform(0, min(get_config('api-retry-max-delay'),
+                               get_config('api-retry-delay') * 2 ** attempt))
+
+
+def add_request_id(request: googleapiclient.http.HttpRequest) -> None:
+  """Make the Compute changes safe to retry: the requests with the same
+  requestId are run only once.
+  https://cloud.google.com/compute/docs/api/handle-api-errors"""
+  if (_kind(request) != 'write' or
+      not (request.methodId or '').startswith('compute.') or
+      'requestId=' in request.uri):
+    return
+  separator = '&' if '?' in request.uri else '?'
+  request.uri = f'{request.uri}{separator}requestId={uuid.uuid4()}'
+
+
+def _failed(
+  request: googleapiclient.http.HttpRequest,
+  zone: Optional[CircuitBreaker],
+  attempt: int,
+  error: Exception
+) -> float:
+  """Seconds before retrying request, raises error when it is not retried."""
+  if not is_retryable(error):
+    if zone:
+      zone.success()
+    raise error
+  if zone and _is_zone_failure(error):
+    zone.failure()
+  if attempt >= get_config('api-retries'):
+    raise error
+  delay = backoff(attempt, error)
+  _logger.info(f'{request.methodId} failed ({error}), '
+               f'retrying in {delay:.1f}s.')
+  return delay
+
+
+def call(
+  request: googleapiclient.http.HttpRequest,
+  send: Callable[[], Dict]
+) -> Dict:
+  """Response of send(), which sends request, within the limits."""
+  add_request_id(request)
+  zone = breaker(request)
+  attempt = 0
+  while True:
+    if zone:
+      zone.check()
+    delay = bucket(request).reserve()
+    if delay:
+      sleep(delay)
+    try:
+      response = send()
+    except Exception as e: # pylint: disable=broad-except
+      sleep(_failed(request, zone, attempt, e))
+      attempt += 1
+      continue
+    if zone:
+      zone.success()
+    return response
+
+
+def clear() -> None:
+  """Forget the buckets and breakers, e.g. after the limits changed."""
+  with _lock:
+    _buckets.clear()
+    _breakers.clear()
@@ -0,0 +1,189 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for limits.py."""
+
+import json
+from unittest import mock
+
+from absl.testing import absltest
+import googleapiclient.http
+from googleapiclient.errors import HttpError
+import httplib2
+
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import limits
+
+URI = ('https://compute.googleapis.com/compute/v1/projects/p1/zones/'
+       'europe-central2-a/instances/vm1')
+
+
+def _request(method: str = 'GET', uri: str = URI,
+             method_id: str = 'compute.instances.get'):
+  return googleapiclient.http.HttpRequest(
+    None, None, uri, method=method, methodId=method_id)
+
+
+def _error(status: int, reason: str = 'error', **headers) -> HttpError:
+  content = {'error': {'code': status, 'message': 'Error.',
+                       'errors': [{'reason': reason}]}}
+  return HttpError(httplib2.Response({**headers, 'status': str(status)}),
+                   json.dumps(content).encode('utf-8'), uri=URI)
+
+
+class LimitsTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['api-retries'] = 3
+    config['circuit-breaker-threshold'] = 3
+    limits.clear()
+    self.addCleanup(limits.clear)
+    self.sleep = self.enter_context(mock.patch.object(limits, 'sleep'))
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def _send(self, *results):
+    """send() returning or raising each of results in turn."""
+    return mock.Mock(side_effect=list(results))
+
+
+  def test_token_bucket(self):
+    bucket = limits.TokenBucket(rate=10, burst=2)
+    with mock.patch.object(limits, 'monotonic', return_value=100):
+      bucket._updated = 100
+      delays = [bucket.reserve() for _ in range(4)]
+    self.assertEqual(delays[:2], [0, 0])
+    self.assertAlmostEqual(delays[2], 0.1)
+    self.assertAlmostEqual(delays[3], 0.2)
+    self.assertEqual(limits.TokenBucket(rate=None).reserve(), 0)
+
+
+  def test_buckets_per_project_and_kind(self):
+    read = limits.bucket(_request())
+    self.assertIs(limits.bucket(_request()), read)
+    self.assertIs(limits.bucket(_request(
+      'POST', URI + '/operations/op-1/wait', 'compute.zoneOperations.wait')),
+      read)
+    self.assertIsNot(limits.bucket(_request(
+      'POST', URI + '/stop', 'compute.instances.stop')), read)
+    self.assertIsNot(limits.bucket(_request(
+      uri=URI.replace('/p1/', '/p2/'))), read)
+
+
+  def test_retry_after(self):
+    send = self._send(_error(429, **{'retry-after': '3'}), {'name': 'vm1'})
+    self.assertEqual(limits.call(_request(), send), {'name': 'vm1'})
+    self.assertEqual(send.call_count, 2)
+    self.sleep.assert_called_once_with(3.0)
+    # Rate limits don't count as failures of the zone.
+    self.assertEqual(limits.breaker(_request()).failures, 0)
+
+
+  def test_retry_after_date(self):
+    error = _error(503, **{'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'})
+    self.assertEqual(limits.retry_after(error), 0)
+    self.assertIsNone(limits.retry_after(_error(503)))
+
+
+  def test_backoff(self):
+    config['api-retry-delay'] = 1
+    config['api-retry-max-delay'] = 10
+    with mock.patch.object(limits.random, 'uniform',
+                           side_effect=lambda low, high: high):
+      self.assertEqual([limits.backoff(attempt) for attempt in range(5)],
+                       [1, 2, 4, 8, 10])
+
+
+  def test_retryable(self):
+    self.assertTrue(limits.is_retryable(_error(500)))
+    self.assertTrue(limits.is_retryable(_error(403, 'rateLimitExceeded')))
+    self.assertTrue(limits.is_retryable(ConnectionResetError()))
+    self.assertFalse(limits.is_retryable(_error(403, 'forbidden')))
+    self.assertFalse(limits.is_retryable(_error(404, 'notFound')))
+    self.assertFalse(limits.is_retryable(ValueError()))
+
+
+  def test_not_retried(self):
+    send = self._send(_error(404, 'notFound'))
+    with self.assertRaises(HttpError):
+      limits.call(_request(), send)
+    send.assert_called_once()
+    self.sleep.assert_not_called()
+
+
+  def test_retries_exhausted(self):
+    send = self._send(*[_error(429)] * 4)
+    with self.assertRaises(HttpError):
+      limits.call(_request(), send)
+    self.assertEqual(send.call_count, 4)
+
+
+  def test_request_id(self):
+    request = _request('POST', URI + '/stop', 'compute.instances.stop')
+    uris = []
+
+    def _send():
+      uris.append(request.uri)
+      if len(uris) == 1:
+        raise _error(503)
+      return {}
+
+    limits.call(request, _send)
+    self.assertLen(set(uris), 1)
+    self.assertIn('?requestId=', uris[0])
+
+    for request in (_request(),
+                    _request('POST', URI + '/operations/op-1/wait',
+                             'compute.zoneOperations.wait')):
+      limits.add_request_id(request)
+      self.assertNotIn('requestId', request.uri)
+
+
+  def test_circuit_breaker(self):
+    config['api-retries'] = 0
+    now = [100.0]
+    self.enter_context(mock.patch.object(limits, 'monotonic',
+                                         side_effect=lambda: now[0]))
+    for _ in range(3):
+      with self.assertRaises(HttpError):
+        limits.call(_request(), self._send(_error(503)))
+
+    send = self._send({})
+    with self.assertRaises(limits.CircuitOpenError):
+      limits.call(_request(), send)
+    # Other zones are not affected.
+    limits.call(_request(uri=URI.replace('europe-central2-a', 'us-east1-b')),
+                send)
+    send.assert_called_once()
+
+    # After the cooldown, the first failure opens it again.
+    now[0] += config['circuit-breaker-cooldown']
+    with self.assertRaises(HttpError):
+      limits.call(_request(), self._send(_error(503)))
+    with self.assertRaises(limits.CircuitOpenError):
+      limits.call(_request(), send)
+
+    now[0] += config['circuit-breaker-cooldown']
+    limits.call(_request(), self._send({}))
+    self.assertEqual(limits.breaker(_request()).failures, 0)
+    limits.call(_request(), self._send({}))
+
+
+if __name__ == '__main__':
+  absltest.main()
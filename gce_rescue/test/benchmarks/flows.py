@@ -0,0 +1,209 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" End to end benchmark: set_rescue_mode followed by reset_rescue_mode
+    against FakeCompute, with the operation durations of its profile
+    multiplied by --scale. Reports the wall time of each flow and step, the
+    API calls and the polling overhead (time between an operation being
+    DONE and the client knowing it). With --http, the requests are sent over
+    HTTP to FakeComputeServer by the client built by api_service().
+
+    $ python3 -m gce_rescue.test.benchmarks.flows --rounds 5 --json new.json
+    $ python3 -m gce_rescue.test.benchmarks.flows --compare new.json
+"""
+
+import argparse
+from collections import Counter, defaultdict
+import json
+import statistics
+import sys
+from time import perf_counter
+from typing import Dict, List
+
+from gce_rescue import timings, tracing
+from gce_rescue.config import config
+from gce_rescue.fleet import Fleet
+from gce_rescue.gce import Instance
+from gce_rescue.tasks.actions import call_tasks
+from gce_rescue.test.fake_compute import FakeCompute, FakeComputeServer
+
+ZONE = 'europe-central2-a'
+ACTIONS = ('set_rescue_mode', 'reset_rescue_mode')
+
+
+def _run_action(
+  fake: FakeCompute,
+  action: str,
+  instances: int,
+  server: FakeComputeServer = None
+) -> Dict:
+  """Run action on every instance of fake, as a new execution would."""
+  tracer = tracing.enable()
+  calls = Counter(fake.calls)
+  polls = len(fake.poll_delays)
+  compute = server.service() if server else fake.service()
+  targets = [(ZONE, f'bench-{i}') for i in range(instances)]
+  # As rescue_fleet(), the requests of the fleet workers are batched.
+  config['batch-requests'] = instances > 1
+
+  start = perf_counter()
+  if instances == 1:
+    vm = Instance(test_mode=False, zone=ZONE, name=targets[0][1],
+                  project=fake.project, compute=compute)
+    call_tasks(vm, action, show_progress=False)
+  else:
+    fleet = Fleet(targets, project=fake.project, compute=compute)
+    fleet.discover()
+    failed = [result for result in fleet.run() if not result.ok]
+    if failed:
+      raise RuntimeError(f'{len(failed)} instances failed: {failed[0].error}')
+  elapsed = perf_counter() - start
+  tracing.disable()
+
+  steps = defaultdict(float)
+  for event in tracer.events:
+    if event.get('cat') == 'task':
+      # Slowest instance of each step.
+      steps[event['name']] = max(steps[event['name']], event['dur'] / 1e6)
+  return {
+    'total': elapsed,
+    'steps': dict(steps),
+    'calls': dict(Counter(fake.calls) - calls),
+    'poll_overhead': sum(fake.poll_delays[polls:]),
+    'operations': len(fake.poll_delays) - polls,
+    'instances': instances,
+  }
+
+
+def run(rounds: int, scale: float, instances: int, http: bool = False) -> Dict:
+  """Returns, per action, the list of timings of each round."""
+  results = {action: [] for action in ACTIONS}
+  for round_ in range(rounds):
+    fake = FakeCompute(scale=scale, seed=round_)
+    for i in range(instances):
+      fake.add_instance(ZONE, f'bench-{i}')
+    server = FakeComputeServer(fake).start() if http else None
+    try:
+      for action in ACTIONS:
+        results[action].append(_run_action(fake, action, instances, server))
+    finally:
+      if server:
+        server.stop()
+  return results
+
+
+def summarize(results: Dict) -> Dict:
+  summary = {}
+  for action, runs in results.items():
+    totals = [run_['total'] for run_ in runs]
+    step_names = sorted({name for run_ in runs for name in run_['steps']})
+    summary[action] = {
+      'total': {'median': statistics.median(totals),
+                'p95': timings.percentile(totals, 95)},
+      'steps': {
+        name: statistics.median([run_['steps'].get(name, 0) for run_ in runs])
+        for name in step_names
+      },
+      'calls': dict(sum((Counter(run_['calls']) for run_ in runs),
+                        Counter())),
+      'poll_overhead': statistics.median(
+        [run_['poll_overhead'] for run_ in runs]),
+      'operations': statistics.median([run_['operations'] for run_ in runs]),
+      'rounds': len(runs),
+      'instances': runs[0]['instances'],
+    }
+    for method in summary[action]['calls']:
+      summary[action]['calls'][method] /= len(runs)
+  return summary
+
+
+def report(summary: Dict) -> str:
+  lines = []
+  for action, data in summary.items():
+    lines.append(f'{action} ({data["rounds"]} rounds)')
+    lines.append(f'  total            median {data["total"]["median"]:7.3f}s'
+                 f'  p95 {data["total"]["p95"]:7.3f}s')
+    lines.append('  steps (median):')
+    for name, value in sorted(data['steps'].items(), key=lambda s: -s[1]):
+      lines.append(f'    {name:<18} {value:7.3f}s')
+    lines.append(f'  API calls per run: {sum(data["calls"].values()):.0f}')
+    for method, count in sorted(data['calls'].items()):
+      lines.append(f'    {method:<32} {count:5.1f}')
+    lines.append(f'  polling overhead: {data["poll_overhead"]:.3f}s over '
+                 f'{data["operations"]:.0f} operations')
+  return '\n'.join(lines)
+
+
+def compare(summary: Dict, baseline: Dict, threshold: float) -> List[str]:
+  """Regressions of the total median time greater than threshold (0.2 =
+  20%) or of the number of API calls."""
+  regressions = []
+  for action, data in summary.items():
+    if action not in baseline:
+      continue
+    if baseline[action].get('instances') != data['instances']:
+      print(f'{action}: not comparable, the baseline used '
+            f'{baseline[action].get("instances")} instances.')
+      continue
+    before = baseline[action]['total']['median']
+    after = data['total']['median']
+    change = (after - before) / before
+    print(f'{action}: {before:.3f}s -> {after:.3f}s ({change:+.1%})')
+    if change > threshold:
+      regressions.append(f'{action} total time {change:+.1%}')
+    calls_before = sum(baseline[action]['calls'].values())
+    calls_after = sum(data['calls'].values())
+    if calls_after > calls_before:
+      regressions.append(
+        f'{action} API calls {calls_before:.0f} -> {calls_after:.0f}')
+  return regressions
+
+
+def main() -> None:
+  parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+  parser.add_argument('--rounds', type=int, default=5)
+  parser.add_argument('--scale', type=float, default=0.01,
+                      help='Multiplier of the simulated API durations.')
+  parser.add_argument('--instances', type=int, default=1,
+                      help='Instances rescued at once (fleet mode).')
+  parser.add_argument('--engine', default='threads',
+                      choices=['threads', 'asyncio'])
+  parser.add_argument('--skip-snapshot', action='store_true')
+  parser.add_argument('--http', action='store_true',
+                      help='Send the requests over HTTP to a local server.')
+  parser.add_argument('--json', help='Save the summary to this file.')
+  parser.add_argument('--compare', help='Summary of a previous run.')
+  parser.add_argument('--threshold', type=float, default=0.2)
+  args = parser.parse_args()
+
+  config['engine'] = args.engine
+  # Durations of the simulated API don't belong to the local store.
+  config['timings-file'] = None
+  config['skip-snapshot'] = args.skip_snapshot
+  summary = summarize(run(args.rounds, args.scale, args.instances,
+                          args.http))
+  print(report(summary))
+  if args.json:
+    with open(args.json, 'w', encoding='utf-8') as file:
+      json.dump(summary, file, indent=2)
+  if args.compare:
+    with open(args.compare, encoding='utf-8') as file:
+      regressions = compare(summary, json.load(file), args.threshold)
+    if regressions:
+      print('Regressions:\n  ' + '\n  '.join(regressions))
+      sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
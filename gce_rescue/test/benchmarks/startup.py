@@ -0,0 +1,94 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Startup benchmark: time from nothing loaded to the first instances.get.
+    The HTTP layer is mocked, so only the client side cost is measured.
+
+    $ python3 -m gce_rescue.test.benchmarks.startup
+"""
+
+import gc
+import os
+import statistics
+import tempfile
+from time import perf_counter
+from unittest import mock
+
+import googleapiclient.discovery
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.http import HttpMock, HttpRequest
+
+from gce_rescue.config import config
+from gce_rescue.tasks.validations import api, discovery
+from gce_rescue.test.mocks import mock_data, MOCK_TEST_VM
+
+ROUNDS = 20
+INSTANCE_FILE = os.path.join(
+  os.path.dirname(os.path.dirname(__file__)), mock_data['compute']
+)
+
+
+def _first_get(build) -> float:
+  gc.collect()
+  start = perf_counter()
+  compute = build()
+  compute.instances().get(
+    project=MOCK_TEST_VM['project'],
+    zone=MOCK_TEST_VM['zone'],
+    instance=MOCK_TEST_VM['name']).execute()
+  return perf_counter() - start
+
+
+def _bundled():
+  """Previous behaviour: parse the document bundled with the client."""
+  return googleapiclient.discovery.build(
+    'compute', 'v1',
+    cache_discovery=False,
+    credentials=AnonymousCredentials(),
+    requestBuilder=HttpRequest)
+
+
+def _api_service():
+  return api.api_service('compute', 'v1', AnonymousCredentials())
+
+
+def run() -> None:
+  scenarios = {
+    'bundled document (no cache)': (_bundled, False),
+    'on-disk cache, new process': (_api_service, False),
+    'document loaded in process': (_api_service, True),
+  }
+  with tempfile.TemporaryDirectory() as cache_dir, \
+       mock.patch.object(api.httplib2, 'Http',
+                         side_effect=lambda *_, **__: HttpMock(INSTANCE_FILE)):
+    config['discovery-cache-dir'] = cache_dir
+    config['discovery-live'] = False
+    # Warm the on-disk cache as a previous run would have done.
+    discovery._write_cache( # pylint: disable=protected-access
+      discovery._cache_file('compute', 'v1'), # pylint: disable=protected-access
+      discovery._compact( # pylint: disable=protected-access
+        googleapiclient.discovery_cache.get_static_doc('compute', 'v1')))
+
+    print(f'Time to the first instances.get, median of {ROUNDS} rounds:')
+    for title, (build, keep_memo) in scenarios.items():
+      timings = []
+      for _ in range(ROUNDS):
+        if not keep_memo:
+          discovery._documents.clear() # pylint: disable=protected-access
+        timings.append(_first_get(build))
+      print(f'  {title:<30} {statistics.median(timings) * 1000:8.1f} ms')
+
+
+if __name__ == '__main__':
+  run()
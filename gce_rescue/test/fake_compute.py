@@ -0,0 +1,742 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Simulated Compute API, with state and latency, for benchmarks and end to
+end tests. FakeCompute replaces httplib2.Http in a googleapiclient service:
+
+  fake = FakeCompute(scale=0.01)
+  fake.add_instance('europe-central2-a', 'test')
+  compute = fake.service()
+
+or is served over HTTP on a local port, for the real client (api_service)
+to send its requests to it:
+
+  with FakeComputeServer(fake) as server:
+    compute = server.service()
+
+Each request takes a sampled API latency, and operations go through PENDING,
+RUNNING and DONE after a sampled duration per operation type. Durations are
+multiplied by scale to run realistic profiles in a fraction of the time.
+Errors such as 429 and 503 can be injected with add_fault(). Batch requests
+(multipart/mixed, see tasks/validations/batch.py) are answered part by
+part, each part as a request of its own.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+import email.parser
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import math
+import random
+import re
+import threading
+from time import sleep, time
+from typing import Dict, List, Optional, Sequence, Tuple
+from urllib.parse import parse_qs, urlsplit
+import uuid
+
+from google.auth.credentials import AnonymousCredentials
+import googleapiclient.discovery
+import httplib2
+
+from gce_rescue.tasks.validations.api import api_service
+
+BASE_URL = 'https://compute.googleapis.com/compute/v1/'
+
+
+@dataclass
+class Latency:
+  """Log-normal distribution around median (seconds)."""
+  median: float
+  sigma: float = 0.3
+
+  def sample(self, rng: random.Random) -> float:
+    if not self.median:
+      return 0.0
+    return self.median * math.exp(rng.gauss(0, self.sigma))
+
+
+# Typical durations observed on small instances. 'request' is the latency
+# of every request, unless the profile has a key for the method, e.g.
+# 'instances.get'. The other keys are operation types and boot time.
+DEFAULT_PROFILE = {
+  'request': Latency(0.08),
+  'wait-timeout': Latency(120, 0),
+  'boot': Latency(30),
+  'stop': Latency(20),
+  'start': Latency(15),
+  'insert': Latency(10),
+  'attachDisk': Latency(3),
+  'detachDisk': Latency(3),
+  'setMetadata': Latency(2),
+  'setLabels': Latency(0.5),
+  'delete': Latency(5),
+  'createSnapshot': Latency(40),
+  'instantSnapshot': Latency(2),
+}
+
+# No latency at all, for tests.
+INSTANT_PROFILE = {key: Latency(0, 0) for key in DEFAULT_PROFILE}
+
+
+_REASONS = {
+  400: 'badRequest', 404: 'notFound', 409: 'alreadyExists',
+  412: 'conditionNotMet', 429: 'rateLimitExceeded', 503: 'backendError',
+}
+
+
+class FakeError(Exception):
+  """Error returned to the client as an HTTP error response."""
+
+  def __init__(self, status: int, message: str, headers: Dict = None):
+    super().__init__(message)
+    self.status = status
+    self.headers = headers or {}
+
+
+@dataclass
+class Fault:
+  """Error injected instead of answering a request, with probability rate,
+  at most count times (None for no limit)."""
+  status: int = 503
+  rate: float = 1.0
+  count: Optional[int] = None
+  retry_after: Optional[int] = None
+
+
+_ROUTES = [
+  ('GET', r'zones/([^/]+)/instances/([^/]+)', 'instances.get'),
+  ('GET', r'zones/([^/]+)/instances/([^/]+)/serialPort',
+   'instances.getSerialPortOutput'),
+  ('GET', r'zones/([^/]+)/instances/([^/]+)/getGuestAttributes',
+   'instances.getGuestAttributes'),
+  ('POST', r'zones/([^/]+)/instances/([^/]+)/(start|stop|attachDisk|'
+   r'detachDisk|setMetadata)', 'instances.{}'),
+  ('GET', r'zones/([^/]+)/disks', 'disks.list'),
+  ('POST', r'zones/([^/]+)/disks', 'disks.insert'),
+  ('GET', r'zones/([^/]+)/disks/([^/]+)', 'disks.get'),
+  ('DELETE', r'zones/([^/]+)/disks/([^/]+)', 'disks.delete'),
+  ('POST', r'zones/([^/]+)/disks/([^/]+)/(setLabels|createSnapshot)',
+   'disks.{}'),
+  ('GET', r'global/snapshots/([^/]+)', 'snapshots.get'),
+  ('POST', r'zones/([^/]+)/instantSnapshots', 'instantSnapshots.insert'),
+  ('GET', r'zones/([^/]+)/instantSnapshots/([^/]+)', 'instantSnapshots.get'),
+  ('GET', r'global/images/family/([^/]+)', 'images.getFromFamily'),
+  ('GET', r'zones/([^/]+)/operations/([^/]+)', 'zoneOperations.get'),
+  ('POST', r'zones/([^/]+)/operations/([^/]+)/wait', 'zoneOperations.wait'),
+]
+
+
+class FakeCompute:
+  """Thread-safe, stateful fake of the Compute API methods used by
+  gce-rescue. Counters:
+    calls: Counter of requests per method, e.g. calls['instances.stop'].
+    batches: number of batch requests, their parts are counted in calls.
+    faults: Counter of errors injected per method.
+    poll_delays: seconds between each operation being DONE and the client
+      receiving it as DONE, i.e. the polling overhead.
+  """
+
+  def __init__(
+    self,
+    project: str = 'fake-project',
+    profile: Dict[str, Latency] = None,
+    scale: float = 1.0,
+    seed: Optional[int] = None
+  ):
+    self.project = project
+    self.profile = {**DEFAULT_PROFILE, **(profile or {})}
+    self.scale = scale
+    self.calls = Counter()
+    self.batches = 0
+    self.faults = Counter()
+    self.poll_delays: List[float] = []
+    self.instances: Dict[Tuple[str, str], Dict] = {}
+    self.disks: Dict[Tuple[str, str], Dict] = {}
+    self.snapshots: Dict[str, Dict] = {}
+    self.instant_snapshots: Dict[Tuple[str, str], Dict] = {}
+    self.operations: Dict[str, Dict] = {}
+    self._serial: Dict[Tuple[str, str], List] = {}
+    # (zone, instance) -> {key: (time it is written, value)}
+    self._guest_attributes: Dict[Tuple[str, str], Dict] = {}
+    self._faults: Dict[str, List[Fault]] = {}
+    self._rng = random.Random(seed)
+    self._lock = threading.RLock()
+
+  # Setup
+
+  def _sample(self, key: str) -> float:
+    with self._lock:
+      return self.profile[key].sample(self._rng) * self.scale
+
+  def _link(self, *parts: str) -> str:
+    return BASE_URL + '/'.join(('projects', self.project) + parts)
+
+  @staticmethod
+  def _fingerprint() -> str:
+    return uuid.uuid4().hex[:12]
+
+  def add_disk(
+    self,
+    zone: str,
+    name: str,
+    source_image: str = 'projects/debian-cloud/global/images/family/debian-11',
+    labels: Dict[str, str] = None
+  ) -> Dict:
+    family = source_image.split('/')[-1]
+    disk = {
+      'kind': 'compute#disk',
+      'name': name,
+      'zone': self._link('zones', zone),
+      'sizeGb': '10',
+      'type': self._link('zones', zone, 'diskTypes', 'pd-balanced'),
+      'status': 'READY',
+      'sourceImage': source_image,
+      'licenses': [f'{BASE_URL}projects/{family}/global/licenses/{family}'],
+      'labels': dict(labels or {}),
+      'labelFingerprint': self._fingerprint(),
+      'selfLink': self._link('zones', zone, 'disks', name),
+    }
+    with self._lock:
+      self.disks[(zone, name)] = disk
+    return disk
+
+  def add_instance(
+    self,
+    zone: str,
+    name: str,
+    source_image: str = 'projects/debian-cloud/global/images/family/debian-11',
+    status: str = 'RUNNING',
+    data_disks: Sequence[str] = ()
+  ) -> Dict:
+    """Create a instance with its own boot disk, named as the instance, and
+    the data disks attached with their name as device name."""
+    disk = self.add_disk(zone, name, source_image)
+    instance = {
+      'kind': 'compute#instance',
+      'name': name,
+      'zone': self._link('zones', zone),
+      'status': status,
+      'machineType': self._link('zones', zone, 'machineTypes', 'e2-medium'),
+      'disks': [],
+      'metadata': {'fingerprint': self._fingerprint(), 'items': []},
+      'selfLink': self._link('zones', zone, 'instances', name),
+    }
+    with self._lock:
+      self.instances[(zone, name)] = instance
+      self._serial[(zone, name)] = []
+      self._attach(zone, instance, disk, 'persistent-disk-0', boot=True)
+      for data_disk in data_disks:
+        self._attach(zone, instance, self.add_disk(zone, data_disk),
+                     data_disk, boot=False)
+    return instance
+
+  def add_serial_output(
+    self,
+    zone: str,
+    name: str,
+    text: str,
+    delay: float = 0
+  ) -> None:
+    """Write text to the serial console of the instance after delay."""
+    with self._lock:
+      self._get_instance(zone, name)
+      self._serial[(zone, name)].append((time() + delay, text))
+
+  def add_fault(
+    self,
+    method: str = '*',
+    status: int = 503,
+    rate: float = 1.0,
+    count: Optional[int] = None,
+    retry_after: Optional[int] = None
+  ) -> Fault:
+    """Answer requests of method ('*' for any) with an error."""
+    fault = Fault(status, rate, count, retry_after)
+    with self._lock:
+      self._faults.setdefault(method, []).append(fault)
+    return fault
+
+  def service(self) -> googleapiclient.discovery.Resource:
+    """Compute API object sending its requests to this fake."""
+    return googleapiclient.discovery.build('compute', 'v1', http=self)
+
+  # httplib2.Http interface
+
+  def request(self, uri, method='GET', body=None, headers=None,
+              redirections=None, connection_type=None):
+    del redirections, connection_type
+    status, headers, content = self.respond(method, uri, body, headers)
+    return httplib2.Response({**headers, 'status': str(status)}), content
+
+  def respond(
+    self,
+    method: str,
+    uri: str,
+    body=None,
+    headers: Dict[str, str] = None
+  ) -> Tuple[int, Dict[str, str], bytes]:
+    """Status, headers and content of the response to a request."""
+    if urlsplit(uri).path.startswith('/batch/'):
+      return self._respond_batch(body, headers or {})
+    headers = {'content-type': 'application/json; charset=UTF-8'}
+    try:
+      status, content = 200, self.handle(method, uri, body)
+    except FakeError as e:
+      status = e.status
+      headers.update(e.headers)
+      content = {'error': {
+        'code': e.status,
+        'message': str(e),
+        'errors': [{'reason': _REASONS.get(e.status, 'error'),
+                    'message': str(e)}],
+      }}
+    return status, headers, json.dumps(content).encode('utf-8')
+
+  def _respond_batch(
+    self,
+    body,
+    headers: Dict[str, str]
+  ) -> Tuple[int, Dict[str, str], bytes]:
+    """Answer each part of a multipart/mixed batch request, in parallel."""
+    content_type = {key.lower(): value
+                    for key, value in headers.items()}.get('content-type', '')
+    if isinstance(body, bytes):
+      body = body.decode('utf-8')
+    message = email.parser.Parser().parsestr(
+      f'content-type: {content_type}\r\n\r\n{body or ""}')
+    if not message.is_multipart():
+      raise FakeError(400, 'Batch request not in multipart/mixed format.')
+    with self._lock:
+      self.batches += 1
+
+    def _respond_part(part) -> str:
+      request_line, _, request = part.get_payload().partition('\n')
+      method, path, _ = request_line.split(' ', 2)
+      request_body = email.parser.Parser().parsestr(request).get_payload()
+      status, part_headers, content = self.respond(method, path,
+                                                   request_body or None)
+      lines = [f'HTTP/1.1 {status} {HTTPStatus(status).phrase}']
+      lines += [f'{name}: {value}' for name, value in part_headers.items()]
+      return (f'--{boundary}\r\n'
+              'Content-Type: application/http\r\n'
+              f'Content-ID: <response-{part["Content-ID"].strip("<>")}>'
+              '\r\n\r\n' + '\r\n'.join(lines) + '\r\n\r\n' +
+              content.decode('utf-8') + '\r\n')
+
+    boundary = uuid.uuid4().hex
+    parts = message.get_payload()
+    with ThreadPoolExecutor(max_workers=max(len(parts), 1)) as executor:
+      content = ''.join(executor.map(_respond_part, parts))
+    return 200, {
+      'content-type': f'multipart/mixed; boundary="{boundary}"'
+    }, (content + f'--{boundary}--').encode('utf-8')
+
+  def _inject_fault(self, method: str) -> None:
+    with self._lock:
+      for fault in self._faults.get(method, []) + self._faults.get('*', []):
+        if fault.count == 0 or self._rng.random() >= fault.rate:
+          continue
+        if fault.count is not None:
+          fault.count -= 1
+        self.faults[method] += 1
+        headers = {}
+        if fault.retry_after is not None:
+          headers['retry-after'] = str(fault.retry_after)
+        raise FakeError(fault.status, f'Injected error on {method}.', headers)
+
+  def handle(self, method: str, uri: str, body=None) -> Dict:
+    """Dispatch one request. Raises FakeError for error responses."""
+    parts = urlsplit(uri)
+    path = parts.path.split('/compute/v1/projects/', 1)[-1]
+    project, _, path = path.partition('/')
+    query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+    if isinstance(body, bytes):
+      body = body.decode('utf-8')
+    body = json.loads(body) if body else {}
+
+    for route_method, pattern, name in _ROUTES:
+      match = re.fullmatch(pattern, path)
+      if route_method != method or not match:
+        continue
+      args = list(match.groups())
+      if '{}' in name:
+        name = name.format(args.pop())
+      with self._lock:
+        self.calls[name] += 1
+      sleep(self._sample(name if name in self.profile else 'request'))
+      self._inject_fault(name)
+      # Images belong to the public image projects.
+      if project != self.project and not name.startswith('images.'):
+        raise FakeError(404, f'Project {project} not found.')
+      handler = getattr(self, '_' + name.replace('.', '_'))
+      return handler(*args, query=query, body=body, project=project)
+    raise FakeError(404, f'Unknown method {method} {path}.')
+
+  # Operations
+
+  def _operation(self, zone: str, operation_type: str, target: str) -> Dict:
+    duration = self._sample(operation_type)
+    now = time()
+    name = f'operation-{uuid.uuid4().hex}'
+    operation = {
+      'kind': 'compute#operation',
+      'name': name,
+      'zone': self._link('zones', zone),
+      'operationType': operation_type,
+      'targetLink': target,
+      'status': 'PENDING',
+      'selfLink': self._link('zones', zone, 'operations', name),
+      '_running_at': now + duration * 0.1,
+      '_done_at': now + duration,
+      '_observed': False,
+    }
+    with self._lock:
+      self.operations[name] = operation
+    return self._operation_view(operation)
+
+  def _operation_view(self, operation: Dict) -> Dict:
+    now = time()
+    with self._lock:
+      if now >= operation['_done_at']:
+        operation['status'] = 'DONE'
+        if not operation['_observed']:
+          operation['_observed'] = True
+          self.poll_delays.append(now - operation['_done_at'])
+      elif now >= operation['_running_at']:
+        operation['status'] = 'RUNNING'
+      return {key: value for key, value in operation.items()
+              if not key.startswith('_')}
+
+  def _get_operation(self, name: str) -> Dict:
+    with self._lock:
+      if name not in self.operations:
+        raise FakeError(404, f'Operation {name} not found.')
+      return self.operations[name]
+
+  def _zoneOperations_get(self, zone, name, **_) -> Dict:
+    del zone
+    return self._operation_view(self._get_operation(name))
+
+  def _zoneOperations_wait(self, zone, name, **_) -> Dict:
+    del zone
+    operation = self._get_operation(name)
+    remaining = operation['_done_at'] - time()
+    sleep(max(min(remaining, self._sample('wait-timeout')), 0))
+    return self._operation_view(operation)
+
+  # Instances
+
+  def _get_instance(self, zone: str, name: str) -> Dict:
+    with self._lock:
+      if (zone, name) not in self.instances:
+        raise FakeError(404, f'Instance {name} not found.')
+      return self.instances[(zone, name)]
+
+  def _get_disk(self, zone: str, name: str) -> Dict:
+    with self._lock:
+      if (zone, name) not in self.disks:
+        raise FakeError(404, f'Disk {name} not found.')
+      return self.disks[(zone, name)]
+
+  def _attach(self, zone, instance, disk, device_name, boot) -> None:
+    if disk.get('users'):
+      raise FakeError(400, f'Disk {disk["name"]} is already being used.')
+    if boot and any(attached['boot'] for attached in instance['disks']):
+      raise FakeError(400, 'The instance already has a boot disk.')
+    attached = {
+      'kind': 'compute#attachedDisk',
+      'type': 'PERSISTENT',
+      'source': disk['selfLink'],
+      'deviceName': device_name,
+      'boot': boot,
+      'licenses': disk['licenses'],
+      'architecture': 'X86_64',
+    }
+    if boot:
+      instance['disks'].insert(0, attached)
+    else:
+      instance['disks'].append(attached)
+    for index, item in enumerate(instance['disks']):
+      item['index'] = index
+    disk['users'] = [instance['selfLink']]
+    del zone
+
+  def _instances_get(self, zone, name, **_) -> Dict:
+    with self._lock:
+      return json.loads(json.dumps(self._get_instance(zone, name)))
+
+  def _instances_getSerialPortOutput(self, zone, name, query, **_) -> Dict:
+    start = int(query.get('start', 0))
+    with self._lock:
+      self._get_instance(zone, name)
+      now = time()
+      contents = ''.join(text for at, text in self._serial[(zone, name)]
+                         if at <= now)
+    return {'contents': contents[start:], 'start': str(start),
+            'next': str(len(contents))}
+
+  def _instances_getGuestAttributes(self, zone, name, query, **_) -> Dict:
+    key = query.get('variableKey')
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      if not any(item['key'] == 'enable-guest-attributes' and
+                 item['value'].upper() == 'TRUE'
+                 for item in instance['metadata']['items']):
+        raise FakeError(400, 'Guest attributes are disabled.')
+      written_at, value = self._guest_attributes.get(
+        (zone, name), {}).get(key, (None, None))
+      if written_at is None or written_at > time():
+        raise FakeError(404, f'Guest attribute {key} not found.')
+    return {'kind': 'compute#guestAttributes', 'variableKey': key,
+            'variableValue': value}
+
+  def _instances_start(self, zone, name, **_) -> Dict:
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      if not any(disk['boot'] for disk in instance['disks']):
+        raise FakeError(400, 'The instance has no boot disk.')
+      operation = self._operation(zone, 'start', instance['selfLink'])
+      instance['status'] = 'RUNNING'
+      self._boot(zone, instance, self.operations[operation['name']])
+    return operation
+
+  def _boot(self, zone: str, instance: Dict, operation: Dict) -> None:
+    """Write to the serial console and the gce-rescue/ready guest attribute
+    as the startup-script would do."""
+    booted_at = operation['_done_at'] + self._sample('boot')
+    serial = self._serial[(zone, instance['name'])]
+    serial.append((operation['_done_at'], 'Booting...\n'))
+    attributes = self._guest_attributes.setdefault((zone, instance['name']),
+                                                   {})
+    attributes.clear()
+    for item in instance['metadata']['items']:
+      match = re.search(r'^ts=(\d+)', item['value'], re.M)
+      if item['key'] == 'startup-script' and match:
+        serial.append((booted_at, f'END:{match.group(1)}\n'))
+        attributes['gce-rescue/ready'] = (booted_at, match.group(1))
+
+  def _instances_stop(self, zone, name, **_) -> Dict:
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      instance['status'] = 'TERMINATED'
+      return self._operation(zone, 'stop', instance['selfLink'])
+
+  def _instances_attachDisk(self, zone, name, body, **_) -> Dict:
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      disk_name = body['source'].split('/')[-1]
+      disk = self._get_disk(zone, disk_name)
+      boot = body.get('boot', False)
+      if boot and instance['status'] != 'TERMINATED':
+        raise FakeError(400, 'The instance must be stopped.')
+      self._attach(zone, instance, disk, body.get('deviceName', disk_name),
+                   boot)
+      return self._operation(zone, 'attachDisk', instance['selfLink'])
+
+  def _instances_detachDisk(self, zone, name, query, **_) -> Dict:
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      for attached in instance['disks']:
+        if attached['deviceName'] == query.get('deviceName'):
+          break
+      else:
+        raise FakeError(400, f'No disk {query.get("deviceName")} attached.')
+      if attached['boot'] and instance['status'] != 'TERMINATED':
+        raise FakeError(400, 'The instance must be stopped.')
+      instance['disks'].remove(attached)
+      disk = self._get_disk(zone, attached['source'].split('/')[-1])
+      disk['users'] = []
+      return self._operation(zone, 'detachDisk', instance['selfLink'])
+
+  def _instances_setMetadata(self, zone, name, body, **_) -> Dict:
+    with self._lock:
+      instance = self._get_instance(zone, name)
+      if body.get('fingerprint') != instance['metadata']['fingerprint']:
+        raise FakeError(412, 'Metadata fingerprint does not match.')
+      instance['metadata'] = {
+        'fingerprint': self._fingerprint(),
+        'items': [{'key': item['key'], 'value': str(item['value'])}
+                  for item in body.get('items', [])]
+      }
+      return self._operation(zone, 'setMetadata', instance['selfLink'])
+
+  # Disks and snapshots
+
+  def _disks_list(self, zone, query, **_) -> Dict:
+    terms = re.findall(r'labels\.([\w-]+)\s*=\s*"?([\w-]+)"?',
+                       query.get('filter', ''))
+    with self._lock:
+      items = [json.loads(json.dumps(disk))
+               for (disk_zone, _), disk in self.disks.items()
+               if disk_zone == zone and all(
+                 disk['labels'].get(key) == value for key, value in terms)]
+    result = {'kind': 'compute#diskList'}
+    if items:
+      result['items'] = items
+    return result
+
+  def _disks_get(self, zone, name, **_) -> Dict:
+    with self._lock:
+      return json.loads(json.dumps(self._get_disk(zone, name)))
+
+  def _disks_insert(self, zone, body, **_) -> Dict:
+    with self._lock:
+      if (zone, body['name']) in self.disks:
+        raise FakeError(409, f'Disk {body["name"]} already exists.')
+      disk = self.add_disk(zone, body['name'], body.get('sourceImage', ''),
+                           body.get('labels'))
+      disk['type'] = body.get('type', disk['type'])
+      disk['sizeGb'] = body.get('sizeGb', disk['sizeGb'])
+      if 'sourceDisk' in body:
+        # Clone of another disk.
+        source = self._get_disk(zone, body['sourceDisk'].split('/')[-1])
+        disk['sourceDisk'] = source['selfLink']
+        disk['licenses'] = list(source['licenses'])
+      return self._operation(zone, 'insert', disk['selfLink'])
+
+  def _disks_delete(self, zone, name, **_) -> Dict:
+    with self._lock:
+      disk = self._get_disk(zone, name)
+      if disk.get('users'):
+        raise FakeError(400, f'Disk {name} is being used.')
+      del self.disks[(zone, name)]
+      return self._operation(zone, 'delete', disk['selfLink'])
+
+  def _disks_setLabels(self, zone, name, body, **_) -> Dict:
+    with self._lock:
+      disk = self._get_disk(zone, name)
+      if body.get('labelFingerprint') != disk['labelFingerprint']:
+        raise FakeError(412, 'Label fingerprint does not match.')
+      disk['labels'] = {key: str(value) for key, value in
+                        body.get('labels', {}).items()}
+      disk['labelFingerprint'] = self._fingerprint()
+      return self._operation(zone, 'setLabels', disk['selfLink'])
+
+  def _disks_createSnapshot(self, zone, name, body, **_) -> Dict:
+    with self._lock:
+      disk = self._get_disk(zone, name)
+      if body['name'] in self.snapshots:
+        raise FakeError(409, f'Snapshot {body["name"]} already exists.')
+      snapshot = {
+        'kind': 'compute#snapshot',
+        'name': body['name'],
+        'sourceDisk': disk['selfLink'],
+        'storageLocations': body.get('storageLocations', []),
+        'selfLink': self._link('global', 'snapshots', body['name']),
+      }
+      self.snapshots[body['name']] = snapshot
+      return self._operation(zone, 'createSnapshot', disk['selfLink'])
+
+  def _images_getFromFamily(self, family, project, **_) -> Dict:
+    name = f'{family}-v20240110'
+    return {
+      'kind': 'compute#image',
+      'name': name,
+      'family': family,
+      'status': 'READY',
+      'selfLink': f'{BASE_URL}projects/{project}/global/images/{name}',
+    }
+
+  def _instantSnapshots_insert(self, zone, body, **_) -> Dict:
+    with self._lock:
+      disk = self._get_disk(zone, body['sourceDisk'].split('/')[-1])
+      if (zone, body['name']) in self.instant_snapshots:
+        raise FakeError(409, f'Instant snapshot {body["name"]} already '
+                        'exists.')
+      link = self._link('zones', zone, 'instantSnapshots', body['name'])
+      self.instant_snapshots[(zone, body['name'])] = {
+        'kind': 'compute#instantSnapshot',
+        'name': body['name'],
+        'sourceDisk': disk['selfLink'],
+        'selfLink': link,
+      }
+      return self._operation(zone, 'instantSnapshot', link)
+
+  def _instantSnapshots_get(self, zone, name, **_) -> Dict:
+    with self._lock:
+      if (zone, name) not in self.instant_snapshots:
+        raise FakeError(404, f'Instant snapshot {name} not found.')
+      return dict(self.instant_snapshots[(zone, name)])
+
+  def _snapshots_get(self, name, **_) -> Dict:
+    with self._lock:
+      if name not in self.snapshots:
+        raise FakeError(404, f'Snapshot {name} not found.')
+      return dict(self.snapshots[name])
+
+
+class _Handler(BaseHTTPRequestHandler):
+  """Keep-alive handler passing every request to server.fake."""
+  protocol_version = 'HTTP/1.1'
+
+  def _dispatch(self) -> None:
+    length = int(self.headers.get('content-length', 0))
+    body = self.rfile.read(length) if length else None
+    status, headers, content = self.server.fake.respond(
+      self.command, self.path, body, dict(self.headers))
+    self.send_response(status)
+    for name, value in headers.items():
+      self.send_header(name, value)
+    self.send_header('content-length', str(len(content)))
+    self.end_headers()
+    self.wfile.write(content)
+
+  do_GET = do_POST = do_DELETE = _dispatch
+
+  def log_message(self, *args) -> None: # pylint: disable=arguments-differ
+    del args
+
+
+class FakeComputeServer:
+  """HTTP server of a FakeCompute, on a local port, running in a thread."""
+
+  def __init__(self, fake: FakeCompute, host: str = '127.0.0.1',
+               port: int = 0):
+    self.fake = fake
+    self._server = ThreadingHTTPServer((host, port), _Handler)
+    self._server.daemon_threads = True
+    self._server.fake = fake
+    self._thread = None
+
+  @property
+  def endpoint(self) -> str:
+    host, port = self._server.server_address[:2]
+    return f'http://{host}:{port}/compute/v1/'
+
+  def start(self) -> 'FakeComputeServer':
+    self._thread = threading.Thread(target=self._server.serve_forever,
+                                    daemon=True)
+    self._thread.start()
+    return self
+
+  def stop(self) -> None:
+    self._server.shutdown()
+    self._server.server_close()
+    self._thread.join()
+
+  def __enter__(self) -> 'FakeComputeServer':
+    return self.start()
+
+  def __exit__(self, *exc) -> None:
+    self.stop()
+
+  def service(self) -> googleapiclient.discovery.Resource:
+    """Compute API object built by api_service(), as in a real execution,
+    sending its requests to this server."""
+    return api_service('compute', 'v1', AnonymousCredentials(),
+                       api_endpoint=self.endpoint)
@@ -0,0 +1,382 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""End to end tests of the rescue flows against fake_compute.py."""
+
+import os
+import tempfile
+from unittest import mock
+
+from absl.testing import absltest
+from googleapiclient.errors import HttpError
+
+from gce_rescue.config import config
+from gce_rescue import timings
+from gce_rescue.fleet import Fleet
+from gce_rescue.gce import Instance
+from gce_rescue.tasks import images, keeper, scheduler, snapshots
+from gce_rescue.tasks.actions import call_tasks, plan
+from gce_rescue.tasks.validations import limits
+from gce_rescue.test.fake_compute import (
+  FakeCompute,
+  FakeComputeServer,
+  INSTANT_PROFILE
+)
+
+ZONE = 'europe-central2-a'
+
+
+class FakeComputeTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['skip-snapshot'] = True
+    config['discovery-live'] = False
+    config['discovery-cache-dir'] = self.enter_context(
+      tempfile.TemporaryDirectory())
+    config['journal-dir'] = self.enter_context(tempfile.TemporaryDirectory())
+    config['timings-file'] = os.path.join(
+      self.enter_context(tempfile.TemporaryDirectory()), 'timings.json')
+    timings.clear()
+    limits.clear()
+    self.fake = FakeCompute(profile=INSTANT_PROFILE, seed=0)
+    self.compute = self.fake.service()
+    images.clear_cache()
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def _instance(self, name: str) -> Instance:
+    return Instance(test_mode=False, zone=ZONE, name=name,
+                    project=self.fake.project, compute=self.compute)
+
+
+  def _assert_original_layout(self, name: str) -> None:
+    instance = self.fake.instances[(ZONE, name)]
+    self.assertEqual(instance['status'], 'RUNNING')
+    self.assertEqual(
+      [(disk['deviceName'], disk['boot']) for disk in instance['disks']],
+      [('persistent-disk-0', True)])
+    self.assertEqual(instance['metadata'].get('items', []), [])
+    self.assertEqual(
+      [disk_name for zone, disk_name in self.fake.disks if zone == ZONE],
+      [name])
+
+
+  def _rescue_and_restore(self, engine: str) -> None:
+    config['engine'] = engine
+    self.fake.add_instance(ZONE, 'vm1')
+
+    call_tasks(self._instance('vm1'), 'set_rescue_mode', show_progress=False)
+    instance = self.fake.instances[(ZONE, 'vm1')]
+    boot = [disk for disk in instance['disks'] if disk['boot']]
+    self.assertTrue(boot[0]['source'].split('/')[-1].startswith(
+      'linux-rescue-vm1-'))
+    self.assertLen(instance['disks'], 2)
+
+    vm = self._instance('vm1')
+    self.assertTrue(vm.rescue_mode_status['rescue-mode'])
+    call_tasks(vm, 'reset_rescue_mode', show_progress=False)
+    self._assert_original_layout('vm1')
+    self.assertEqual(self.fake.calls['disks.insert'], 1)
+    self.assertEqual(self.fake.calls['disks.delete'], 1)
+    self.assertEqual(self.fake.calls['instances.getGuestAttributes'], 1)
+    self.assertEqual(self.fake.calls['instances.getSerialPortOutput'], 0)
+
+
+  def test_rescue_threads(self):
+    self._rescue_and_restore('threads')
+
+
+  def test_rescue_asyncio(self):
+    self._rescue_and_restore('asyncio')
+
+
+  def test_fleet(self):
+    # As in rescue_fleet().
+    config['batch-requests'] = True
+    targets = [(ZONE, 'vm1'), (ZONE, 'vm2')]
+    for _, name in targets:
+      self.fake.add_instance(ZONE, name)
+    for action in ('set_rescue_mode', 'reset_rescue_mode'):
+      fleet = Fleet(targets, project=self.fake.project,
+                    compute=self.fake.service())
+      fleet.discover()
+      results = fleet.run()
+      self.assertTrue(all(result.ok for result in results),
+                      [result.error for result in results])
+      if action == 'set_rescue_mode':
+        # The image family is resolved once for the whole fleet.
+        self.assertEqual(self.fake.calls['images.getFromFamily'], 1)
+        rescue_disks = [disk for (_, name), disk in self.fake.disks.items()
+                        if name.startswith('linux-rescue-')]
+        self.assertLen(rescue_disks, 2)
+        for disk in rescue_disks:
+          self.assertEndsWith(disk['sourceImage'],
+                              '/images/rocky-linux-9-v20240110')
+    for _, name in targets:
+      self.assertEqual(self.fake.instances[(ZONE, name)]['disks'][0]['source']
+                       .split('/')[-1], name)
+    self.assertEqual(self.fake.calls['disks.insert'], 2)
+    self.assertEqual(self.fake.calls['disks.delete'], 2)
+    self.assertGreater(self.fake.batches, 0)
+
+
+  def test_backup_methods(self):
+    config['skip-snapshot'] = False
+    for method, engine in [('snapshot', 'threads'),
+                           ('instant-snapshot', 'asyncio'),
+                           ('clone', 'threads'),
+                           ('none', 'asyncio')]:
+      config['backup'] = method
+      config['engine'] = engine
+      name = f'vm-{method}'
+      self.fake.add_instance(ZONE, name)
+      call_tasks(self._instance(name), 'set_rescue_mode', show_progress=False)
+
+      vm = self._instance(name)
+      self.assertEqual(vm.backup_method, method)
+      self.assertEqual(self.fake.disks[(ZONE, name)]['labels'],
+                       {'rescue': str(vm.ts), 'rescue-backup': method})
+      expected = '' if method == 'none' else f'{name}-{vm.ts}'
+      self.assertEqual(vm.backup, expected)
+    clones = [disk for disk in self.fake.disks.values() if 'sourceDisk' in disk]
+    self.assertLen(clones, 1)
+    self.assertEqual(len(self.fake.snapshots), 1)
+    self.assertEqual(len(self.fake.instant_snapshots), 1)
+
+
+  def test_snapshot_data_disks(self):
+    config['skip-snapshot'] = False
+    config['backup'] = 'snapshot'
+    config['snapshot-data-disks'] = True
+    for engine in ('threads', 'asyncio'):
+      config['engine'] = engine
+      name = f'vm-{engine}'
+      self.fake.add_instance(ZONE, name, data_disks=[f'{name}-data'])
+      vm = self._instance(name)
+      call_tasks(vm, 'set_rescue_mode', show_progress=False)
+      self.assertEqual(snapshots.manager.poll(vm), {
+        f'{name}-{vm.ts}': 'DONE',
+        f'{name}-data-{vm.ts}': 'DONE',
+      })
+      self.assertEqual(
+        self.fake.snapshots[f'{name}-data-{vm.ts}']['sourceDisk'],
+        self.fake.disks[(ZONE, f'{name}-data')]['selfLink'])
+      for job in snapshots.manager.jobs(vm):
+        self.assertIn(job.operation, self.fake.operations)
+    self.assertLen(self.fake.snapshots, 4)
+
+
+  def test_backup_failure(self):
+    config['skip-snapshot'] = False
+    config['backup'] = 'snapshot'
+    for engine in ('threads', 'asyncio'):
+      config['engine'] = engine
+      config['resume'] = False
+      name = f'vm-{engine}'
+      self.fake.add_instance(ZONE, name)
+      self.fake.add_fault('disks.createSnapshot', status=400, count=1)
+      with self.assertRaises(scheduler.OptionalTaskFailed):
+        call_tasks(self._instance(name), 'set_rescue_mode',
+                   show_progress=False)
+      # The rescue went on, only the backup is missing.
+      instance = self.fake.instances[(ZONE, name)]
+      self.assertEqual(instance['status'], 'RUNNING')
+      self.assertTrue(instance['disks'][0]['source'].split('/')[-1]
+                      .startswith(f'linux-rescue-{name}-'))
+      self.assertLen(self.fake.snapshots, 0)
+
+      config['resume'] = True
+      vm = self._instance(name)
+      call_tasks(vm, 'set_rescue_mode', show_progress=False)
+      self.assertIn(f'{name}-{vm.ts}', self.fake.snapshots)
+      self.assertIsNone(vm.journal)
+      self.fake.snapshots.clear()
+    self.assertEqual(self.fake.calls['disks.insert'], 2)
+
+
+  def test_auto_disk_type(self):
+    config['rescue-disk-type'] = 'auto'
+    config['rescue-disk-size'] = 50
+    self.fake.add_instance(ZONE, 'vm1')
+    self.fake.disks[(ZONE, 'vm1')]['type'] = 'zones/z/diskTypes/pd-ssd'
+    vm = self._instance('vm1')
+    call_tasks(vm, 'set_rescue_mode', show_progress=False)
+    rescue_disk = self.fake.disks[(ZONE, vm.rescue_disk)]
+    self.assertEndsWith(rescue_disk['type'], '/diskTypes/pd-ssd')
+    self.assertEqual(rescue_disk['sizeGb'], '50')
+
+
+  def _rescue_with_helper(self, engine: str) -> None:
+    config['engine'] = engine
+    config['helper-vm'] = 'helper'
+    self.fake.add_instance(ZONE, 'helper')
+    self.fake.add_instance(ZONE, 'vm1')
+
+    vm = self._instance('vm1')
+    call_tasks(vm, 'set_rescue_mode', show_progress=False)
+    helper = self.fake.instances[(ZONE, 'helper')]
+    self.assertEqual(
+      [(disk['deviceName'], disk['boot']) for disk in helper['disks']],
+      [('persistent-disk-0', True), ('vm1', False)])
+    instance = self.fake.instances[(ZONE, 'vm1')]
+    self.assertEqual(instance['status'], 'TERMINATED')
+    self.assertEmpty(instance['disks'])
+    self.assertEqual(instance['metadata']['items'], [])
+
+    # The state comes from the labels of the boot disk.
+    config['helper-vm'] = None
+    vm = self._instance('vm1')
+    self.assertTrue(vm.rescue_mode_status['rescue-mode'])
+    self.assertEqual(vm.helper_vm, 'helper')
+    call_tasks(vm, 'reset_rescue_mode', show_progress=False)
+    self.assertEqual(instance['status'], 'RUNNING')
+    self.assertEqual(
+      [(disk['deviceName'], disk['boot']) for disk in instance['disks']],
+      [('persistent-disk-0', True)])
+    self.assertLen(helper['disks'], 1)
+    for method in ('disks.insert', 'instances.setMetadata'):
+      self.assertEqual(self.fake.calls[method], 0)
+
+
+  def test_helper_vm_threads(self):
+    self._rescue_with_helper('threads')
+
+
+  def test_helper_vm_asyncio(self):
+    self._rescue_with_helper('asyncio')
+
+
+  def test_plan(self):
+    self.fake.add_instance(ZONE, 'vm1')
+    vm = self._instance('vm1')
+    before = plan(vm, 'set_rescue_mode')
+    self.assertEqual(before['location'], f'{ZONE}/e2-medium')
+    self.assertEqual({step['samples'] for step in before['steps']}, {0})
+    # Nothing was changed.
+    self.assertEqual(sum(self.fake.calls.values()),
+                     self.fake.calls['instances.get'])
+
+    call_tasks(vm, 'set_rescue_mode', show_progress=False)
+    timings.clear()
+    after = plan(self._instance('vm1'), 'reset_rescue_mode')
+    self.assertEqual(
+      {step['id']: step['samples'] for step in after['steps']}['stop'], 1)
+    self.assertLess(after['p90'], before['p50'])
+
+
+  def test_rescue_over_http(self):
+    with FakeComputeServer(self.fake) as server:
+      self.compute = server.service()
+      self._rescue_and_restore('asyncio')
+
+
+  def test_batch_over_http(self):
+    config['batch-requests'] = True
+    self.fake.add_instance(ZONE, 'vm1')
+    self.fake.add_fault('disks.get', status=503, count=1)
+    with FakeComputeServer(self.fake) as server:
+      self.compute = server.service()
+      with mock.patch.object(limits, 'sleep'):
+        call_tasks(self._instance('vm1'), 'set_rescue_mode',
+                   show_progress=False)
+    self.assertGreater(self.fake.batches, 0)
+    self.assertEqual(self.fake.faults['disks.get'], 1)
+
+
+  def test_injected_faults(self):
+    # The errors as answered by the fake, without the client retries.
+    config['api-retries'] = 0
+    self.fake.add_instance(ZONE, 'vm1')
+    self.fake.add_fault('disks.get', status=429, count=1, retry_after=5)
+    self.fake.add_fault('instances.stop', status=503)
+    with FakeComputeServer(self.fake) as server:
+      compute = server.service()
+      get = compute.disks().get(project=self.fake.project, zone=ZONE,
+                                disk='vm1')
+      with self.assertRaises(HttpError) as error:
+        get.execute()
+      self.assertEqual(error.exception.status_code, 429)
+      self.assertEqual(error.exception.resp['retry-after'], '5')
+      self.assertEqual(get.execute()['name'], 'vm1')
+      with self.assertRaises(HttpError) as error:
+        compute.instances().stop(project=self.fake.project, zone=ZONE,
+                                 instance='vm1').execute()
+      self.assertEqual(error.exception.status_code, 503)
+    self.assertEqual(self.fake.faults,
+                     {'disks.get': 1, 'instances.stop': 1})
+    self.assertEqual(self.fake.instances[(ZONE, 'vm1')]['status'], 'RUNNING')
+
+
+  def test_retries(self):
+    config['api-retry-delay'] = 0.01
+    self.fake.add_fault('disks.insert', status=429, count=2, retry_after=0)
+    self.fake.add_fault('instances.stop', status=503, count=2)
+    with FakeComputeServer(self.fake) as server:
+      self.compute = server.service()
+      for engine in ('threads', 'asyncio'):
+        config['engine'] = engine
+        self.fake.add_instance(ZONE, f'vm-{engine}')
+        call_tasks(self._instance(f'vm-{engine}'), 'set_rescue_mode',
+                   show_progress=False)
+        self.assertLen(self.fake.instances[(ZONE, f'vm-{engine}')]['disks'],
+                       2)
+    self.assertEqual(self.fake.faults, {'disks.insert': 2,
+                                        'instances.stop': 2})
+    self.assertEqual(self.fake.calls['disks.insert'], 4)
+    self.assertEqual(self.fake.calls['instances.stop'], 4)
+
+
+  def test_circuit_breaker(self):
+    config['api-retry-delay'] = 0.01
+    config['circuit-breaker-threshold'] = 3
+    self.fake.add_instance(ZONE, 'vm1')
+    with FakeComputeServer(self.fake) as server:
+      self.compute = server.service()
+      vm = self._instance('vm1')
+      # The whole zone fails from now on.
+      self.fake.add_fault('*', status=503)
+      with self.assertRaises(limits.CircuitOpenError):
+        call_tasks(vm, 'set_rescue_mode', show_progress=False)
+    # Without the breaker, each step would be tried api-retries + 1 times.
+    self.assertLess(sum(self.fake.faults.values()), config['api-retries'])
+
+
+  def test_guest_attributes_disabled(self):
+    # e.g. by the compute.disableGuestAttributesAccess organization policy.
+    self.fake.add_fault('instances.getGuestAttributes', status=403)
+    for engine in ('threads', 'asyncio'):
+      config['engine'] = engine
+      self.fake.add_instance(ZONE, f'vm-{engine}')
+      with mock.patch.object(keeper, 'SERIAL_POLL_DELAY', 0):
+        call_tasks(self._instance(f'vm-{engine}'), 'set_rescue_mode',
+                   show_progress=False)
+    self.assertEqual(self.fake.calls['instances.getSerialPortOutput'], 2)
+
+
+  def test_serial_output(self):
+    self.fake.add_instance(ZONE, 'vm1')
+    self.fake.add_serial_output(ZONE, 'vm1', 'kernel panic\n')
+    self.fake.add_serial_output(ZONE, 'vm1', 'later\n', delay=60)
+    output = self.compute.instances().getSerialPortOutput(
+      project=self.fake.project, zone=ZONE, instance='vm1').execute()
+    self.assertEqual(output['contents'], 'kernel panic\n')
+
+
+if __name__ == '__main__':
+  absltest.main()
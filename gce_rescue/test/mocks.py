@@ -17,7 +17,7 @@
 import os
 import pathlib
 import json
-from typing import List
+from typing import Dict, List, Tuple
 import googleapiclient.discovery
 from googleapiclient.http import HttpMockSequence
 
@@ -40,8 +40,10 @@ TESTDATA_PATH='test-data'
 mock_data = {
   'compute': f'{TESTDATA_PATH}/instances.json',
   'disks': f'{TESTDATA_PATH}/disks.json',
+  'disk': f'{TESTDATA_PATH}/disk.json',
   'operations': f'{TESTDATA_PATH}/operations.json',
   'serialconsole': f'{TESTDATA_PATH}/serialconsole.json',
+  'guestattributes': f'{TESTDATA_PATH}/guestattributes.json',
 }
 
 
@@ -62,3 +64,16 @@ def mock_api_object(mocks_list: List[str]):
   http = HttpMockSequence(responses)
   service = googleapiclient.discovery.build('compute', 'v1', http = http)
   return service
+
+
+def mock_api_responses(responses: List[Tuple[Dict[str, str], str]]):
+  """ Returns mock HTTP sequence Resources from (headers, content) tuples,
+  for tests that need responses not available in test-data/ """
+  http = HttpMockSequence(responses)
+  service = googleapiclient.discovery.build('compute', 'v1', http = http)
+  return service
+
+
+def ok_response(body: Dict) -> Tuple[Dict[str, str], str]:
+  """ (headers, content) of a successful response, for mock_api_responses """
+  return ({'status': '200'}, json.dumps(body))
@@ -0,0 +1,211 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Local store of the duration of each step, per zone and machine type,
+    used to predict how long an action will take (--plan and the ETA of
+    the progress bar). The store is a JSON file (timings-file):
+      {"ZONE/MACHINE_TYPE": {"STEP": [seconds, ...]}}
+    with the last MAX_SAMPLES durations of each step. Steps without samples
+    for the zone and machine type use the samples of any zone, and then
+    DEFAULT_DURATIONS.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+from time import perf_counter
+from typing import Callable, Dict, List, Optional
+
+from gce_rescue.config import get_config
+
+_logger = logging.getLogger(__name__)
+
+MAX_SAMPLES = 50
+# Typical durations (seconds), before anything was recorded.
+DEFAULT_DURATIONS = {
+  'backup': 40,
+  'stop': 20,
+  'start': 15,
+  'create_disk': 10,
+  'detach_boot': 3,
+  'detach_original': 3,
+  'detach_rescue': 3,
+  'detach_helper': 3,
+  'attach_rescue': 3,
+  'attach_original': 3,
+  'attach_helper': 3,
+  'label_boot': 1,
+  'delete_disk': 5,
+  'set_metadata': 2,
+  'restore_metadata': 35,
+}
+DEFAULT_DURATION = 5
+
+_lock = threading.Lock()
+# Durations recorded by this process and not saved yet.
+_pending: Dict[str, Dict[str, List[float]]] = {}
+# Content of the store, loaded once per process.
+_data: Optional[Dict[str, Dict[str, List[float]]]] = None
+
+
+def location_key(vm) -> str:
+  """europe-central2-a/e2-medium"""
+  return f'{vm.zone}/{vm.data["machineType"].split("/")[-1]}'
+
+
+def _read() -> Dict[str, Dict[str, List[float]]]:
+  file_name = get_config('timings-file')
+  if not file_name:
+    return {}
+  try:
+    with open(file_name, encoding='utf-8') as file:
+      return json.load(file)
+  except (FileNotFoundError, ValueError):
+    return {}
+
+
+def load() -> Dict[str, Dict[str, List[float]]]:
+  global _data
+  with _lock:
+    if _data is None:
+      _data = _read()
+    return _data
+
+
+def record(vm, step: str, seconds: float) -> None:
+  with _lock:
+    _pending.setdefault(location_key(vm), {}).setdefault(step, []).append(
+      round(seconds, 3))
+
+
+def save() -> None:
+  """Add the pending durations to the store. The file is read again first,
+  other executions may have saved their own since it was loaded."""
+  global _data
+  file_name = get_config('timings-file')
+  with _lock:
+    if not file_name or not _pending:
+      return
+    data = _read()
+    for key, steps in _pending.items():
+      for step, durations in steps.items():
+        samples = data.setdefault(key, {}).setdefault(step, [])
+        samples.extend(durations)
+        del samples[:-MAX_SAMPLES]
+    _pending.clear()
+    try:
+      os.makedirs(os.path.dirname(file_name), exist_ok=True)
+      tmp_file = f'{file_name}.{os.getpid()}.tmp'
+      with open(tmp_file, 'w', encoding='utf-8') as file:
+        json.dump(data, file)
+      os.replace(tmp_file, file_name)
+    except OSError as e:
+      _logger.info(f'Unable to save the step durations: {e}')
+    _data = data
+
+
+def wrap(vm, tasks: List[Dict]) -> List[Dict]:
+  """Tasks of the scheduler recording the duration of each step when it
+  completes."""
+  for task in tasks:
+    task['name'] = _timed(vm, task['id'], task['name'])
+  return tasks
+
+
+def _timed(vm, step: str, func: Callable) -> Callable:
+  @functools.wraps(func)
+  def _step(**kwargs):
+    start = perf_counter()
+    func(**kwargs)
+    record(vm, step, perf_counter() - start)
+  return _step
+
+
+def percentile(values: List[float], percent: int) -> float:
+  """Inclusive percentile of values, interpolated between the two closest
+  values."""
+  values = sorted(values)
+  position = (len(values) - 1) * percent / 100
+  low = int(position)
+  high = min(low + 1, len(values) - 1)
+  return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def samples(vm, step: str) -> List[float]:
+  data = load()
+  found = data.get(location_key(vm), {}).get(step)
+  if found:
+    return found
+  return [value for steps in data.values() for value in steps.get(step, [])]
+
+
+def estimates(vm, tasks: List[Dict], percent: int = 50) -> Dict[str, float]:
+  """Predicted duration of each task."""
+  result = {}
+  for task in tasks:
+    values = samples(vm, task['id'])
+    result[task['id']] = (percentile(values, percent) if values else
+                          DEFAULT_DURATIONS.get(task['id'], DEFAULT_DURATION))
+  return result
+
+
+def predict(tasks: List[Dict], durations: Dict[str, float]) -> float:
+  """Duration of the tasks graph: its longest path, as independent tasks
+  run at the same time."""
+  finish = {}
+  pending = list(tasks)
+  while pending:
+    ready = [task for task in pending
+             if all(dependency in finish for dependency in task['after'])]
+    if not ready:
+      raise ValueError('Tasks dependencies have a cycle.')
+    for task in ready:
+      finish[task['id']] = durations[task['id']] + max(
+        [finish[dependency] for dependency in task['after']], default=0)
+      pending.remove(task)
+  return max(finish.values(), default=0)
+
+
+def plan(vm, tasks: List[Dict]) -> Dict:
+  """Steps of tasks with their predicted durations, and of the whole."""
+  p50 = estimates(vm, tasks, 50)
+  p90 = estimates(vm, tasks, 90)
+  return {
+    'location': location_key(vm),
+    'steps': [{
+      'id': task['id'],
+      'after': task['after'],
+      'p50': p50[task['id']],
+      'p90': p90[task['id']],
+      'samples': len(samples(vm, task['id'])),
+    } for task in tasks],
+    'p50': predict(tasks, p50),
+    'p90': predict(tasks, p90),
+  }
+
+
+def format_duration(seconds: float) -> str:
+  """95 -> 1m35s"""
+  minutes, seconds = divmod(int(round(seconds)), 60)
+  return f'{minutes}m{seconds:02d}s' if minutes else f'{seconds}s'
+
+
+def clear() -> None:
+  """Forget the loaded store and the pending durations."""
+  global _data
+  with _lock:
+    _data = None
+    _pending.clear()
@@ -0,0 +1,121 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for timings.py."""
+
+import json
+import os
+import tempfile
+from types import SimpleNamespace
+
+from absl.testing import absltest
+
+from gce_rescue import timings
+from gce_rescue.config import config
+
+TASKS = [
+  {'id': 'stop', 'after': []},
+  {'id': 'create_disk', 'after': []},
+  {'id': 'attach_rescue', 'after': ['stop', 'create_disk']},
+]
+
+
+def _vm(zone: str = 'us-east1-b', machine_type: str = 'e2-medium'):
+  return SimpleNamespace(zone=zone, data={
+    'machineType': f'zones/{zone}/machineTypes/{machine_type}'})
+
+
+class TimingsTest(absltest.TestCase):
+
+  def setUp(self):
+    self._config = dict(config)
+    config['timings-file'] = os.path.join(
+      self.enter_context(tempfile.TemporaryDirectory()), 'timings.json')
+    timings.clear()
+    self.addCleanup(timings.clear)
+
+
+  def tearDown(self):
+    config.clear()
+    config.update(self._config)
+
+
+  def test_predict_longest_path(self):
+    self.assertEqual(timings.predict(
+      TASKS, {'stop': 20, 'create_disk': 10, 'attach_rescue': 3}), 23)
+
+
+  def test_estimates(self):
+    # No samples yet.
+    self.assertEqual(timings.estimates(_vm(), TASKS)['stop'],
+                     timings.DEFAULT_DURATIONS['stop'])
+    for seconds in (1, 2, 3, 4, 100):
+      timings.record(_vm(), 'stop', seconds)
+    timings.record(_vm('europe-west1-b'), 'create_disk', 7)
+    timings.save()
+    self.assertEqual(timings.estimates(_vm(), TASKS)['stop'], 3)
+    self.assertGreater(timings.estimates(_vm(), TASKS, 90)['stop'], 4)
+    # From other zones and machine types.
+    self.assertEqual(timings.estimates(_vm(), TASKS)['create_disk'], 7)
+
+
+  def test_save_merges(self):
+    timings.record(_vm(), 'stop', 1)
+    timings.save()
+    # Saved by another execution meanwhile.
+    with open(config['timings-file'], encoding='utf-8') as file:
+      data = json.load(file)
+    data['us-east1-b/e2-medium']['stop'].append(2)
+    with open(config['timings-file'], 'w', encoding='utf-8') as file:
+      json.dump(data, file)
+
+    timings.record(_vm(), 'stop', 3)
+    timings.save()
+    timings.clear()
+    self.assertEqual(timings.samples(_vm(), 'stop'), [1, 2, 3])
+
+    # Only the last MAX_SAMPLES are kept.
+    for _ in range(timings.MAX_SAMPLES):
+      timings.record(_vm(), 'stop', 4)
+    timings.save()
+    self.assertEqual(timings.samples(_vm(), 'stop'),
+                     [4] * timings.MAX_SAMPLES)
+
+
+  def test_wrap(self):
+    calls = []
+    tasks = timings.wrap(_vm(), [
+      {'id': 'stop', 'name': lambda vm: calls.append(vm), 'after': []}])
+    tasks[0]['name'](vm='vm1')
+    self.assertEqual(calls, ['vm1'])
+    timings.save()
+    timings.clear()
+    self.assertLen(timings.samples(_vm(), 'stop'), 1)
+
+
+  def test_percentile(self):
+    values = [5.0, 1.0, 3.0, 2.0, 4.0]
+    self.assertEqual(timings.percentile(values, 50), 3.0)
+    self.assertAlmostEqual(timings.percentile(values, 90), 4.6)
+    self.assertEqual(timings.percentile(values, 100), 5.0)
+    self.assertEqual(timings.percentile([7.0], 90), 7.0)
+
+
+  def test_format_duration(self):
+    self.assertEqual(timings.format_duration(9.6), '10s')
+    self.assertEqual(timings.format_duration(95), '1m35s')
+
+
+if __name__ == '__main__':
+  absltest.main()
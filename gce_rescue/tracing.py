@@ -0,0 +1,119 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+""" Spans of the tasks, API requests and operation waits of an execution,
+    exported in the Chrome trace event format. The file can be opened with
+    https://ui.perfetto.dev or chrome://tracing.
+    Tracing is disabled unless enable() is called, span() is then a no-op.
+"""
+
+import asyncio
+from contextlib import contextmanager
+import json
+import os
+import threading
+from time import perf_counter
+from typing import Dict, Iterator, List
+
+_tracer = None
+
+
+class Tracer:
+  """Thread-safe collection of complete ('X') trace events. Each thread,
+  or asyncio task, has its own lane (tid) in the trace."""
+
+  def __init__(self):
+    self.events: List[Dict] = []
+    self._start = perf_counter()
+    self._lanes = {}
+    self._lock = threading.Lock()
+
+  def _lane(self) -> int:
+    try:
+      task = asyncio.current_task()
+    except RuntimeError:
+      task = None
+    thread = threading.current_thread()
+    key = (thread.ident, id(task) if task else None)
+    with self._lock:
+      if key not in self._lanes:
+        self._lanes[key] = len(self._lanes) + 1
+        # Task names are only available from Python 3.8.
+        get_name = getattr(task, 'get_name', None)
+        name = get_name() if get_name else thread.name
+        self.events.append({
+          'name': 'thread_name', 'ph': 'M', 'pid': os.getpid(),
+          'tid': self._lanes[key], 'args': {'name': name}
+        })
+      return self._lanes[key]
+
+  def _now(self) -> float:
+    return (perf_counter() - self._start) * 1e6
+
+  @contextmanager
+  def span(self, name: str, cat: str, args: Dict) -> Iterator[Dict]:
+    lane = self._lane()
+    start = self._now()
+    try:
+      yield args
+    except BaseException as e:
+      args['error'] = str(e) or e.__class__.__name__
+      raise
+    finally:
+      event = {
+        'name': name, 'cat': cat, 'ph': 'X', 'pid': os.getpid(),
+        'tid': lane, 'ts': round(start, 1),
+        'dur': round(self._now() - start, 1), 'args': args
+      }
+      with self._lock:
+        self.events.append(event)
+
+  def write(self, file_name: str) -> None:
+    with self._lock:
+      events = list(self.events)
+    with open(file_name, 'w', encoding='utf-8') as file:
+      json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file,
+                default=str)
+
+
+def enable() -> Tracer:
+  global _tracer
+  _tracer = Tracer()
+  return _tracer
+
+
+def disable() -> None:
+  global _tracer
+  _tracer = None
+
+
+def get_tracer() -> Tracer:
+  return _tracer
+
+
+@contextmanager
+def span(name: str, cat: str = 'task', **args) -> Iterator[Dict]:
+  """Record the time spent in the block. The yielded dict can be updated to
+  add details to the span (e.g. number of polls)."""
+  tracer = _tracer
+  if tracer is None:
+    yield args
+    return
+  with tracer.span(name, cat, args) as span_args:
+    yield span_args
+
+
+def write(file_name: str) -> None:
+  if _tracer is not None:
+    _tracer.write(file_name)
@@ -0,0 +1,90 @@
+# Copyright 2021 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Test code for tracing.py."""
+
+import json
+import os
+import tempfile
+import threading
+
+from absl.testing import absltest
+from gce_rescue import tracing
+from gce_rescue.tasks import scheduler
+
+
+class TracingTest(absltest.TestCase):
+
+  def tearDown(self):
+    tracing.disable()
+    super().tearDown()
+
+
+  def test_disabled(self):
+    with tracing.span('stop', vm='mock_vm') as args:
+      args['polls'] = 1
+    self.assertIsNone(tracing.get_tracer())
+
+
+  def test_span(self):
+    tracer = tracing.enable()
+    with tracing.span('compute.instances.get', 'api') as args:
+      args['cached'] = True
+    with self.assertRaises(ValueError):
+      with tracing.span('stop'):
+        raise ValueError('failed')
+
+    spans = [event for event in tracer.events if event['ph'] == 'X']
+    self.assertEqual([span['name'] for span in spans],
+                     ['compute.instances.get', 'stop'])
+    self.assertEqual(spans[0]['cat'], 'api')
+    self.assertTrue(spans[0]['args']['cached'])
+    self.assertEqual(spans[1]['args']['error'], 'failed')
+    self.assertGreaterEqual(spans[1]['dur'], 0)
+
+
+  def test_scheduler_lanes(self):
+    """Each task is a span, in the lane of the thread that ran it."""
+    tracer = tracing.enable()
+    # Both threads alive at the same time, so they can't share an ident.
+    barrier = threading.Barrier(2)
+    wait = lambda: barrier.wait(timeout=5)
+    tasks = [
+      {'id': 'stop', 'name': wait, 'args': [{}], 'after': [],
+       'trace': {'vm': 'zone/mock_vm'}},
+      {'id': 'create_disk', 'name': wait, 'args': [{}], 'after': []},
+    ]
+    scheduler.run_tasks(tasks)
+    spans = {event['name']: event for event in tracer.events
+             if event['ph'] == 'X'}
+    self.assertEqual(spans['stop']['args'], {'vm': 'zone/mock_vm'})
+    self.assertNotEqual(spans['stop']['tid'], spans['create_disk']['tid'])
+    lanes = [event for event in tracer.events if event['ph'] == 'M']
+    self.assertLen(lanes, 2)
+
+
+  def test_write(self):
+    tracing.enable()
+    with tracing.span('stop'):
+      pass
+    directory = self.enter_context(tempfile.TemporaryDirectory())
+    file_name = os.path.join(directory, 'trace.json')
+    tracing.write(file_name)
+    with open(file_name, encoding='utf-8') as file:
+      trace = json.load(file)
+    self.assertIn('stop', [event['name'] for event in trace['traceEvents']])
+
+
+if __name__ == '__main__':
+  absltest.main()
@@ -16,75 +16,159 @@
 
 """ List of classes and functions to be used across the code. """
 
-from time import sleep
 import logging
-import multiprocessing
+import shutil
+import threading
 from threading import Thread
+from time import monotonic
 import sys
 from gce_rescue.config import get_config
+from gce_rescue.timings import format_duration
 
 
 _logger = logging.getLogger(__name__)
 
+class ProgressRenderer():
+  """ Print one progress bar per tracked task list (e.g. one per VM).
+  Runs in a thread of the current process and redraws only when a bar
+  changes, or every TICK seconds to animate the spinner. When the output is
+  not a terminal, one line is printed per event instead. """
+
+  TICK = 0.25
+  SIZE = 60
+
+  def __init__(self, stream=None, tty=None):
+    self.stream = stream or sys.stderr
+    self.tty = self.stream.isatty() if tty is None else tty
+    self._bars = {}
+    self._deadlines = {}
+    self._spin = 0
+    self._drawn = 0
+    self._changed = False
+    self._running = False
+    self._cond = threading.Condition()
+    self._thread = None
+
+  def add(self, name: str, total: int, eta: float = None) -> None:
+    """ eta: predicted seconds to complete the bar, shown next to it. """
+    with self._cond:
+      self._bars[name] = [0, total]
+      if eta is not None:
+        self._deadlines[name] = monotonic() + eta
+    self._update(name)
+
+  def set(self, name: str, count: int) -> None:
+    with self._cond:
+      bar = self._bars[name]
+      if bar[0] == min(count, bar[1]):
+        return
+      bar[0] = min(count, bar[1])
+    self._update(name)
+
+  def count(self, name: str) -> int:
+    return self._bars[name][0]
+
+  def start(self) -> None:
+    if not self.tty or self._running:
+      return
+    self._running = True
+    self._thread = Thread(target=self._run, daemon=True)
+    self._thread.start()
+
+  def stop(self) -> None:
+    if self._running:
+      with self._cond:
+        self._running = False
+        self._cond.notify()
+      self._thread.join()
+    if self.tty:
+      self._draw()
+
+  def _update(self, name: str) -> None:
+    if not self.tty:
+      count, total = self._bars[name]
+      print(f'│   └── {self._label(name)}Progress {count}/{total}'
+        f'{self._eta(name, count, total)}', file=self.stream, flush=True)
+      return
+    with self._cond:
+      self._changed = True
+      self._cond.notify()
+
+  def _run(self) -> None:
+    while True:
+      with self._cond:
+        if not self._changed:
+          self._cond.wait(timeout=self.TICK)
+        if not self._running:
+          return
+        self._changed = False
+        self._spin += 1
+      self._draw()
+
+  def _label(self, name: str) -> str:
+    return f'{name} ' if name else ''
+
+  def _eta(self, name: str, count: int, total: int) -> str:
+    deadline = self._deadlines.get(name)
+    if deadline is None or count == total:
+      return ''
+    return f' ETA {format_duration(max(deadline - monotonic(), 0))}'
+
+  def _draw(self) -> None:
+    chars = ['-', '|', '/', '|', '\\']
+    with self._cond:
+      bars = [(name, list(bar)) for name, bar in self._bars.items()]
+    # Keep the bars inside the terminal, bars in progress first.
+    max_lines = max(shutil.get_terminal_size().lines - 2, 1)
+    hidden = 0
+    if len(bars) > max_lines:
+      bars.sort(key=lambda bar: not 0 < bar[1][0] < bar[1][1])
+      hidden = len(bars) - max_lines + 1
+      bars = bars[:max_lines - 1]
+    lines = []
+    for name, (count, total) in bars:
+      x = int(self.SIZE * count / total) if total else self.SIZE
+      loading = '█' if count == total else chars[self._spin % len(chars)]
+      lines.append(
+        f'│   └── {self._label(name)}Progress {count}/{total} '
+        f'[{"█" * x}{loading}{"." * (self.SIZE - x)}]'
+        f'{self._eta(name, count, total)}'
+      )
+    if hidden:
+      lines.append(f'│   └── ... and {hidden} more')
+    # Move back to the first line of the previous draw and overwrite it.
+    output = f'\x1b[{self._drawn}F\x1b[J' if self._drawn else ''
+    output += ''.join(f'{line}\n' for line in lines)
+    self._drawn = len(lines)
+    print(output, end='', file=self.stream, flush=True)
+
+
 class Tracker():
-  """ Track tasks using multiprocessing and print progress bar. """
+  """ Track the tasks of a single task list and print its progress bar. """
 
-  def __init__(self, target):
+  def __init__(self, target, name='', renderer=None, eta=None):
     self.target = target
-    self._pivot = multiprocessing.Value('i', 1)
-    self._proc = None
+    self.name = name
+    self.eta = eta
+    self._own_renderer = renderer is None
+    self._renderer = renderer or ProgressRenderer()
 
   def start(self):
-    self._proc = multiprocessing.Process(target=self._run)
-    self._proc.start()
-    print('┌── Configuring...')
+    if self._own_renderer:
+      print('┌── Configuring...')
+    self._renderer.add(self.name, self.target, eta=self.eta)
+    self._renderer.start()
 
   def advance(self, step=None):
     if not step:
       step = 1
-    self._pivot.value += step
+    self._renderer.set(self.name, self._renderer.count(self.name) + step)
 
   def finish(self):
-    self._pivot.value = self.target
-    self._proc.join()
-    sleep(0.5)
-    print('├── Configurations finished.')
-
-  def _loading(self):
-    chars = ['-', '|', '/', '|', '\\']
-    i = 0
-    while True:
-      yield chars[i]
-      i += 1
-      if i == len(chars):
-        i = 0
-
-  def _run(self):
-    self._gen = self._loading()
-    while self._pivot.value < self.target:
-      try:
-        sleep(0.001)
-        self._print()
-      except Exception as exc:
-        raise f'{exc}: {self._pivot.value} = {self.target}'
-
-    self._print()
-    print('\r')
-
-  def _print(self):
-    size = 60
-    loading = next(self._gen)
-    if self._pivot.value == self.target:
-      loading = '█'
-    count = self._pivot.value
-    total = self.target
-    x = int(size * self._pivot.value / self.target)
-    progress = '█' * x
-    bar = '.' * (size-x)
-    print(f'│   └── Progress {count}/{total} [{progress}{loading}{bar}]',
-      end='\r',
-      file=sys.stderr,
-      flush=True)
+    self._renderer.set(self.name, self.target)
+    if self._own_renderer:
+      self._renderer.stop()
+      print('├── Configurations finished.')
 
 
 class ThreadHandler(Thread):
@@ -15,7 +15,9 @@
 """ Multitask test code """
 
 from absl.testing import absltest
+from gce_rescue.utils import ProgressRenderer, Tracker
 from gce_rescue.utils import ThreadHandler as Handler
+import io
 import time
 
 OUTPUT1 = 'task1 done'
@@ -60,5 +62,47 @@ class MultitasksTest(absltest.TestCase):
     self.assertTrue(MultitasksTest.status['task2_done'])
 
 
+class ProgressTest(absltest.TestCase):
+
+  def test_non_tty_one_line_per_event(self):
+    stream = io.StringIO()
+    renderer = ProgressRenderer(stream=stream, tty=False)
+    tracker = Tracker(2, name='vm1', renderer=renderer)
+    tracker.start()
+    tracker.advance()
+    tracker.finish()
+    self.assertEqual(stream.getvalue().splitlines(), [
+      '│   └── vm1 Progress 0/2',
+      '│   └── vm1 Progress 1/2',
+      '│   └── vm1 Progress 2/2',
+    ])
+
+
+  def test_eta(self):
+    stream = io.StringIO()
+    renderer = ProgressRenderer(stream=stream, tty=False)
+    tracker = Tracker(2, name='vm1', renderer=renderer, eta=95)
+    tracker.start()
+    tracker.finish()
+    self.assertRegex(stream.getvalue().splitlines()[0],
+                     r'Progress 0/2 ETA 1m3\ds$')
+    self.assertEndsWith(stream.getvalue().splitlines()[1], 'Progress 2/2')
+
+
+  def test_tty_multiple_bars(self):
+    stream = io.StringIO()
+    renderer = ProgressRenderer(stream=stream, tty=True)
+    renderer.start()
+    renderer.add('vm1', 2)
+    renderer.add('vm2', 4)
+    renderer.set('vm1', 2)
+    renderer.set('vm2', 1)
+    renderer.stop()
+    last_draw = stream.getvalue().split('\x1b[J')[-1].splitlines()
+    self.assertLen(last_draw, 2)
+    self.assertStartsWith(last_draw[0], '│   └── vm1 Progress 2/2 [')
+    self.assertStartsWith(last_draw[1], '│   └── vm2 Progress 1/4 [')
+
+
 if __name__ == '__main__':
   absltest.main()